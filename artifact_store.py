@@ -0,0 +1,170 @@
+"""
+Store of prepared deploy artifacts.
+
+After a successful deploy, the workspace is captured in the background
+under config.ARTIFACT_STORE_PATH/<sha256 of the archive>: the shipped
+files, extracted and hoisted, and the installed dependencies, along with
+the analysis.  Telegram's file_unique_id is mapped to that hash, so a user
+re-sending the same ZIP skips the download too.  A known artifact becomes
+a new workspace by copying the project files and hard-link cloning the
+venv; nothing is extracted, analyzed or installed again.  Artifacts are
+evicted least recently used first once they exceed ARTIFACT_STORE_MAX_MB.
+"""
+import asyncio
+import json
+import os
+import shutil
+import time
+import uuid
+import config
+from utils.json_store import JsonSnapshotFile
+from utils.logger import get_logger
+from venv_cache import clone_venv, tree_size
+
+logger = get_logger(__name__)
+
+_INDEX_FILE = "index.json"
+# Per-bot files that must never be shared between workspaces
+_WORKSPACE_ONLY = {"venv", "space_config.json", "__pycache__"}
+# Shipped directories the manifest skips but a materialized workspace needs
+_DEPENDENCY_DIRS = ("node_modules",)
+
+
+class ArtifactStore:
+    def __init__(self, root: str = None, max_bytes: int = None):
+        self.root = os.path.abspath(root or config.ARTIFACT_STORE_PATH)
+        self.max_bytes = max_bytes if max_bytes is not None else config.ARTIFACT_STORE_MAX_MB * 1024 * 1024
+        self.index_path = os.path.join(self.root, _INDEX_FILE)
+        self._index_file = JsonSnapshotFile(self.index_path)
+        self.index = self._load_index()
+        self._locks = {}
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("artifacts", {})
+        index.setdefault("uploads", {})
+        return index
+
+    async def _save_index(self):
+        await asyncio.to_thread(self._index_file.save, *self._index_file.snapshot(self.index))
+
+    def lookup(self, file_unique_id: str):
+        """Archive hash of a Telegram upload we already hold an artifact for"""
+        archive_hash = self.index["uploads"].get(file_unique_id)
+        return archive_hash if archive_hash in self.index["artifacts"] else None
+
+    async def remember_upload(self, file_unique_id: str, archive_hash: str):
+        if archive_hash in self.index["artifacts"] and self.index["uploads"].get(file_unique_id) != archive_hash:
+            self.index["uploads"][file_unique_id] = archive_hash
+            await self._save_index()
+
+    async def materialize(self, archive_hash: str, workspace: str):
+        """Recreate a stored artifact at workspace and return its analysis, or None if unknown"""
+        entry = self.index["artifacts"].get(archive_hash)
+        if entry is None:
+            return None
+        lock = self._locks.setdefault(archive_hash, asyncio.Lock())
+        async with lock:
+            artifact_path = os.path.join(self.root, archive_hash)
+            if archive_hash not in self.index["artifacts"] or not os.path.isdir(artifact_path):
+                self.index["artifacts"].pop(archive_hash, None)
+                return None
+            try:
+                await asyncio.to_thread(_materialize, artifact_path, workspace)
+            except OSError as e:
+                logger.error(f"Failed to materialize artifact {archive_hash[:12]}: {str(e)}")
+                await asyncio.to_thread(shutil.rmtree, workspace, True)
+                return None
+            entry["last_used"] = time.time()
+            await self._save_index()
+        logger.info(f"Deployed from stored artifact {archive_hash[:12]}")
+        return entry["analysis"]
+
+    async def store(self, archive_hash: str, workspace: str, analysis: dict, files: list):
+        """Keep files (relative paths) and the venv of a prepared workspace as the artifact for archive_hash
+
+        Runs after the deploy has answered. Failures are logged, never
+        raised: the deploy itself already succeeded.
+        """
+        if archive_hash in self.index["artifacts"]:
+            return
+        lock = self._locks.setdefault(archive_hash, asyncio.Lock())
+        async with lock:
+            if archive_hash in self.index["artifacts"]:
+                return
+            artifact_path = os.path.join(self.root, archive_hash)
+            staging = os.path.join(self.root, f".staging-{uuid.uuid4().hex}")
+            try:
+                size = await asyncio.to_thread(_capture, workspace, files, staging, artifact_path)
+            except OSError as e:
+                logger.error(f"Failed to store artifact {archive_hash[:12]}: {str(e)}")
+                await asyncio.to_thread(shutil.rmtree, staging, True)
+                await asyncio.to_thread(shutil.rmtree, artifact_path, True)
+                return
+            self.index["artifacts"][archive_hash] = {
+                "analysis": analysis,
+                "size": size,
+                "last_used": time.time()
+            }
+            await self.evict(keep=archive_hash)
+
+    async def evict(self, keep: str = None):
+        """Drop least recently used artifacts until the store fits its budget"""
+        artifacts = self.index["artifacts"]
+        total = sum(entry.get("size", 0) for entry in artifacts.values())
+        for archive_hash in sorted(artifacts, key=lambda h: artifacts[h].get("last_used", 0)):
+            if total <= self.max_bytes:
+                break
+            if archive_hash == keep or (archive_hash in self._locks and self._locks[archive_hash].locked()):
+                continue
+            logger.info(f"Evicting deploy artifact {archive_hash[:12]}")
+            await asyncio.to_thread(shutil.rmtree, os.path.join(self.root, archive_hash), True)
+            total -= artifacts.pop(archive_hash).get("size", 0)
+            self._locks.pop(archive_hash, None)
+        self.index["uploads"] = {
+            file_id: archive_hash for file_id, archive_hash in self.index["uploads"].items()
+            if archive_hash in artifacts
+        }
+        await self._save_index()
+
+
+def _capture(workspace: str, files: list, staging: str, artifact_path: str) -> int:
+    """Copy a workspace's files into staging and move it into place (blocking)"""
+    tree = os.path.join(staging, "tree")
+    for rel in files:
+        if rel.split("/", 1)[0] in _WORKSPACE_ONLY:
+            continue
+        source = os.path.join(workspace, rel)
+        target = os.path.join(tree, rel)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.islink(source):
+            os.symlink(os.readlink(source), target)
+        else:
+            shutil.copy2(source, target)
+    os.makedirs(tree, exist_ok=True)
+    for name in _DEPENDENCY_DIRS:
+        source = os.path.join(workspace, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(tree, name), symlinks=True)
+    shutil.rmtree(artifact_path, ignore_errors=True)
+    os.rename(staging, artifact_path)
+    # Cloned in place: venv scripts embed their absolute path. The index
+    # entry is only written after this returns, so a half-made artifact is
+    # never used
+    venv_path = os.path.join(workspace, "venv")
+    if os.path.isdir(venv_path):
+        clone_venv(venv_path, os.path.join(artifact_path, "venv"))
+    return tree_size(artifact_path)
+
+
+def _materialize(artifact_path: str, workspace: str):
+    """Lay an artifact out as a new workspace (blocking)"""
+    # Project files are copied: bots may write into their workspace
+    shutil.copytree(os.path.join(artifact_path, "tree"), workspace, symlinks=True)
+    venv_path = os.path.join(artifact_path, "venv")
+    if os.path.isdir(venv_path):
+        clone_venv(venv_path, os.path.join(workspace, "venv"))
@@ -4,70 +4,263 @@ import zipfile
 import json
 import subprocess
 import uuid
-import docker
 import re
+import copy
+import random
+import time
+import threading
+import shutil
+import signal
+import socket
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import config
+from utils import crypto
 from utils.logger import get_logger
+from utils.json_store import JsonSnapshotFile
+from venv_cache import VenvCache, clone_venv, create_venv, install_requirements
+from artifact_store import ArtifactStore
+from workspace_scanner import scan_manifest, relative_manifest, hoist_root, file_sha256, changed_files, AnalysisCache
+from docker_backend import DockerBackend
+from image_cache import ImageCache
+from log_collector import LogCollector
+from resource_sampler import ResourceSampler, read_proc_stat, read_cmdline
 
 logger = get_logger(__name__)
 
+# Fields needed to launch a bot; keeps token lookups off the full document
+TOKEN_PROJECTION = {"_id": 0, "bot_token": 1, "token_key_id": 1, "token_configured": 1}
+# Files a bot's archive put in its workspace; updates only ever delete these
+SHIPPED_FILES = ".space_files.json"
+
 class BotManager:
-    def __init__(self):
-        self.docker_client = docker.from_env() if config.DOCKER_ENABLED else None
+    def __init__(self, db=None):
+        self.db = db
+        self.docker = DockerBackend() if config.DOCKER_ENABLED else None
+        self.image_cache = ImageCache(self.docker) if self.docker is not None else None
         self.running_processes = {}
-        self.port_manager = PortManager()
+        self.port_allocator = PortAllocator()
+        self.venv_cache = VenvCache()
+        self.workspace_index = WorkspaceIndex()
+        self.analysis_cache = AnalysisCache()
+        self.artifacts = ArtifactStore()
+        self.log_collector = LogCollector()
+        self.supervisor = ProcessSupervisor(self)
+        self.sampler = ResourceSampler(self)
+        self.process_registry = ProcessRegistry()
+        self.starting = set()
+        self.updating = set()
+        self.shutting_down = False
+        self._reconcile_lock = asyncio.Lock()
+        self._reconcile_task = None
+        # Work a deploy hands off after answering the user (artifact capture)
+        self._background = set()
+        # Filesystem-heavy deploy stages run here, never on the event loop
+        self.io_executor = ThreadPoolExecutor(
+            max_workers=config.DEPLOY_IO_WORKERS,
+            thread_name_prefix="deploy-io"
+        )
+        
+    async def initialize(self):
+        """Load persistent state needed before serving requests"""
+        await self.run_blocking(self.workspace_index.load)
+        await self.run_blocking(self.process_registry.load)
+        # Upload temp dirs left behind by a crash
+        await self.run_blocking(shutil.rmtree, config.TEMP_PATH, True)
+        await self.load_port_assignments()
+        if self.docker is not None and not await self.docker.start():
+            self.docker = None
+            self.image_cache = None
+        self.sampler.start()
+        # First pass resumes the fleet right away, later passes fix drift
+        self._reconcile_task = asyncio.ensure_future(self._reconcile_forever())
+        
+    async def stop_fleet(self, timeout: float = None):
+        """Stop every supervised bot against one global deadline
+        
+        All bots get SIGTERM (containers a docker stop) at once, sent to
+        each host bot's whole process group; whatever is still alive at the
+        deadline, children included, is killed. Final statuses go to the
+        DB in one bulk write, flagged resume_pending so the next start
+        brings the same bots back.
+        """
+        timeout = config.SHUTDOWN_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + max(0.0, timeout - config.SHUTDOWN_KILL_GRACE)
+        self.shutting_down = True
+        if self._reconcile_task is not None:
+            self._reconcile_task.cancel()
+            self._reconcile_task = None
+            
+        stopped = list(self.supervisor.pending_restarts)
+        for task in self.supervisor.pending_restarts.values():
+            task.cancel()
+        self.supervisor.pending_restarts.clear()
+        
+        processes = {}
+        for bot_id, proc_info in self.running_processes.items():
+            proc_info["stopping"] = True
+            processes[bot_id] = proc_info["process"]
+        if not processes and not stopped:
+            return
+        logger.info(f"Stopping {len(processes)} bots (deadline {timeout:.0f}s)")
+        
+        containers = [p.container_id for p in processes.values() if hasattr(p, "container_id")]
+        if containers:
+            grace = int(max(0, deadline - time.monotonic()))
+            asyncio.ensure_future(self.docker.stop_many(containers, timeout=grace))
+        # Groups are looked up first: once a bot exits its pid no longer
+        # leads to children it left behind
+        groups = set()
+        for process in processes.values():
+            if not hasattr(process, "container_id"):
+                try:
+                    groups.add(os.getpgid(process.pid))
+                except ProcessLookupError:
+                    pass
+        groups.discard(os.getpgrp())
+        for pgid in groups:
+            try:
+                os.killpg(pgid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+                
+        waiters = {asyncio.ensure_future(p.wait()): bot_id for bot_id, p in processes.items()}
+        _, pending = await asyncio.wait(waiters, timeout=max(0.0, deadline - time.monotonic()))
+        if pending:
+            logger.warning(f"{len(pending)} bots ignored SIGTERM, killing them")
+            for waiter in pending:
+                process = processes[waiters[waiter]]
+                if hasattr(process, "container_id"):
+                    process.kill()
+        for pgid in groups:
+            try:
+                os.killpg(pgid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        if pending:
+            await asyncio.wait(pending, timeout=config.SHUTDOWN_KILL_GRACE)
+            
+        stopped += list(processes)
+        self.running_processes.clear()
+        for bot_id in stopped:
+            self.process_registry.remove(bot_id)
+        await self.run_blocking(self.process_registry.save, *self.process_registry.snapshot())
+        
+        if self.db is not None:
+            try:
+                await self.db.bulk_set_bot_status(
+                    {bot_id: "stopped" for bot_id in stopped},
+                    {"resume_pending": True}
+                )
+            except Exception as e:
+                logger.error(f"Failed to record final bot statuses: {str(e)}")
+        logger.info(f"Fleet stopped: {len(stopped)} bots")
+        
+    async def close(self):
+        """Release background tasks and the Docker connection"""
+        if self._reconcile_task is not None:
+            self._reconcile_task.cancel()
+            self._reconcile_task = None
+        for task in self._background:
+            task.cancel()
+        self.sampler.stop()
+        if self.docker is not None:
+            await self.docker.close()
+        
+    async def load_port_assignments(self):
+        """Rebuild the port bitmap from every bot's persisted config"""
+        def read_ports():
+            ports = []
+            for bot_id in list(self.workspace_index.paths):
+                bot_config = self.workspace_index.read_config(bot_id)
+                if bot_config and bot_config.get('port'):
+                    ports.append(bot_config['port'])
+            return ports
+            
+        ports = await self.run_blocking(read_ports)
+        self.port_allocator.load(ports)
+        logger.info(f"Port allocator loaded {len(ports)} assigned ports")
+        
+    def run_in_background(self, coro):
+        """Run coro without waiting for it; close() cancels what is left"""
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+        
+    async def run_blocking(self, func, *args):
+        """Run a blocking callable in the deploy I/O pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.io_executor, func, *args)
         
-    async def deploy_bot(self, user_id: int, zip_path: str):
-        """Deploy a bot from ZIP file with enhanced analysis"""
+    async def deploy_bot(self, user_id: int, zip_path: str = None, progress=None,
+                         archive_hash: str = None, file_unique_id: str = None):
+        """Deploy a bot from ZIP file with enhanced analysis
+        
+        progress, if given, is an async callable taking (stage, done, total).
+        An archive already in the artifact store (by archive_hash, or the
+        hash of zip_path) is materialized instead of rebuilt, so zip_path may
+        be None when archive_hash is known.  The caller owns zip_path.
+        """
+        port = None
+        extract_path = None
+        deployed = False
+        capture = False
         try:
             bot_id = str(uuid.uuid4())
             extract_path = f"{config.BOTS_PATH}/{user_id}/{bot_id}"
             
-            # Create directories
-            os.makedirs(extract_path, exist_ok=True)
-            
-            # Extract ZIP file
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_path)
+            if archive_hash is None:
+                archive_hash = await self.run_blocking(file_sha256, zip_path)
                 
-            # Enhanced bot analysis with module support
-            analysis_result = await self.analyze_bot_structure_enhanced(extract_path)
-            
-            if not analysis_result['success']:
-                return {"success": False, "error": analysis_result['error']}
+            analysis = await self.artifacts.materialize(archive_hash, extract_path)
+            if analysis is not None:
+                if progress:
+                    await progress("reuse", 1, 1)
+            elif zip_path is None:
+                return {"success": False, "error": "This upload is no longer cached", "artifact_missing": True}
+            else:
+                build_result = await self.build_workspace(zip_path, extract_path, archive_hash, progress)
+                if not build_result["success"]:
+                    return build_result
+                analysis = build_result["analysis"]
+                capture = True
                 
-            analysis = analysis_result['analysis']
+            if file_unique_id:
+                await self.artifacts.remember_upload(file_unique_id, archive_hash)
+                
+            analysis = copy.deepcopy(analysis)
             bot_type = analysis['bot_type']
-            
-            # Install dependencies
-            install_result = await self.install_dependencies(extract_path, bot_type, analysis)
-            
-            if not install_result["success"]:
-                return {"success": False, "error": f"Dependency installation failed: {install_result['error']}"}
                 
             # Create bot configuration
+            port = self.port_allocator.allocate()
             bot_config = {
                 "bot_id": bot_id,
                 "user_id": user_id,
                 "bot_type": bot_type,
                 "path": extract_path,
-                "port": await self.port_manager.get_available_port(),
+                "port": port,
                 "status": "created",
                 "name": self.extract_bot_name(extract_path, analysis),
                 "start_method": analysis.get('start_method', 'direct'),
                 "module_name": analysis.get('module_name'),
                 "start_script": analysis.get('start_script'),
-                "main_file": analysis.get('main_file')
+                "main_file": analysis.get('main_file'),
+                "archive_sha256": archive_hash
             }
             
             # Save configuration
-            config_path = f"{extract_path}/space_config.json"
-            with open(config_path, 'w') as f:
-                json.dump(bot_config, f)
-                
-            # Clean up ZIP file
-            os.remove(zip_path)
+            shipped = await self.run_blocking(self.record_shipped_files, extract_path)
+            await self.run_blocking(self.write_bot_config, extract_path, bot_config)
+            self.workspace_index.add(bot_id, extract_path)
+            await self.run_blocking(self.workspace_index.save, *self.workspace_index.snapshot())
+            deployed = True
+            
+            if capture:
+                # Only shipped files are kept, so nothing the bot writes
+                # into its workspace later can end up in the artifact
+                self.run_in_background(self.artifacts.store(archive_hash, extract_path, analysis, shipped))
             
             return {
                 "success": True,
@@ -80,20 +273,456 @@ class BotManager:
         except Exception as e:
             logger.error(f"Bot deployment failed: {str(e)}")
             return {"success": False, "error": str(e)}
+        finally:
+            # Undo a deploy that failed part-way
+            if not deployed:
+                if port is not None:
+                    self.port_allocator.release(port)
+                if extract_path is not None:
+                    await self.run_blocking(shutil.rmtree, extract_path, True)
 
+    async def build_workspace(self, zip_path: str, extract_path: str, archive_hash: str,
+                              progress=None, install: bool = True):
+        """Extract, analyze and (unless install is False) install an archive into extract_path"""
+        # Extract ZIP file in the I/O pool. The worker only publishes its
+        # latest count; one consumer on the loop forwards the newest state,
+        # so progress edits never pile up or arrive out of order
+        loop = asyncio.get_running_loop()
+        state = {"latest": None, "finished": False}
+        wake = asyncio.Event()
+        
+        def report(done, total):
+            state["latest"] = (done, total)
+            loop.call_soon_threadsafe(wake.set)
+            
+        async def forward():
+            applied = None
+            while True:
+                await wake.wait()
+                wake.clear()
+                # Read before latest: once finished, latest is the final state
+                finished = state["finished"]
+                latest = state["latest"]
+                if latest is not None and latest != applied:
+                    applied = latest
+                    await progress("extract", *latest)
+                if finished:
+                    return
+                    
+        consumer = asyncio.ensure_future(forward()) if progress else None
+        try:
+            await self.run_blocking(self.extract_archive, zip_path, extract_path, report if progress else None)
+        finally:
+            if consumer is not None:
+                state["finished"] = True
+                wake.set()
+                await consumer
+                
+        if progress:
+            await progress("analyze", 0, 1)
+            
+        # Enhanced bot analysis with module support, once per distinct archive
+        analysis = self.analysis_cache.peek(archive_hash)
+        if analysis is None:
+            analysis = await self.run_blocking(self.analysis_cache.load, archive_hash)
+            if analysis is not None:
+                self.analysis_cache.remember(archive_hash, analysis)
+        if analysis is None:
+            analysis_result = await self.analyze_bot_structure_enhanced(extract_path)
+            
+            if not analysis_result['success']:
+                return {"success": False, "error": analysis_result['error']}
+                
+            analysis = analysis_result['analysis']
+            self.analysis_cache.remember(archive_hash, analysis)
+            await self.run_blocking(self.analysis_cache.save, archive_hash, analysis)
+        else:
+            logger.info(f"Reusing analysis of archive {archive_hash[:12]}")
+            
+        await self.run_blocking(self.prepare_workspace, extract_path, analysis)
+        
+        if not install:
+            return {"success": True, "analysis": analysis}
+            
+        # Install dependencies
+        if progress:
+            await progress("install", 0, 1)
+        install_result = await self.install_dependencies(extract_path, analysis['bot_type'], analysis)
+        
+        if not install_result["success"]:
+            return {"success": False, "error": f"Dependency installation failed: {install_result['error']}"}
+            
+        return {"success": True, "analysis": analysis}
+
+    async def update_bot(self, bot_id: str, zip_path: str, progress=None):
+        """Apply a new archive to an existing bot in place
+        
+        Only files whose content changed are written and files dropped from
+        the archive are removed. The venv is kept unless requirements.txt
+        changed. Everything is prepared while the old process keeps running;
+        a running bot is then restarted with the same bot_id, port and token.
+        """
+        bot_config = await self.load_bot_config(bot_id)
+        if not bot_config:
+            return {"success": False, "error": "Bot configuration not found"}
+        if bot_id in self.updating:
+            return {"success": False, "error": "An update for this bot is already in progress"}
+            
+        self.updating.add(bot_id)
+        path = bot_config["path"]
+        staging = f"{path}.update-{uuid.uuid4().hex[:8]}"
+        swap = None
+        try:
+            archive_hash = await self.run_blocking(file_sha256, zip_path)
+            if archive_hash == bot_config.get("archive_sha256"):
+                return {"success": True, "changed": [], "removed": [], "restarted": False}
+                
+            build_result = await self.build_workspace(zip_path, staging, archive_hash, progress, install=False)
+            if not build_result["success"]:
+                return build_result
+            analysis = copy.deepcopy(build_result["analysis"])
+            
+            plan = await self.run_blocking(self.plan_update, staging, path)
+            deps = await self.prepare_update_dependencies(
+                bot_config, analysis, staging,
+                any(rel in ("requirements.txt", "package.json") for rel in plan["changed"])
+            )
+            if not deps["success"]:
+                return {"success": False, "error": f"Dependency installation failed: {deps['error']}"}
+                
+            # Stopping, moving files and restarting must not be cut off halfway
+            # by the deploy timeout, so that part finishes on its own
+            swap = asyncio.ensure_future(self.swap_in_update(
+                bot_config, staging, plan, deps, analysis, archive_hash, progress
+            ))
+            return await asyncio.shield(swap)
+            
+        except Exception as e:
+            logger.error(f"Bot update failed for {bot_id}: {str(e)}")
+            return {"success": False, "error": str(e)}
+        finally:
+            if swap is None:
+                await self.finish_update(bot_id, staging)
+
+    async def finish_update(self, bot_id: str, staging: str):
+        self.updating.discard(bot_id)
+        await self.run_blocking(shutil.rmtree, staging, True)
+
+    async def swap_in_update(self, bot_config: dict, staging: str, plan: dict, deps: dict,
+                             analysis: dict, archive_hash: str, progress=None):
+        """Stop the bot, move the prepared update into place and restart it
+        
+        Whatever fails once the bot is stopped, the previous files, venv and
+        config are put back and a bot that was running is started again.
+        """
+        bot_id = bot_config["bot_id"]
+        path = bot_config["path"]
+        previous = copy.deepcopy(bot_config)
+        journal = {"backup": os.path.join(staging, ".previous"), "written": [], "removed": [], "venv": None}
+        reinstall = bool(deps.get("reinstall"))
+        was_running = False
+        try:
+            if progress:
+                await progress("apply", 0, 1)
+            was_running = bot_id in self.running_processes
+            
+            # Keep reconciliation from restarting the bot while its files move
+            self.starting.add(bot_id)
+            try:
+                if was_running:
+                    stop_result = await self.stop_bot(bot_id)
+                    if not stop_result["success"]:
+                        was_running = False
+                        return stop_result
+                else:
+                    self.supervisor.cancel_restart(bot_id)
+                    
+                await self.run_blocking(self.apply_update, staging, path, plan, deps.get("venv"), journal)
+                if deps.get("delta"):
+                    await self.run_blocking(self.preserve_venv, path, journal)
+                    deps = await self.install_python_delta(path)
+                elif reinstall:
+                    deps = await self.install_dependencies(path, analysis['bot_type'], analysis)
+                if not deps["success"]:
+                    await self.roll_back_update(previous, journal, reinstall)
+                    return {"success": False, "error": f"Dependency installation failed, previous version kept: {deps['error']}"}
+                    
+                bot_config.update({
+                    "bot_type": analysis['bot_type'],
+                    "name": self.extract_bot_name(path, analysis),
+                    "start_method": analysis.get('start_method', 'direct'),
+                    "module_name": analysis.get('module_name'),
+                    "start_script": analysis.get('start_script'),
+                    "main_file": analysis.get('main_file'),
+                    "archive_sha256": archive_hash
+                })
+                await self.run_blocking(self.write_bot_config, path, bot_config)
+            finally:
+                self.starting.discard(bot_id)
+                
+            if was_running:
+                start_result = await self.start_bot(bot_id)
+                if not start_result["success"]:
+                    await self.roll_back_update(previous, journal, reinstall)
+                    return {"success": False, "error": f"The updated bot failed to start, previous version restored: {start_result['error']}"}
+                    
+            logger.info(
+                f"Updated bot {bot_id}: {len(plan['changed'])} files changed, "
+                f"{len(plan['removed'])} removed"
+            )
+            return {
+                "success": True,
+                "changed": plan["changed"],
+                "removed": plan["removed"],
+                "restarted": was_running,
+                "analysis": analysis
+            }
+        except Exception as e:
+            logger.error(f"Bot update failed for {bot_id}: {str(e)}")
+            try:
+                await self.roll_back_update(previous, journal, reinstall)
+            except Exception as rollback_error:
+                logger.error(f"Rolling back the update of {bot_id} failed: {str(rollback_error)}")
+            return {"success": False, "error": str(e)}
+        finally:
+            if was_running and bot_id not in self.running_processes:
+                restart = await self.start_bot(bot_id)
+                if not restart["success"]:
+                    logger.error(f"Failed to restart {bot_id} after a failed update: {restart['error']}")
+            await self.finish_update(bot_id, staging)
+            
+    async def roll_back_update(self, previous: dict, journal: dict, reinstalled: bool = False):
+        """Put a bot's previous files, venv and config back after a failed update"""
+        path = previous["path"]
+        logger.warning(f"Rolling back the update of {previous['bot_id']}")
+        await self.run_blocking(self.restore_update_backup, path, journal)
+        await self.run_blocking(self.write_bot_config, path, previous)
+        if reinstalled:
+            await self.install_dependencies(path, previous['bot_type'], {})
+            
+    def plan_update(self, staging: str, path: str) -> dict:
+        """Work out which files an update writes and removes (blocking)"""
+        files = {
+            rel: size for rel, size in scan_manifest(staging)["files"].items()
+            if rel not in (SHIPPED_FILES, "space_config.json")
+        }
+        shipped = self.read_shipped_files(path)
+        return {
+            "files": sorted(files),
+            "changed": changed_files(staging, files, path),
+            # Only files we shipped before; anything else was written by the bot
+            "removed": sorted(set(shipped) - set(files))
+        }
+
+    def apply_update(self, staging: str, path: str, plan: dict, venv_source: str, journal: dict):
+        """Move changed files into the workspace and swap in a new venv (blocking)
+        
+        Everything replaced or removed is moved to journal["backup"] first
+        and logged in journal, so restore_update_backup can undo it.
+        """
+        backup = journal["backup"]
+        for rel in [SHIPPED_FILES] + plan["changed"]:
+            target = os.path.join(path, rel)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            self._back_up(path, rel, backup)
+            journal["written"].append(rel)
+            if rel != SHIPPED_FILES:
+                os.replace(os.path.join(staging, rel), target)
+        for rel in plan["removed"]:
+            if self._back_up(path, rel, backup):
+                journal["removed"].append(rel)
+                
+        if venv_source:
+            self.preserve_venv(path, journal, clone=False)
+            # Cloned rather than moved: venv scripts embed their own path
+            clone_venv(venv_source, os.path.join(path, "venv"))
+            
+        self.record_shipped_files(path, plan["files"])
+        
+    def preserve_venv(self, path: str, journal: dict, clone: bool = True):
+        """Move the bot's venv to the backup, leaving a clone in place unless clone=False (blocking)"""
+        current = os.path.join(path, "venv")
+        if not os.path.isdir(current) or journal["venv"]:
+            return
+        saved = os.path.join(journal["backup"], "venv")
+        os.makedirs(journal["backup"], exist_ok=True)
+        os.rename(current, saved)
+        journal["venv"] = saved
+        if clone:
+            clone_venv(saved, current)
+            
+    def restore_update_backup(self, path: str, journal: dict):
+        """Undo apply_update and preserve_venv from their journal (blocking)"""
+        backup = journal["backup"]
+        for rel in reversed(journal["written"]):
+            target = os.path.join(path, rel)
+            saved = os.path.join(backup, rel)
+            if os.path.lexists(saved):
+                os.replace(saved, target)
+            else:
+                try:
+                    os.remove(target)
+                except OSError:
+                    pass
+        for rel in journal["removed"]:
+            saved = os.path.join(backup, rel)
+            if os.path.lexists(saved):
+                target = os.path.join(path, rel)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(saved, target)
+        if journal["venv"]:
+            current = os.path.join(path, "venv")
+            shutil.rmtree(current, ignore_errors=True)
+            os.rename(journal["venv"], current)
+            journal["venv"] = None
+        journal["written"], journal["removed"] = [], []
+        
+    @staticmethod
+    def _back_up(path: str, rel: str, backup: str) -> bool:
+        source = os.path.join(path, rel)
+        if not os.path.lexists(source):
+            return False
+        saved = os.path.join(backup, rel)
+        os.makedirs(os.path.dirname(saved), exist_ok=True)
+        os.replace(source, saved)
+        return True
+
+    async def prepare_update_dependencies(self, bot_config: dict, analysis: dict, staging: str, dependencies_changed: bool):
+        """Get an update's dependencies ready before the bot is stopped
+        
+        Returns "venv" (a venv to swap in), "delta" (pip install into the
+        current venv after the swap) or "reinstall" alongside "success".
+        """
+        bot_type = analysis['bot_type']
+        if bot_type == bot_config['bot_type'] and not dependencies_changed:
+            return {"success": True}
+            
+        if self.image_cache is not None and bot_type in config.DOCKER_IMAGES:
+            # start_in_container finds the new dependency image by its hash
+            await self.image_cache.image_for(staging, bot_type)
+            return {"success": True}
+            
+        if bot_type != 'python':
+            return {"success": True, "reinstall": True}
+            
+        req_file = os.path.join(staging, "requirements.txt")
+        if not os.path.exists(req_file):
+            return {"success": True}
+        if await self.venv_cache.cache_key(req_file) is None:
+            # Local references: bring the existing venv up to date in place
+            return {"success": True, "delta": True}
+            
+        venv_path = os.path.join(staging, "venv")
+        result = await self.venv_cache.provision(req_file, venv_path, cwd=staging)
+        if result["success"]:
+            result["venv"] = venv_path
+        return result
+
+    async def install_python_delta(self, path: str):
+        """Install what changed in requirements.txt into the bot's existing venv"""
+        req_file = f"{path}/requirements.txt"
+        venv_path = f"{path}/venv"
+        if not os.path.isdir(venv_path):
+            return await create_venv(venv_path, req_file, path)
+        return await install_requirements(venv_path, req_file, path)
+
+    def record_shipped_files(self, path: str, files: list = None):
+        """Remember which workspace files came from the archive (blocking)"""
+        if files is None:
+            files = [
+                rel for rel in scan_manifest(path)["files"]
+                if rel not in (SHIPPED_FILES, "space_config.json")
+            ]
+        with open(os.path.join(path, SHIPPED_FILES), 'w') as f:
+            json.dump(sorted(files), f)
+        return files
+
+    def read_shipped_files(self, path: str) -> list:
+        try:
+            with open(os.path.join(path, SHIPPED_FILES), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def extract_archive(self, zip_path: str, extract_path: str, report=None):
+        """Stream ZIP members to disk in chunks (blocking, run in the I/O pool)"""
+        root = os.path.realpath(extract_path)
+        os.makedirs(root, exist_ok=True)
+        
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            members = zip_ref.infolist()
+            total = sum(member.file_size for member in members) or 1
+            done = 0
+            last_reported = -1
+            
+            for member in members:
+                target = os.path.realpath(os.path.join(root, member.filename))
+                if target != root and not target.startswith(root + os.sep):
+                    raise ValueError(f"Unsafe path in archive: {member.filename}")
+                    
+                if member.is_dir():
+                    os.makedirs(target, exist_ok=True)
+                    continue
+                    
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with zip_ref.open(member) as src, open(target, 'wb') as dst:
+                    while True:
+                        chunk = src.read(config.EXTRACT_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        done += len(chunk)
+                        
+                        percent = done * 100 // total
+                        if report and percent != last_reported:
+                            last_reported = percent
+                            report(done, total)
+                            
+                # Keep executable bits so start scripts stay runnable
+                mode = (member.external_attr >> 16) & 0o777
+                if mode & 0o111:
+                    os.chmod(target, mode)
+                    
+        if report and last_reported != 100:
+            report(total, total)
+            
+    def write_bot_config(self, path: str, bot_config: dict):
+        """Write space_config.json (blocking, run in the I/O pool)"""
+        with open(f"{path}/space_config.json", 'w') as f:
+            json.dump(bot_config, f)
+            
     async def analyze_bot_structure_enhanced(self, path: str):
         """Enhanced bot analysis with module support"""
+        return await self.run_blocking(self.analyze_bot_structure, path)
+        
+    def analyze_bot_structure(self, path: str):
+        """Blocking bot structure analysis (run in the I/O pool)
+        
+        The workspace is walked once; everything below works off that
+        manifest, re-based on the project root if the archive wraps it.
+        """
         try:
-            files = os.listdir(path)
+            manifest = scan_manifest(path)
+            root = manifest['root']
+            project = os.path.join(path, root) if root else path
+            listing = relative_manifest(manifest)['listing']
+            files = listing.get('', [])
             
             analysis = {
                 'bot_type': 'unknown',
+                'root': root,
                 'main_file': None,
                 'dependencies': [],
                 'config_files': [],
                 'start_method': 'direct',
                 'module_info': {},
                 'scripts': [],
+                'manifest': {
+                    'files': len(manifest['files']),
+                    'size': manifest['total_size'],
+                    'packages': [p[len(root) + 1:] if root else p for p in manifest['packages']],
+                    'dependency_files': [p[len(root) + 1:] if root else p for p in manifest['dependency_files']]
+                },
                 'estimated_resources': {
                     'memory': '512MB',
                     'cpu': '1 core'
@@ -101,15 +730,16 @@ class BotManager:
             }
             
             # Enhanced Python detection
-            if self.is_python_bot(path, files):
+            if self.is_python_bot(listing):
                 analysis['bot_type'] = 'python'
-                python_analysis = await self.analyze_python_structure(path, files)
+                python_analysis = self.analyze_python_structure(project, listing)
                 analysis.update(python_analysis)
                 
             elif 'package.json' in files:
                 analysis['bot_type'] = 'nodejs'
-                analysis['main_file'] = self.find_nodejs_main(path, files)
-                analysis['dependencies'] = self.parse_package_json(os.path.join(path, 'package.json'))
+                package = self.parse_package_json(os.path.join(project, 'package.json'))
+                analysis['main_file'] = self.find_nodejs_main(files, package)
+                analysis['dependencies'] = sorted(package.get('dependencies') or {})
                 
             elif any(f.endswith('.jar') for f in files):
                 analysis['bot_type'] = 'java'
@@ -132,8 +762,21 @@ class BotManager:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
-    def is_python_bot(self, path: str, files: list) -> bool:
+    def prepare_workspace(self, path: str, analysis: dict):
+        """Lay out an extracted workspace as analyzed (blocking, run in the I/O pool)"""
+        hoist_root(path, analysis.get('root'))
+        
+        # Make start script executable
+        if analysis.get('start_script'):
+            try:
+                os.chmod(os.path.join(path, analysis['start_script']), 0o755)
+            except OSError:
+                pass
+
+    def is_python_bot(self, listing: dict) -> bool:
         """Enhanced Python bot detection"""
+        files = listing.get('', [])
+        
         # Check for obvious Python indicators
         if 'requirements.txt' in files:
             return True
@@ -142,20 +785,19 @@ class BotManager:
             return True
             
         # Check for Python module structure
-        for item in files:
-            item_path = os.path.join(path, item)
-            if os.path.isdir(item_path):
-                try:
-                    subfiles = os.listdir(item_path)
-                    if '__init__.py' in subfiles or '__main__.py' in subfiles:
-                        return True
-                except:
-                    continue
-                    
-        return False
+        return bool(self.find_packages(listing))
+
+    def find_packages(self, listing: dict) -> list:
+        """Top-level directories that are Python packages"""
+        return [
+            item for item in listing.get('', [])
+            if not item.startswith('.')
+            and any(marker in listing.get(item, ()) for marker in ('__init__.py', '__main__.py'))
+        ]
 
-    async def analyze_python_structure(self, path: str, files: list) -> dict:
+    def analyze_python_structure(self, path: str, listing: dict) -> dict:
         """Detailed Python bot structure analysis with module support"""
+        files = listing.get('', [])
         structure = {
             'main_file': None,
             'start_method': 'direct',
@@ -176,49 +818,31 @@ class BotManager:
         # Look for start scripts (highest priority)
         start_scripts = ['start.sh', 'start', 'run.sh', 'launch.sh']
         for script in start_scripts:
-            if script in files:
+            if script in files and script not in listing:
                 structure['start_method'] = 'bash_script'
                 structure['start_script'] = script
                 
-                # Make script executable
-                script_path = os.path.join(path, script)
-                try:
-                    os.chmod(script_path, 0o755)
-                except:
-                    pass
-                
                 # Try to extract module name from script
-                module_name = await self.extract_module_from_script(script_path)
+                module_name = self.extract_module_from_script(os.path.join(path, script))
                 if module_name:
                     structure['module_name'] = module_name
                 break
         
         # If no script, check for module structure
         if structure['start_method'] == 'direct':
-            module_name = self.detect_module_structure(path, files)
+            module_name = self.detect_module_structure(listing)
             if module_name:
                 structure['start_method'] = 'module'
                 structure['module_name'] = module_name
             else:
                 # Direct file execution
-                structure['main_file'] = self.find_python_main(path, files)
+                structure['main_file'] = self.find_python_main(files)
                 
         return structure
 
-    def detect_module_structure(self, path: str, files: list) -> str:
+    def detect_module_structure(self, listing: dict) -> str:
         """Detect Python module structure"""
-        potential_modules = []
-        
-        for item in files:
-            item_path = os.path.join(path, item)
-            if os.path.isdir(item_path) and not item.startswith('.'):
-                try:
-                    # Check for module indicators
-                    subfiles = os.listdir(item_path)
-                    if '__init__.py' in subfiles or '__main__.py' in subfiles:
-                        potential_modules.append(item)
-                except:
-                    continue
+        potential_modules = self.find_packages(listing)
                     
         if potential_modules:
             # Prioritize common bot module names
@@ -232,7 +856,7 @@ class BotManager:
             
         return None
 
-    async def extract_module_from_script(self, script_path: str) -> str:
+    def extract_module_from_script(self, script_path: str) -> str:
         """Extract module name from start script"""
         try:
             with open(script_path, 'r') as f:
@@ -260,7 +884,7 @@ class BotManager:
             logger.error(f"Error extracting module from script: {str(e)}")
             return None
 
-    def find_python_main(self, path: str, files: list):
+    def find_python_main(self, files: list):
         """Enhanced main file detection"""
         # Priority order for main files
         main_candidates = [
@@ -289,8 +913,35 @@ class BotManager:
         py_files = [f for f in files if f.endswith('.py')]
         return py_files[0] if py_files else None
 
-    async def start_bot(self, bot_id: str):
-        """Enhanced start bot with token and module support"""
+    def find_nodejs_main(self, files: list, package: dict):
+        """Node.js entry point: package.json "main", then common file names"""
+        main = package.get('main')
+        if isinstance(main, str) and main:
+            return main
+        for candidate in ['index.js', 'bot.js', 'app.js', 'main.js', 'server.js']:
+            if candidate in files:
+                return candidate
+        js_files = [f for f in files if f.endswith('.js')]
+        return js_files[0] if js_files else None
+
+    def parse_package_json(self, package_path: str) -> dict:
+        """Parse package.json"""
+        try:
+            with open(package_path, 'r') as f:
+                package = json.load(f)
+            return package if isinstance(package, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    async def start_bot(self, bot_id: str, bot_info: dict = None):
+        """Enhanced start bot with token and module support
+        
+        bot_info may be passed in when the caller already fetched it in bulk
+        """
+        if bot_id in self.running_processes or bot_id in self.starting:
+            return {"success": False, "error": "Bot is already running"}
+            
+        self.starting.add(bot_id)
         try:
             # Load bot configuration
             bot_config = await self.load_bot_config(bot_id)
@@ -298,17 +949,23 @@ class BotManager:
                 return {"success": False, "error": "Bot configuration not found"}
                 
             # Get bot info from database
-            bot_info = await self.get_bot_from_db(bot_id)
+            if bot_info is None:
+                bot_info = await self.get_bot_from_db(bot_id)
             if not bot_info or not bot_info.get('token_configured'):
                 return {"success": False, "error": "Bot token not configured"}
                 
-            # Get token (stored as plain text as per owner's request)
+            # Tokens without a key id predate encryption and are still plain text
             bot_token = bot_info['bot_token']
+            if bot_info.get('token_key_id'):
+                bot_token = crypto.decrypt(bot_token)
             
             # Set up environment with token
             bot_config['environment_vars'] = bot_config.get('environment_vars', {})
             bot_config['environment_vars']['BOT_TOKEN'] = bot_token
             
+            if self.docker is not None and bot_config['bot_type'] in config.DOCKER_IMAGES:
+                return await self.start_in_container(bot_config)
+                
             # Start bot with enhanced method detection
             if bot_config['bot_type'] == 'python':
                 return await self.start_python_bot_enhanced(bot_config)
@@ -322,6 +979,8 @@ class BotManager:
         except Exception as e:
             logger.error(f"Failed to start bot {bot_id}: {str(e)}")
             return {"success": False, "error": str(e)}
+        finally:
+            self.starting.discard(bot_id)
 
     async def start_python_bot_enhanced(self, bot_config: dict):
         """Enhanced Python bot startup with module support"""
@@ -360,21 +1019,20 @@ class BotManager:
             env['PATH'] = f"{venv_path}/bin:" + env.get('PATH', '')
             env['VIRTUAL_ENV'] = venv_path
         
-        # Execute the start script
-        process = await asyncio.create_subprocess_exec(
-            f"./{script_name}",
-            cwd=path,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            env=env
-        )
+        # Execute the start script. Output goes to a file, not a pipe, so the
+        # bot keeps running if the controller goes away
+        with await self.log_collector.open_output(bot_id) as output:
+            process = HostProcess(await asyncio.create_subprocess_exec(
+                f"./{script_name}",
+                cwd=path,
+                stdout=output,
+                stderr=asyncio.subprocess.STDOUT,
+                env=env,
+                # Own session: signals aimed at the controller don't take bots down
+                start_new_session=True
+            ))
         
-        self.running_processes[bot_id] = {
-            "type": "process",
-            "process": process,
-            "start_method": "bash_script",
-            "script_name": script_name
-        }
+        self.register_process(bot_config, process, start_method="bash_script", script_name=script_name)
         
         return {"success": True}
 
@@ -401,20 +1059,18 @@ class BotManager:
             python_cmd = "python3"
         
         # Start with module flag
-        process = await asyncio.create_subprocess_exec(
-            python_cmd, "-m", module_name,
-            cwd=path,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            env=env
-        )
+        with await self.log_collector.open_output(bot_id) as output:
+            process = HostProcess(await asyncio.create_subprocess_exec(
+                python_cmd, "-m", module_name,
+                cwd=path,
+                stdout=output,
+                stderr=asyncio.subprocess.STDOUT,
+                env=env,
+                # Own session: signals aimed at the controller don't take bots down
+                start_new_session=True
+            ))
         
-        self.running_processes[bot_id] = {
-            "type": "process",
-            "process": process,
-            "start_method": "module",
-            "module_name": module_name
-        }
+        self.register_process(bot_config, process, start_method="module", module_name=module_name)
         
         return {"success": True}
 
@@ -441,44 +1097,215 @@ class BotManager:
             python_cmd = "python3"
         
         # Start directly
-        process = await asyncio.create_subprocess_exec(
-            python_cmd, main_file,
-            cwd=path,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            env=env
-        )
+        with await self.log_collector.open_output(bot_id) as output:
+            process = HostProcess(await asyncio.create_subprocess_exec(
+                python_cmd, main_file,
+                cwd=path,
+                stdout=output,
+                stderr=asyncio.subprocess.STDOUT,
+                env=env,
+                # Own session: signals aimed at the controller don't take bots down
+                start_new_session=True
+            ))
         
-        self.running_processes[bot_id] = {
-            "type": "process",
-            "process": process,
-            "start_method": "direct",
-            "main_file": main_file
-        }
+        self.register_process(bot_config, process, start_method="direct", main_file=main_file)
+        
+        return {"success": True}
+
+    async def start_in_container(self, bot_config: dict):
+        """Start a bot in a resource-limited container on DOCKER_NETWORK"""
+        bot_id = bot_config["bot_id"]
+        image = await self.image_cache.image_for(bot_config["path"], bot_config['bot_type'])
+        command = self.container_command(bot_config, install=not image["layered"])
+        if command is None:
+            return {"success": False, "error": "No entry point found for this bot"}
+            
+        logger.info(f"Starting bot {bot_id} from {image['image']}: {' '.join(command)}")
+        env = dict(bot_config.get('environment_vars', {}))
+        env['PORT'] = str(bot_config.get('port', ''))
+        
+        process = await self.docker.run(
+            bot_id,
+            image["image"],
+            command,
+            bot_config["path"],
+            env
+        )
+        self.register_process(bot_config, process, type="docker", container_id=process.container_id)
         
         return {"success": True}
+        
+    def container_command(self, bot_config: dict, install: bool = True):
+        """Entry point for a container, optionally installing dependencies first"""
+        bot_type = bot_config['bot_type']
+        start_method = bot_config.get('start_method', 'direct')
+        
+        if bot_type == 'python':
+            setup = '[ ! -f requirements.txt ] || pip install -q --no-cache-dir -r requirements.txt'
+            if start_method == 'bash_script' and bot_config.get('start_script'):
+                command = ["sh", bot_config['start_script']]
+            elif start_method == 'module' and bot_config.get('module_name'):
+                command = ["python", "-m", bot_config['module_name']]
+            elif bot_config.get('main_file'):
+                command = ["python", bot_config['main_file']]
+            else:
+                return None
+        elif bot_type == 'nodejs':
+            setup = '[ ! -f package.json ] || npm install --omit=dev --no-audit --no-fund'
+            command = ["node", bot_config.get('main_file') or "index.js"]
+        elif bot_type == 'java' and bot_config.get('main_file'):
+            setup = 'true'
+            command = ["java", "-jar", bot_config['main_file']]
+        else:
+            return None
+            
+        if not install:
+            return command
+        return ["sh", "-c", f'{setup} && exec "$@"', "sh", *command]
+
+    def register_process(self, bot_config: dict, process, record: bool = True, **info):
+        """Track a bot process, drain its output, supervise it and persist it"""
+        bot_id = bot_config["bot_id"]
+        self.running_processes[bot_id] = {"type": "process", "process": process, **info}
+        self.log_collector.attach(bot_id, process)
+        self.supervisor.watch(
+            bot_id, process,
+            bot_config.get("restart_policy", config.DEFAULT_RESTART_POLICY),
+            record=record
+        )
+        
+        if info.get("type") == "docker":
+            entry = {"runtime": "docker", "container_id": info["container_id"]}
+        else:
+            stat = read_proc_stat(process.pid)
+            entry = {
+                "runtime": "process",
+                "pid": process.pid,
+                "start_ticks": stat[2] if stat else None,
+                "cmdline": read_cmdline(process.pid)
+            }
+        self.process_registry.add(bot_id, entry)
+        self.save_process_registry()
+        
+    def forget_process(self, bot_id: str, process):
+        """Drop a bot from the process registry once its process has exited"""
+        if self.process_registry.remove(bot_id, process):
+            self.save_process_registry()
+            
+    def save_process_registry(self):
+        self.io_executor.submit(self.process_registry.save, *self.process_registry.snapshot())
+        
+    async def _reconcile_forever(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Reconciliation failed: {str(e)}")
+            await asyncio.sleep(config.RECONCILE_INTERVAL)
+            
+    async def reconcile(self):
+        """Bring tracked processes, the registry and DB statuses in line
+        
+        Bots that are still alive (registry pid with a matching start time
+        and command line, or a labelled container) are re-attached. Bots
+        that should be running but are not get restarted, premium owners
+        first, RECONCILE_CONCURRENCY at a time. DB statuses that disagree
+        with reality are fixed in one bulk write.
+        """
+        async with self._reconcile_lock:
+            busy = (
+                set(self.running_processes) | self.starting |
+                set(self.supervisor.pending_restarts) | self.supervisor.restarting
+            )
+            containers = await self.docker.list_bot_containers() if self.docker is not None else {}
+            
+            desired, db_status, resume = set(), {}, set()
+            if self.db is not None:
+                for bot in await self.db.get_bots_with_status(
+                    ["running", "restarting"], {"_id": 0, "bot_id": 1}
+                ):
+                    desired.add(bot["bot_id"])
+                # Bots stopped by a graceful shutdown or /fleet stop come back too
+                resume = set(await self.db.get_bots_pending_resume())
+                desired |= resume
+                tracked = [b for b, info in self.running_processes.items() if not info.get("stopping")]
+                for i in range(0, len(tracked), config.DB_BATCH_SIZE):
+                    infos = await self.db.get_bots_by_ids(tracked[i:i + config.DB_BATCH_SIZE], {"status": 1})
+                    db_status.update({b: info.get("status") for b, info in infos.items()})
+                    
+            registered = set(self.process_registry.entries)
+            fixes = {b: "running" for b, status in db_status.items() if status != "running"}
+            adopted, dead, owners = [], [], {}
+            
+            for bot_id in (desired | registered | set(containers)) - busy:
+                bot_config = await self.load_bot_config(bot_id)
+                container = containers.get(bot_id)
+                if bot_config is None:
+                    # Workspace is gone (deleted bot); nothing left to run
+                    if container is not None:
+                        await self.docker.remove(container.id)
+                    if self.process_registry.remove(bot_id):
+                        self.save_process_registry()
+                    if bot_id in desired:
+                        fixes[bot_id] = "error"
+                    continue
+                    
+                if container is not None:
+                    process = self.docker.adopt(container)
+                    self.register_process(
+                        bot_config, process, record=False,
+                        type="docker", container_id=container.id
+                    )
+                else:
+                    process = AdoptedProcess.attach(self.process_registry.entries.get(bot_id))
+                    if process is None:
+                        if self.process_registry.remove(bot_id):
+                            self.save_process_registry()
+                        dead.append(bot_id)
+                        owners[bot_id] = bot_config.get("user_id")
+                        continue
+                    self.register_process(bot_config, process, record=False, start_method="adopted")
+                adopted.append(bot_id)
+                fixes[bot_id] = "running"
+                
+            if adopted or dead:
+                logger.info(f"Reconciliation: {len(adopted)} bots re-attached, {len(dead)} to restart")
+                
+            if dead:
+                premium = await self.db.get_premium_user_ids(set(owners.values())) if self.db is not None else set()
+                dead.sort(key=lambda b: owners[b] not in premium)
+                results = await self.start_bots(dead, concurrency=config.RECONCILE_CONCURRENCY)
+                for bot_id, result in results.items():
+                    if not result["success"]:
+                        logger.error(f"Could not resume bot {bot_id}: {result['error']}")
+                        fixes[bot_id] = "error"
+                        
+            if fixes and self.db is not None:
+                await self.db.bulk_set_bot_status(fixes)
+            resumed = [b for b in resume if b in self.running_processes]
+            if resumed:
+                await self.db.clear_resume_pending(resumed)
 
     async def stop_bot(self, bot_id: str):
         """Stop a running bot"""
         try:
             if bot_id not in self.running_processes:
+                if self.supervisor.cancel_restart(bot_id):
+                    return {"success": True}
                 return {"success": False, "error": "Bot not running"}
                 
             proc_info = self.running_processes[bot_id]
+            proc_info["stopping"] = True
             
-            if proc_info["type"] == "docker":
-                container = proc_info["container"]
-                container.stop()
-                container.remove()
-            else:
-                process = proc_info["process"]
-                process.terminate()
-                
-                try:
-                    await asyncio.wait_for(process.wait(), timeout=10.0)
-                except asyncio.TimeoutError:
-                    process.kill()
-                    await process.wait()
+            # Containers are ContainerProcess handles, so both runtimes stop alike
+            process = proc_info["process"]
+            process.terminate()
+            
+            try:
+                await asyncio.wait_for(process.wait(), timeout=10.0)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
                     
             del self.running_processes[bot_id]
             return {"success": True}
@@ -487,21 +1314,64 @@ class BotManager:
             logger.error(f"Failed to stop bot {bot_id}: {str(e)}")
             return {"success": False, "error": str(e)}
 
-    async def restart_bot(self, bot_id: str):
-        """Restart a bot"""
-        stop_result = await self.stop_bot(bot_id)
-        if not stop_result["success"]:
-            return stop_result
+    async def restart_bot(self, bot_id: str, bot_info: dict = None):
+        """Restart a bot (or just start it if it isn't running)
+        
+        stop_bot returns only after the old process has exited, so its
+        port is free again and no settle delay is needed.
+        """
+        if bot_id in self.running_processes:
+            stop_result = await self.stop_bot(bot_id)
+            if not stop_result["success"]:
+                return stop_result
+        else:
+            self.supervisor.cancel_restart(bot_id)
             
-        # Wait a moment before restarting
-        await asyncio.sleep(2)
+        return await self.start_bot(bot_id, bot_info=bot_info)
         
-        return await self.start_bot(bot_id)
+    async def bulk_action(self, action: str, bot_ids: list, progress=None, concurrency: int = None):
+        """Start, stop or restart many bots concurrently
+        
+        Returns {bot_id: result} with one result dict per bot. progress, if
+        given, is an async callable taking (done, total) after each bot.
+        """
+        if action not in ("start", "stop", "restart"):
+            raise ValueError(f"Unknown bulk action: {action}")
+            
+        semaphore = asyncio.Semaphore(concurrency or config.BULK_CONCURRENCY)
+        results = {}
+        infos = {}
+        if action != "stop" and self.db is not None:
+            # Tokens for every bot, one query per batch instead of one per bot
+            for i in range(0, len(bot_ids), config.DB_BATCH_SIZE):
+                infos.update(await self.db.get_bots_by_ids(bot_ids[i:i + config.DB_BATCH_SIZE], TOKEN_PROJECTION))
+                
+        async def run(bot_id):
+            async with semaphore:
+                try:
+                    if action == "stop":
+                        result = await self.stop_bot(bot_id)
+                    elif action == "start":
+                        result = await self.start_bot(bot_id, bot_info=infos.get(bot_id))
+                    else:
+                        result = await self.restart_bot(bot_id, bot_info=infos.get(bot_id))
+                except Exception as e:
+                    result = {"success": False, "error": str(e)}
+            results[bot_id] = result
+            if progress:
+                await progress(len(results), len(bot_ids))
+                
+        await asyncio.gather(*(run(bot_id) for bot_id in bot_ids))
+        return results
 
     async def install_dependencies(self, path: str, bot_type: str, analysis: dict):
         """Install bot dependencies based on type and analysis"""
         try:
-            if bot_type == "python":
+            if self.image_cache is not None and bot_type in config.DOCKER_IMAGES:
+                # Build (or reuse) the shared dependency image now so the first start is fast
+                await self.image_cache.image_for(path, bot_type)
+                return {"success": True}
+            elif bot_type == "python":
                 return await self.install_python_deps(path)
             elif bot_type == "nodejs":
                 return await self.install_nodejs_deps(path)
@@ -514,40 +1384,12 @@ class BotManager:
             return {"success": False, "error": str(e)}
 
     async def install_python_deps(self, path: str):
-        """Install Python dependencies"""
+        """Install Python dependencies through the shared venv cache"""
         req_file = f"{path}/requirements.txt"
         
         if os.path.exists(req_file):
-            # Create virtual environment
             venv_path = f"{path}/venv"
-            
-            # Create venv
-            process = await asyncio.create_subprocess_exec(
-                "python3", "-m", "venv", venv_path,
-                cwd=path,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode != 0:
-                return {"success": False, "error": f"Virtual environment creation failed: {stderr.decode()}"}
-                
-            # Install requirements
-            pip_path = f"{venv_path}/bin/pip"
-            
-            process = await asyncio.create_subprocess_exec(
-                pip_path, "install", "-r", req_file,
-                cwd=path,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode != 0:
-                return {"success": False, "error": f"Pip install failed: {stderr.decode()}"}
+            return await self.venv_cache.provision(req_file, venv_path, cwd=path)
                 
         return {"success": True}
 
@@ -583,44 +1425,447 @@ class BotManager:
             return []
 
     async def load_bot_config(self, bot_id: str):
-        """Load bot configuration from file"""
-        # Search for config file in bot directories
-        for user_dir in os.listdir(config.BOTS_PATH):
-            user_path = f"{config.BOTS_PATH}/{user_dir}"
-            if os.path.isdir(user_path):
-                for bot_dir in os.listdir(user_path):
-                    if bot_dir == bot_id:
-                        config_path = f"{user_path}/{bot_dir}/space_config.json"
-                        if os.path.exists(config_path):
-                            with open(config_path, 'r') as f:
-                                return json.load(f)
-        return None
+        """Load bot configuration via the workspace index"""
+        bot_config = self.workspace_index.get_cached_config(bot_id)
+        if bot_config is None:
+            bot_config = await self.run_blocking(self.workspace_index.read_config, bot_id)
+        return copy.deepcopy(bot_config) if bot_config else None
+
+    async def delete_bot(self, bot_id: str):
+        """Stop a bot and remove its workspace from disk and the index"""
+        if bot_id in self.running_processes:
+            await self.stop_bot(bot_id)
+        self.supervisor.cancel_restart(bot_id)
+        self.supervisor.history.pop(bot_id, None)
+            
+        bot_config = await self.load_bot_config(bot_id)
+        path = self.workspace_index.get_path(bot_id)
+        
+        if path:
+            await self.run_blocking(shutil.rmtree, path, True)
+        if self.workspace_index.remove(bot_id):
+            await self.run_blocking(self.workspace_index.save, *self.workspace_index.snapshot())
+        self.log_collector.discard(bot_id)
+        
+        if bot_config and bot_config.get('port'):
+            self.port_allocator.release(bot_config['port'])
+            
+        return {"success": path is not None}
+
+    async def get_bot_from_db(self, bot_id: str, projection: dict = TOKEN_PROJECTION):
+        """Get bot information from the shared database"""
+        return await self.db.get_bot_by_id(bot_id, projection)
+
+    async def start_bots(self, bot_ids: list, concurrency: int = 1):
+        """Start many bots in order, fetching their tokens one batch per query"""
+        return await self.bulk_action("start", bot_ids, concurrency=concurrency)
 
-    async def get_bot_from_db(self, bot_id: str):
-        """Get bot information from database"""
-        # This would typically integrate with database class
-        from database import Database
-        db = Database()
-        await db.initialize()
-        return await db.db.bots.find_one({"bot_id": bot_id})
-
-class PortManager:
-    def __init__(self):
-        self.used_ports = set()
-        self.current_port = config.BASE_PORT
-        
-    async def get_available_port(self) -> int:
-        """Get next available port"""
-        while self.current_port in self.used_ports or self.current_port > config.MAX_PORT:
-            self.current_port += 1
-            
-        if self.current_port > config.MAX_PORT:
-            # Reset and find available port
-            self.current_port = config.BASE_PORT
-            
-        self.used_ports.add(self.current_port)
-        return self.current_port
-        
-    async def release_port(self, port: int):
-        """Release a port"""
-        self.used_ports.discard(port)
+class ProcessSupervisor:
+    """Watches bot processes and applies restart policies when they exit
+    
+    Policies: "always" restarts on any exit, "on-failure" only on a
+    non-zero exit code, "never" just records the exit. Restarts back off
+    exponentially with jitter; too many within CRASH_LOOP_WINDOW marks the
+    bot as "error" and gives up.
+    """
+    
+    def __init__(self, manager):
+        self.manager = manager
+        self.watchers = {}
+        self.pending_restarts = {}
+        self.history = {}
+        self.restarting = set()
+        
+    def watch(self, bot_id: str, process, policy: str, record: bool = True):
+        """Start awaiting a process's exit"""
+        if bot_id not in self.restarting:
+            # A manual start clears any previous crash history
+            self.history.pop(bot_id, None)
+        self.restarting.discard(bot_id)
+        
+        state = self.history.setdefault(bot_id, {"restart_count": 0, "restarts": []})
+        state["started_at"] = time.monotonic()
+        self.watchers[bot_id] = asyncio.ensure_future(self._wait(bot_id, process, policy))
+        if record:
+            asyncio.ensure_future(self._record(bot_id, "running", restart_count=state["restart_count"]))
+        
+    async def _wait(self, bot_id: str, process, policy: str):
+        exit_code = await process.wait()
+        if self.manager.shutting_down:
+            # stop_fleet records every final status in one bulk write
+            return
+        self.manager.forget_process(bot_id, process)
+        proc_info = self.manager.running_processes.get(bot_id)
+        if proc_info and proc_info.get("process") is not process:
+            return
+            
+        if not proc_info or proc_info.get("stopping"):
+            await self._record(bot_id, "stopped", last_exit_code=exit_code)
+            return
+            
+        # Unexpected exit
+        del self.manager.running_processes[bot_id]
+        state = self.history[bot_id]
+        logger.warning(f"Bot {bot_id} exited with code {exit_code}")
+        
+        wants_restart = policy == "always" or (policy == "on-failure" and exit_code != 0)
+        if not wants_restart:
+            await self._record(bot_id, "stopped" if exit_code == 0 else "error", last_exit_code=exit_code)
+            return
+            
+        now = time.monotonic()
+        if now - state["started_at"] > config.RESTART_RESET_SECONDS:
+            # It ran healthily for a while; start backing off from scratch
+            state["restarts"] = []
+        state["restarts"] = [t for t in state["restarts"] if now - t < config.CRASH_LOOP_WINDOW]
+        
+        if len(state["restarts"]) >= config.CRASH_LOOP_MAX_RESTARTS:
+            logger.error(f"Bot {bot_id} is crash looping, giving up")
+            await self._record(
+                bot_id, "error",
+                last_exit_code=exit_code,
+                restart_count=state["restart_count"],
+                error="Crash loop detected"
+            )
+            return
+            
+        delay = min(config.RESTART_BACKOFF_MAX, config.RESTART_BACKOFF_BASE * 2 ** len(state["restarts"]))
+        delay *= random.uniform(0.5, 1.0)
+        state["restarts"].append(now)
+        state["restart_count"] += 1
+        # Registered before anything awaits, so a stop_bot or stop_fleet in
+        # between always finds (and cancels) the restart
+        self.pending_restarts[bot_id] = asyncio.ensure_future(
+            self._restart_after(bot_id, delay, exit_code, state["restart_count"])
+        )
+        
+    async def _restart_after(self, bot_id: str, delay: float, exit_code: int, restart_count: int):
+        try:
+            await self._record(bot_id, "restarting", last_exit_code=exit_code, restart_count=restart_count)
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            return
+        self.pending_restarts.pop(bot_id, None)
+        
+        self.restarting.add(bot_id)
+        result = await self.manager.start_bot(bot_id)
+        if not result["success"]:
+            self.restarting.discard(bot_id)
+            logger.error(f"Supervisor failed to restart bot {bot_id}: {result['error']}")
+            await self._record(bot_id, "error", error=result["error"])
+            
+    def cancel_restart(self, bot_id: str) -> bool:
+        """Cancel a pending restart; returns True if one was pending"""
+        task = self.pending_restarts.pop(bot_id, None)
+        if task is None:
+            return False
+        task.cancel()
+        asyncio.ensure_future(self._record(bot_id, "stopped"))
+        return True
+        
+    async def _record(self, bot_id: str, status: str, **fields):
+        if self.manager.db is None:
+            return
+        try:
+            await self.manager.db.update_bot_runtime(bot_id, status, fields)
+        except Exception as e:
+            logger.error(f"Failed to record status for bot {bot_id}: {str(e)}")
+
+class WorkspaceIndex:
+    """Persistent bot_id -> workspace path index with an mtime-checked config cache"""
+    
+    def __init__(self, root: str = None):
+        self.root = root or config.BOTS_PATH
+        self.index_path = os.path.join(self.root, config.WORKSPACE_INDEX_FILE)
+        self.index_file = JsonSnapshotFile(self.index_path)
+        self.paths = {}
+        self.configs = {}
+        
+    def load(self):
+        """Load the index, rebuilding it from a directory scan if missing"""
+        try:
+            with open(self.index_path, 'r') as f:
+                self.paths = json.load(f)
+        except (OSError, ValueError):
+            self.rebuild()
+            
+    def rebuild(self):
+        """Scan BOTS_PATH once and persist the result"""
+        self.paths = {}
+        if os.path.isdir(self.root):
+            for user_entry in os.scandir(self.root):
+                if not user_entry.is_dir() or user_entry.name.startswith('.'):
+                    continue
+                for bot_entry in os.scandir(user_entry.path):
+                    if os.path.exists(os.path.join(bot_entry.path, "space_config.json")):
+                        self.paths[bot_entry.name] = f"{self.root}/{user_entry.name}/{bot_entry.name}"
+        logger.info(f"Workspace index rebuilt with {len(self.paths)} bots")
+        self.index_file.save(*self.snapshot())
+        
+    def snapshot(self):
+        return self.index_file.snapshot(self.paths)
+        
+    def add(self, bot_id: str, path: str):
+        """Record a workspace (on the loop); persist with save(*snapshot())"""
+        self.paths[bot_id] = path
+        self.configs.pop(bot_id, None)
+        
+    def remove(self, bot_id: str) -> bool:
+        self.configs.pop(bot_id, None)
+        return self.paths.pop(bot_id, None) is not None
+        
+    def save(self, paths: dict, generation: int):
+        self.index_file.save(paths, generation)
+        
+    def get_path(self, bot_id: str):
+        return self.paths.get(bot_id)
+        
+    def get_cached_config(self, bot_id: str):
+        """Return the cached config if its file is unchanged, else None"""
+        cached = self.configs.get(bot_id)
+        path = self.paths.get(bot_id)
+        if not cached or not path:
+            return None
+        try:
+            mtime = os.stat(f"{path}/space_config.json").st_mtime_ns
+        except OSError:
+            return None
+        return cached[1] if cached[0] == mtime else None
+        
+    def read_config(self, bot_id: str):
+        """Read and cache space_config.json for bot_id (blocking)"""
+        path = self.paths.get(bot_id)
+        if not path:
+            return None
+        config_path = f"{path}/space_config.json"
+        try:
+            mtime = os.stat(config_path).st_mtime_ns
+            with open(config_path, 'r') as f:
+                bot_config = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self.configs[bot_id] = (mtime, bot_config)
+        return bot_config
+
+class ProcessRegistry:
+    """bot_id -> how to find its process again, persisted across controller restarts
+    
+    Host processes are identified by pid plus start time and command line
+    (so a recycled pid is never mistaken for the bot); containers by id.
+    """
+    
+    def __init__(self, root: str = None):
+        self.path = os.path.join(root or config.BOTS_PATH, config.PROCESS_REGISTRY_FILE)
+        self.entries = {}
+        self.generation = 0
+        self._written = 0
+        self._lock = threading.Lock()
+        
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+            
+    def add(self, bot_id: str, entry: dict):
+        self.entries[bot_id] = entry
+        self.generation += 1
+        
+    def remove(self, bot_id: str, process=None) -> bool:
+        """Forget bot_id, or only if the entry still describes process"""
+        entry = self.entries.get(bot_id)
+        if entry is None:
+            return False
+        if process is not None:
+            if entry["runtime"] == "docker":
+                current = entry["container_id"] == getattr(process, "container_id", None)
+            else:
+                current = entry.get("pid") == process.pid
+            if not current:
+                return False
+        del self.entries[bot_id]
+        self.generation += 1
+        return True
+        
+    def snapshot(self):
+        return copy.deepcopy(self.entries), self.generation
+        
+    def save(self, entries: dict, generation: int):
+        """Persist a snapshot unless a newer one was already written (blocking)"""
+        with self._lock:
+            if generation <= self._written:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+            self._written = generation
+
+def signal_group(pid: int, sig):
+    """Signal a bot's whole process group (bots lead their own session)"""
+    try:
+        os.killpg(pid, sig)
+    except ProcessLookupError:
+        pass
+
+class HostProcess:
+    """A bot process we spawned; signals reach everything it started"""
+    
+    def __init__(self, process):
+        self.process = process
+        self.pid = process.pid
+        # Output goes to the bot's log file, see LogCollector.open_output
+        self.stdout = None
+        self.stderr = None
+        
+    @property
+    def returncode(self):
+        return self.process.returncode
+        
+    async def wait(self) -> int:
+        return await self.process.wait()
+        
+    def terminate(self):
+        if self.returncode is None:
+            signal_group(self.pid, signal.SIGTERM)
+            
+    def kill(self):
+        if self.returncode is None:
+            signal_group(self.pid, signal.SIGKILL)
+
+class AdoptedProcess:
+    """Process-like handle for a bot left running by a previous controller
+    
+    It is not our child, so its exit status is unknown (reported as -1)
+    and liveness is polled. Its output still goes to its log file.
+    """
+    
+    def __init__(self, pid: int, start_ticks: int):
+        self.pid = pid
+        self.start_ticks = start_ticks
+        self.returncode = None
+        self.stdout = None
+        self.stderr = None
+        
+    @classmethod
+    def attach(cls, entry: dict):
+        """Return a handle if the recorded process is still the same live process"""
+        if not entry or entry.get("runtime") != "process":
+            return None
+        stat = read_proc_stat(entry["pid"])
+        if stat is None or stat[2] != entry.get("start_ticks"):
+            return None
+        if read_cmdline(entry["pid"]) != entry.get("cmdline"):
+            return None
+        return cls(entry["pid"], entry["start_ticks"])
+        
+    def alive(self) -> bool:
+        try:
+            # Orphans are reparented to us when we run as PID 1; reap them
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                self.returncode = os.waitstatus_to_exitcode(status)
+                return False
+        except ChildProcessError:
+            pass
+        stat = read_proc_stat(self.pid)
+        return stat is not None and stat[2] == self.start_ticks and stat[3] != "Z"
+        
+    async def wait(self) -> int:
+        while self.returncode is None:
+            if not self.alive():
+                if self.returncode is None:
+                    self.returncode = -1
+                break
+            await asyncio.sleep(config.ADOPTED_POLL_INTERVAL)
+        return self.returncode
+        
+    def _signal(self, sig):
+        if self.returncode is None and self.alive():
+            signal_group(self.pid, sig)
+                
+    def terminate(self):
+        self._signal(signal.SIGTERM)
+        
+    def kill(self):
+        self._signal(signal.SIGKILL)
+
+class PortAllocator:
+    """Bitmap allocator over BASE_PORT..MAX_PORT
+    
+    Used ports are a bitmap; free ports wait in a FIFO so allocate and
+    release are O(1) and a just-released port is handed out last. The
+    bitmap is rebuilt from the bots' space_config.json records on startup,
+    and every candidate is bind-probed so ports held by something outside
+    the allocator are skipped.
+    """
+    
+    def __init__(self, base: int = None, last: int = None):
+        self.base = config.BASE_PORT if base is None else base
+        self.last = config.MAX_PORT if last is None else last
+        self.reset()
+        
+    def reset(self):
+        size = self.last - self.base + 1
+        self.bitmap = bytearray((size + 7) // 8)
+        self.free = deque(range(self.base, self.last + 1))
+        
+    def _bit(self, port: int):
+        offset = port - self.base
+        return offset >> 3, 1 << (offset & 7)
+        
+    def in_range(self, port) -> bool:
+        return isinstance(port, int) and self.base <= port <= self.last
+        
+    def is_used(self, port: int) -> bool:
+        index, mask = self._bit(port)
+        return bool(self.bitmap[index] & mask)
+        
+    def load(self, ports):
+        """Mark ports already assigned to existing bots as used"""
+        self.reset()
+        for port in ports:
+            if not self.in_range(port):
+                continue
+            if self.is_used(port):
+                logger.warning(f"Port {port} is assigned to more than one bot")
+            self.reserve(port)
+        # Stale free-list entries are skipped lazily; drop them now instead
+        self.free = deque(port for port in self.free if not self.is_used(port))
+        
+    def reserve(self, port: int):
+        index, mask = self._bit(port)
+        self.bitmap[index] |= mask
+        
+    def allocate(self) -> int:
+        """Hand out a free port that can actually be bound right now"""
+        for _ in range(len(self.free)):
+            port = self.free.popleft()
+            if self.is_used(port):
+                continue
+            if not self.probe(port):
+                # Held by something else; try it again after everything else
+                self.free.append(port)
+                continue
+            self.reserve(port)
+            return port
+        raise RuntimeError(f"No free ports left between {self.base} and {self.last}")
+        
+    def release(self, port: int):
+        if not self.in_range(port) or not self.is_used(port):
+            return
+        index, mask = self._bit(port)
+        self.bitmap[index] &= ~mask
+        self.free.append(port)
+        
+    @staticmethod
+    def probe(port: int) -> bool:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                sock.bind(("0.0.0.0", port))
+            except OSError:
+                return False
+        return True
@@ -0,0 +1,231 @@
+"""
+Rate-limited broadcast engine.
+
+Messages fan out over BROADCAST_CONCURRENCY workers, gated by a global
+token bucket (Telegram allows roughly 30 messages/s per bot) and a
+per-chat bucket.  A RetryAfter pauses the global bucket for the requested
+time.  Recipients are stored one document each in broadcast_recipients
+and streamed back with a cursor, so no single document grows with the
+audience.  Every delivery outcome is persisted to broadcast_deliveries,
+so a broadcast interrupted by a restart resumes where it stopped.
+
+The engine only needs an object with an async send_message(), so it can
+be pointed at a local fake Bot API server through TELEGRAM_API_BASE_URL.
+"""
+import asyncio
+import time
+import uuid
+from datetime import datetime
+from pymongo.errors import BulkWriteError
+from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError
+import config
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Hold every acquirer for at least seconds (used for RetryAfter)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def idle(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BroadcastEngine:
+    def __init__(self, db, bot):
+        self.db = db
+        self.bot = bot
+        self.global_bucket = TokenBucket(config.BROADCAST_GLOBAL_RATE, config.BROADCAST_GLOBAL_RATE)
+        self.chat_buckets = {}
+        self.tasks = {}
+
+    async def create(self, recipients: list, text: str = None, parse_mode: str = None, created_by: int = None) -> str:
+        """Persist a broadcast; recipients are chat ids or {"chat_id", "text"} dicts"""
+        broadcast_id = str(uuid.uuid4())
+        batch = []
+        for seq, recipient in enumerate(recipients):
+            if not isinstance(recipient, dict):
+                recipient = {"chat_id": recipient}
+            batch.append({"broadcast_id": broadcast_id, "seq": seq, **recipient})
+            if len(batch) >= config.BROADCAST_FLUSH_SIZE:
+                await self.db.db.broadcast_recipients.insert_many(batch)
+                batch = []
+        if batch:
+            await self.db.db.broadcast_recipients.insert_many(batch)
+
+        # Written last: resume_pending only ever sees complete recipient lists
+        await self.db.db.broadcasts.insert_one({
+            "_id": broadcast_id,
+            "text": text,
+            "parse_mode": parse_mode,
+            "total": len(recipients),
+            "created_by": created_by,
+            "status": "running",
+            "counts": {"delivered": 0, "failed": 0, "blocked": 0},
+            "created_at": datetime.utcnow()
+        })
+        return broadcast_id
+
+    def start(self, broadcast_id: str):
+        """Run a broadcast in the background"""
+        if broadcast_id not in self.tasks:
+            task = asyncio.ensure_future(self.run(broadcast_id))
+            self.tasks[broadcast_id] = task
+            task.add_done_callback(lambda _: self.tasks.pop(broadcast_id, None))
+        return self.tasks[broadcast_id]
+
+    async def resume_pending(self):
+        """Restart broadcasts that were interrupted mid-way"""
+        async for doc in self.db.db.broadcasts.find({"status": "running"}, {"_id": 1}):
+            logger.info(f"Resuming broadcast {doc['_id']}")
+            self.start(doc["_id"])
+
+    async def run(self, broadcast_id: str) -> dict:
+        """Deliver every outstanding message of a broadcast and return the counts"""
+        doc = await self.db.db.broadcasts.find_one({"_id": broadcast_id})
+        if doc is None:
+            return {}
+
+        counts = {"delivered": 0, "failed": 0, "blocked": 0}
+        done = set()
+        async for delivery in self.db.db.broadcast_deliveries.find(
+            {"broadcast_id": broadcast_id}, {"chat_id": 1, "status": 1}
+        ):
+            done.add(delivery["chat_id"])
+            counts[delivery["status"]] = counts.get(delivery["status"], 0) + 1
+
+        queue = asyncio.Queue(maxsize=config.BROADCAST_CONCURRENCY * 2)
+
+        async def produce():
+            try:
+                async for recipient in self.db.db.broadcast_recipients.find(
+                    {"broadcast_id": broadcast_id}, {"_id": 0, "chat_id": 1, "text": 1}
+                ).sort("seq", 1):
+                    if recipient["chat_id"] not in done:
+                        await queue.put(recipient)
+            finally:
+                for _ in range(config.BROADCAST_CONCURRENCY):
+                    await queue.put(None)
+
+        results = []
+        last_flush = time.monotonic()
+
+        async def flush():
+            nonlocal results, last_flush
+            batch, results = results, []
+            last_flush = time.monotonic()
+            try:
+                if batch:
+                    try:
+                        await self.db.db.broadcast_deliveries.insert_many(batch, ordered=False)
+                    except BulkWriteError:
+                        pass  # duplicates from an earlier partial run
+                await self.db.db.broadcasts.update_one({"_id": broadcast_id}, {"$set": {"counts": counts}})
+            except Exception as e:
+                # Keep sending; the outcomes go out with the next flush
+                logger.error(f"Broadcast {broadcast_id}: failed to record {len(batch)} deliveries: {str(e)}")
+                results = batch + results
+
+        async def worker():
+            while True:
+                recipient = await queue.get()
+                if recipient is None:
+                    return
+                status = await self.send(
+                    recipient["chat_id"],
+                    recipient.get("text", doc["text"]),
+                    doc.get("parse_mode")
+                )
+                counts[status] += 1
+                results.append({
+                    "broadcast_id": broadcast_id,
+                    "chat_id": recipient["chat_id"],
+                    "status": status,
+                    "at": datetime.utcnow()
+                })
+                if len(results) >= config.BROADCAST_FLUSH_SIZE or time.monotonic() - last_flush > 5:
+                    await flush()
+
+        logger.info(f"Broadcast {broadcast_id}: {doc.get('total', 0) - len(done)} messages to send")
+        await asyncio.gather(produce(), *(worker() for _ in range(config.BROADCAST_CONCURRENCY)))
+        await flush()
+        if results:
+            # Still unrecorded: leave the broadcast running so a restart picks it up
+            return counts
+
+        await self.db.db.broadcasts.update_one(
+            {"_id": broadcast_id},
+            {"$set": {"status": "done", "counts": counts, "finished_at": datetime.utcnow()}}
+        )
+        await self.db.db.broadcast_recipients.delete_many({"broadcast_id": broadcast_id})
+        self._prune_chat_buckets()
+        logger.info(f"Broadcast {broadcast_id} finished: {counts}")
+
+        if doc.get("created_by"):
+            await self.send(
+                doc["created_by"],
+                f"📢 Broadcast `{broadcast_id}` finished\n\n"
+                f"✅ Delivered: {counts['delivered']:,}\n"
+                f"🚫 Blocked: {counts['blocked']:,}\n"
+                f"❌ Failed: {counts['failed']:,}",
+                "Markdown"
+            )
+        return counts
+
+    async def send(self, chat_id: int, text: str, parse_mode: str = None) -> str:
+        """Send one message under the rate limits; returns delivered/blocked/failed"""
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(config.BROADCAST_CHAT_RATE, 1)
+
+        for attempt in range(config.BROADCAST_MAX_RETRIES):
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                return "delivered"
+            except RetryAfter as e:
+                delay = e.retry_after
+                delay = delay.total_seconds() if hasattr(delay, "total_seconds") else float(delay)
+                logger.warning(f"Flood limit hit, pausing broadcasts for {delay}s")
+                self.global_bucket.pause(delay)
+            except Forbidden:
+                return "blocked"
+            except BadRequest as e:
+                logger.warning(f"Broadcast to {chat_id} rejected: {str(e)}")
+                return "failed"
+            except NetworkError:
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                logger.error(f"Broadcast to {chat_id} failed: {str(e)}")
+                return "failed"
+        return "failed"
+
+    def _prune_chat_buckets(self):
+        for chat_id in [c for c, b in self.chat_buckets.items() if b.idle()]:
+            del self.chat_buckets[chat_id]
@@ -5,10 +5,48 @@ load_dotenv()
 # Telegram
 BOT_TOKEN  = os.getenv("BOT_TOKEN")          # hoster bot token
 BOT_USERNAME = "SpaceDeployerBot"
+# Point at a local Bot API server (or a fake one in tests) if needed
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+
+# Outbound Bot API HTTP client
+HTTP_POOL_SIZE       = 100
+HTTP_TIMEOUT         = 15    # seconds, whole request
+HTTP_CONNECT_TIMEOUT = 5
+GETME_CACHE_TTL      = 600
 
 # MongoDB
 MONGODB_URI  = os.getenv("MONGODB_URI")
 DATABASE_NAME = "space_deployer"
+MONGODB_POOL_SIZE = int(os.getenv("MONGODB_POOL_SIZE", "50"))
+DB_BATCH_SIZE     = 100
+
+# Subscription cache TTL and expiry sweep interval (seconds)
+SUBSCRIPTION_CACHE_TTL      = 300
+SUBSCRIPTION_SWEEP_INTERVAL = 300
+
+# Per-user dashboard snapshot TTL (seconds)
+USER_SNAPSHOT_TTL = 30
+
+# Drift correction for the materialized platform stats (seconds)
+STATS_RECONCILE_INTERVAL = 3600
+
+# Broadcasts (Telegram allows ~30 msg/s overall and ~1 msg/s per chat)
+BROADCAST_GLOBAL_RATE = 25
+BROADCAST_CHAT_RATE   = 1
+BROADCAST_CONCURRENCY = 30
+BROADCAST_MAX_RETRIES = 5
+BROADCAST_FLUSH_SIZE  = 200
+
+# Bot token re-encryption job
+TOKEN_REENCRYPT_CONCURRENCY = 4    # batches of DB_BATCH_SIZE in flight
+
+# Ban cache reload interval when change streams are unavailable (seconds)
+BAN_POLL_INTERVAL    = 30
+BAN_STREAM_RETRY_MIN = 1     # first change stream retry; doubles up to BAN_POLL_INTERVAL
+
+# Write-behind buffer for hot-path updates
+WRITE_BEHIND_INTERVAL    = 1.0   # seconds
+WRITE_BEHIND_MAX_PENDING = 500   # dirty documents before an early flush
 
 # Privileged users
 OWNER_ID  = int(os.getenv("OWNER_ID", "5960968099"))
@@ -24,13 +62,85 @@ LOGGER_ID       = "-1002068576120"
 MAX_BOTS_FREE = 1
 UPLOAD_MAX_MB = 100
 
+# Deploy I/O (ZIP extraction, analysis) worker pool
+DEPLOY_IO_WORKERS  = int(os.getenv("DEPLOY_IO_WORKERS", "4"))
+EXTRACT_CHUNK_SIZE = 1024 * 1024
+
+# Deploy job queue (builds running at once default to the host's cores)
+DEPLOY_WORKERS          = int(os.getenv("DEPLOY_WORKERS", str(os.cpu_count() or 2)))
+DEPLOY_JOB_TIMEOUT      = 1800
+DEPLOY_JOB_MAX_ATTEMPTS = 3
+DEPLOY_JOB_ESTIMATE     = 60     # seconds per job until real durations are known
+DEPLOY_QUEUE_POLL       = 5
+DEPLOY_JOB_RETENTION    = 7 * 24 * 3600   # finished jobs are dropped after this
+
 # Paths
 UPLOAD_PATH = "uploads"
 TEMP_PATH   = "temp"
 BOTS_PATH   = "deployed_bots"
 BASE_PORT   = 8000
 MAX_PORT    = 9000
+WORKSPACE_INDEX_FILE = ".index.json"
+LOGS_PATH   = "logs"
+
+# Bot analyses kept per archive SHA-256 (in memory and under BOTS_PATH/.analysis_cache)
+ANALYSIS_CACHE_SIZE = 512
+
+# Process supervision
+DEFAULT_RESTART_POLICY  = "on-failure"   # always / on-failure / never
+RESTART_BACKOFF_BASE    = 2.0            # seconds
+RESTART_BACKOFF_MAX     = 300.0
+RESTART_RESET_SECONDS   = 600            # healthy runtime that clears backoff
+CRASH_LOOP_WINDOW       = 900
+CRASH_LOOP_MAX_RESTARTS = 5
+
+# Graceful shutdown: one deadline for the whole fleet (keep below stop_grace_period)
+SHUTDOWN_TIMEOUT    = 25
+SHUTDOWN_KILL_GRACE = 3      # reserved for SIGKILL of stragglers
+
+# Bulk start/stop/restart
+BULK_CONCURRENCY = 20
+
+# Controller restart reconciliation
+PROCESS_REGISTRY_FILE  = ".processes.json"
+RECONCILE_INTERVAL     = 300     # seconds between drift checks
+RECONCILE_CONCURRENCY  = 10      # bots restarted at once
+ADOPTED_POLL_INTERVAL  = 2.0     # liveness check for re-attached processes
+
+# Resource sampling (/proc) interval in seconds
+RESOURCE_SAMPLE_INTERVAL = 30
+
+# Hosted bot output (per-bot memory cap = LOG_BUFFER_LINES * LOG_MAX_LINE_BYTES + LOG_SPILL_MAX_BYTES)
+LOG_BUFFER_LINES   = 500
+LOG_MAX_LINE_BYTES = 2048
+LOG_READ_CHUNK     = 64 * 1024
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS   = 3
+LOG_SPILL_MAX_BYTES = 1024 * 1024  # container output waiting for its log file write
+LOG_POLL_INTERVAL  = 1.0  # seconds between checks of host bots' log files
+
+# Venv cache (kept under BOTS_PATH so clones can hard-link on one filesystem)
+VENV_CACHE_PATH   = f"{BOTS_PATH}/.venv_cache"
+VENV_CACHE_MAX_MB = int(os.getenv("VENV_CACHE_MAX_MB", "5120"))
+
+# Prepared deploy artifacts, keyed by archive SHA-256 (re-uploads skip the whole build)
+ARTIFACT_STORE_PATH   = f"{BOTS_PATH}/.artifacts"
+ARTIFACT_STORE_MAX_MB = int(os.getenv("ARTIFACT_STORE_MAX_MB", "5120"))
 
 # Docker
 DOCKER_ENABLED = os.getenv("DOCKER_ENABLED", "true").lower() == "true"
 DOCKER_NETWORK = "space_deployer_network"
+DOCKER_IO_WORKERS   = 8
+DOCKER_API_TIMEOUT  = 30
+DOCKER_STOP_TIMEOUT = 8      # seconds between SIGTERM and SIGKILL
+DOCKER_MEMORY_LIMIT = os.getenv("DOCKER_MEMORY_LIMIT", "512m")
+DOCKER_CPU_LIMIT    = float(os.getenv("DOCKER_CPU_LIMIT", "0.5"))
+DOCKER_PIDS_LIMIT   = 256
+# Host path of BOTS_PATH when this bot itself runs in a container (bind mount source)
+DOCKER_HOST_BOTS_PATH = os.getenv("DOCKER_HOST_BOTS_PATH", "")
+DOCKER_IMAGE_CACHE_MAX_MB = int(os.getenv("DOCKER_IMAGE_CACHE_MAX_MB", "10240"))
+DOCKER_IMAGES = {
+    "python": "python:3.11-slim",
+    "nodejs": "node:20-slim",
+    "java":   "eclipse-temurin:17-jre"
+}
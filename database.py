@@ -1,22 +1,281 @@
 import asyncio
+import time
 from datetime import datetime, timedelta
 from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError, PyMongoError
 import config
+from utils import crypto
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+def merge_update(target: dict, update: dict):
+    """Fold a later $set/$inc update document into an earlier one"""
+    for operator, fields in update.items():
+        for field, value in fields.items():
+            if operator == "$inc" and field in target.get("$set", {}):
+                target["$set"][field] += value
+            elif operator == "$inc":
+                incs = target.setdefault("$inc", {})
+                incs[field] = incs.get(field, 0) + value
+            else:
+                target.get("$inc", {}).pop(field, None)
+                target.setdefault(operator, {})[field] = value
+    if "$inc" in target and not target["$inc"]:
+        del target["$inc"]
+    return target
+
+class WriteBehindBuffer:
+    """Coalesces per-document updates in memory and flushes them in bulk
+    
+    Updates to the same (collection, filter) are merged, so a burst of
+    activity pings or counter increments becomes one write. Pending
+    operations are flushed as ordered bulk_writes once WRITE_BEHIND_MAX_PENDING
+    documents are dirty or every WRITE_BEHIND_INTERVAL seconds.
+    """
+    
+    def __init__(self, db):
+        self.db = db
+        self.pending = {}
+        # Held while a flush is writing; direct writes take it too so a
+        # flush in flight can never land on top of them
+        self.lock = asyncio.Lock()
+        self._task = None
+        self._flush_task = None
+        
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+            
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            
+    async def _run(self):
+        while True:
+            await asyncio.sleep(config.WRITE_BEHIND_INTERVAL)
+            await self.flush()
+            
+    @staticmethod
+    def _key(collection: str, filter: dict):
+        return collection, tuple(sorted(filter.items()))
+        
+    def add(self, collection: str, filter: dict, update: dict):
+        key = self._key(collection, filter)
+        entry = self.pending.get(key)
+        if entry is None:
+            self.pending[key] = (collection, filter, merge_update({}, update))
+        else:
+            merge_update(entry[2], update)
+            
+        if len(self.pending) >= config.WRITE_BEHIND_MAX_PENDING and (
+                self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.ensure_future(self.flush())
+            
+    def take(self, collection: str, filter: dict):
+        """Remove and return the pending update for one document, if any"""
+        entry = self.pending.pop(self._key(collection, filter), None)
+        return entry[2] if entry else None
+        
+    async def flush(self):
+        """Write all pending updates, one ordered bulk_write per collection"""
+        async with self.lock:
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, {}
+            
+            by_collection = {}
+            for collection, filter, update in pending.values():
+                by_collection.setdefault(collection, []).append((filter, update))
+                
+            for collection, entries in by_collection.items():
+                operations = [UpdateOne(filter, update) for filter, update in entries]
+                try:
+                    await self.db[collection].bulk_write(operations, ordered=True)
+                except BulkWriteError as e:
+                    # Ordered: everything before the first error was applied
+                    failed = e.details["writeErrors"][0]["index"]
+                    logger.error(f"Write-behind flush to {collection} failed at op {failed}: {e.details['writeErrors'][0]['errmsg']}")
+                    self._requeue(collection, entries[failed + 1:])
+                except Exception as e:
+                    logger.error(f"Write-behind flush to {collection} failed: {str(e)}")
+                    self._requeue(collection, entries)
+                    
+    def _requeue(self, collection: str, entries: list):
+        newer, self.pending = self.pending, {}
+        for filter, update in entries:
+            self.add(collection, filter, update)
+        for collection, filter, update in newer.values():
+            self.add(collection, filter, update)
+
+class BanCache:
+    """In-memory set of banned user ids kept in sync with the bans collection
+    
+    Changes made by other controller instances arrive through a change
+    stream. While it is unavailable (standalone mongod, failover) the set
+    is reloaded instead and the stream is retried with backoff, at least
+    every BAN_POLL_INTERVAL seconds.
+    """
+    
+    def __init__(self, db):
+        self.db = db
+        self.banned = set()
+        self.ids = {}
+        self.ready = False
+        self.mode = "loading"
+        self.hits = 0
+        self.misses = 0
+        self._task = None
+        self._load_lock = asyncio.Lock()
+        # Changes seen while a load is reading, replayed on top of its result
+        self._journal = None
+        
+    async def load(self):
+        """Reload the set without losing changes that arrive meanwhile"""
+        async with self._load_lock:
+            journal = self._journal = []
+            banned, ids = set(), {}
+            try:
+                async for ban in self.db.bans.find({}, {"user_id": 1}):
+                    banned.add(ban["user_id"])
+                    ids[ban["_id"]] = ban["user_id"]
+            finally:
+                self._journal = None
+            self.banned, self.ids = banned, ids
+            for method, arg in journal:
+                method(arg)
+            self.ready = True
+        
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._watch())
+            
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            
+    async def _watch(self):
+        delay = config.BAN_STREAM_RETRY_MIN
+        while True:
+            try:
+                async with self.db.bans.watch(full_document="updateLookup") as stream:
+                    self.mode = "change_stream"
+                    delay = config.BAN_STREAM_RETRY_MIN
+                    # Catch anything that changed before the stream opened
+                    await self.load()
+                    async for change in stream:
+                        self._apply(change)
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                if self.mode != "polling":
+                    logger.warning(f"Ban change stream unavailable ({str(e)}), polling until it is back")
+                    
+            self.mode = "polling"
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, config.BAN_POLL_INTERVAL)
+            try:
+                await self.load()
+            except PyMongoError as e:
+                logger.error(f"Ban cache reload failed: {str(e)}")
+                
+    def _apply(self, change: dict):
+        if self._journal is not None:
+            self._journal.append((self._apply, change))
+        operation = change["operationType"]
+        doc_id = change.get("documentKey", {}).get("_id")
+        if operation in ("insert", "update", "replace") and change.get("fullDocument"):
+            user_id = change["fullDocument"]["user_id"]
+            self.ids[doc_id] = user_id
+            self.banned.add(user_id)
+        elif operation == "delete" and doc_id in self.ids:
+            self.banned.discard(self.ids.pop(doc_id))
+            
+    def add(self, user_id: int):
+        if self._journal is not None:
+            self._journal.append((self.add, user_id))
+        self.banned.add(user_id)
+        
+    def discard(self, user_id: int):
+        if self._journal is not None:
+            self._journal.append((self.discard, user_id))
+        self.banned.discard(user_id)
+        
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "size": len(self.banned),
+            "hits": self.hits,
+            "misses": self.misses
+        }
 
 class Database:
     def __init__(self):
         self.client = None
         self.db = None
+        self.writes = None
+        self.bans = None
+        # user_id -> (monotonic deadline, snapshot); bot_id -> user_id for invalidation
+        self.snapshots = {}
+        self.bot_owners = {}
+        # Last status this instance wrote per bot, to spot running <-> not running changes
+        self.bot_status = {}
+        self._stats_task = None
+        # One re-encryption pass at a time, or an older pass could retire a key still in use
+        self._reencrypt_lock = asyncio.Lock()
         
     async def initialize(self):
         """Initialize database connection"""
-        self.client = AsyncIOMotorClient(config.MONGODB_URI)
+        if self.client is not None:
+            return
+            
+        self.client = AsyncIOMotorClient(config.MONGODB_URI, maxPoolSize=config.MONGODB_POOL_SIZE)
         self.db = self.client[config.DATABASE_NAME]
         
         # Create indexes
         await self.create_indexes()
         
+        self.writes = WriteBehindBuffer(self.db)
+        self.writes.start()
+        
+        self.bans = BanCache(self.db)
+        await self.bans.load()
+        self.bans.start()
+        
+        self._stats_task = asyncio.ensure_future(self._reconcile_stats_forever())
+        
+    async def close(self):
+        """Flush buffered writes and close the connection"""
+        if self._stats_task is not None:
+            self._stats_task.cancel()
+            self._stats_task = None
+        if self.bans is not None:
+            self.bans.stop()
+        if self.writes is not None:
+            self.writes.stop()
+            await self.writes.flush()
+        if self.client is not None:
+            self.client.close()
+            
+    async def write(self, collection: str, filter: dict, update: dict, strict: bool = False):
+        """Buffer an update, or apply it immediately when strict
+        
+        A strict write folds in anything still buffered for the same
+        document first, so later reads see every earlier write.
+        """
+        if not strict:
+            self.writes.add(collection, filter, update)
+            return
+        async with self.writes.lock:
+            pending = self.writes.take(collection, filter)
+            if pending:
+                update = merge_update(pending, update)
+            await self.db[collection].update_one(filter, update)
+        
     async def create_indexes(self):
         """Create database indexes"""
         # Users collection
@@ -33,6 +292,17 @@ class Database:
         # Bans collection
         await self.db.bans.create_index("user_id", unique=True)
         
+        # Broadcast progress
+        await self.db.broadcasts.create_index("status")
+        await self.db.broadcast_recipients.create_index([("broadcast_id", 1), ("seq", 1)], unique=True)
+        await self.db.broadcast_deliveries.create_index(
+            [("broadcast_id", 1), ("chat_id", 1)], unique=True
+        )
+        
+        # Deploy job queue
+        await self.db.deploy_jobs.create_index([("status", 1), ("priority", 1), ("created_at", 1)])
+        await self.db.deploy_jobs.create_index("finished_at", expireAfterSeconds=config.DEPLOY_JOB_RETENTION)
+        
     async def register_user(self, user_id: int, username: str, first_name: str):
         """Register a new user"""
         user_data = {
@@ -45,23 +315,34 @@ class Database:
             "active_bots": 0
         }
         
-        await self.db.users.update_one(
+        result = await self.db.users.update_one(
             {"user_id": user_id},
             {"$setOnInsert": user_data},
             upsert=True
         )
         
+        if result.upserted_id is not None:
+            await self.bump_stats({"total_users": 1})
+        
     async def get_user(self, user_id: int):
         """Get user information"""
         return await self.db.users.find_one({"user_id": user_id})
         
-    async def update_user_activity(self, user_id: int):
+    async def update_user_activity(self, user_id: int, strict: bool = False):
         """Update user's last activity"""
-        await self.db.users.update_one(
+        await self.write(
+            "users",
             {"user_id": user_id},
-            {"$set": {"last_active": datetime.utcnow()}}
+            {"$set": {"last_active": datetime.utcnow()}},
+            strict
         )
         
+    async def get_broadcast_recipients(self):
+        """User ids of every registered, non-banned user"""
+        cursor = self.db.users.find({}, {"_id": 0, "user_id": 1})
+        banned = self.bans.banned if self.bans is not None and self.bans.ready else set()
+        return [user["user_id"] async for user in cursor if user["user_id"] not in banned]
+        
     async def ban_user(self, user_id: int, reason: str):
         """Ban a user"""
         ban_data = {
@@ -76,14 +357,24 @@ class Database:
             {"$set": ban_data},
             upsert=True
         )
+        self.bans.add(user_id)
+        self.invalidate_snapshot(user_id)
         
     async def unban_user(self, user_id: int):
         """Unban a user"""
         await self.db.bans.delete_one({"user_id": user_id})
+        self.bans.discard(user_id)
+        self.invalidate_snapshot(user_id)
         
     async def is_user_banned(self, user_id: int) -> bool:
-        """Check if user is banned"""
-        ban = await self.db.bans.find_one({"user_id": user_id})
+        """Check if user is banned (served from the ban cache once loaded)"""
+        if self.bans is not None and self.bans.ready:
+            self.bans.hits += 1
+            return user_id in self.bans.banned
+            
+        if self.bans is not None:
+            self.bans.misses += 1
+        ban = await self.db.bans.find_one({"user_id": user_id}, {"_id": 1})
         return ban is not None
         
     async def create_bot(self, user_id: int, bot_data: dict):
@@ -101,13 +392,102 @@ class Database:
         result = await self.db.bots.insert_one(bot_data)
         
         # Update user bot count
-        await self.db.users.update_one(
-            {"user_id": user_id},
-            {"$inc": {"total_bots": 1}}
-        )
+        await self.write("users", {"user_id": user_id}, {"$inc": {"total_bots": 1}})
+        await self.bump_stats({"total_bots": 1})
+        self.bot_status[bot_data["bot_id"]] = "created"
+        
+        self.invalidate_snapshot(user_id)
         
         return str(result.inserted_id)
         
+    async def get_user_snapshot(self, user_id: int):
+        """Compact dashboard data for a user in one aggregation (cached briefly)
+        
+        Returns None for users that are not registered yet.
+        """
+        cached = self.snapshots.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            return self._with_ban_flag(cached[1])
+            
+        pipeline = [
+            {"$match": {"user_id": user_id}},
+            {"$project": {"_id": 0, "user_id": 1}},
+            {"$lookup": {
+                "from": "bans",
+                "localField": "user_id",
+                "foreignField": "user_id",
+                "pipeline": [{"$project": {"_id": 1}}],
+                "as": "ban"
+            }},
+            {"$lookup": {
+                "from": "subscriptions",
+                "localField": "user_id",
+                "foreignField": "user_id",
+                "pipeline": [{"$project": {"_id": 0, "plan": 1, "expires_at": 1, "active": 1}}],
+                "as": "subscription"
+            }},
+            {"$lookup": {
+                "from": "bots",
+                "localField": "user_id",
+                "foreignField": "user_id",
+                "pipeline": [{"$group": {
+                    "_id": "$status",
+                    "bot_ids": {"$push": "$bot_id"}
+                }}],
+                "as": "bot_counts"
+            }}
+        ]
+        docs = await self.db.users.aggregate(pipeline).to_list(length=1)
+        if not docs:
+            return None
+        doc = docs[0]
+        
+        subscription = doc["subscription"][0] if doc["subscription"] else None
+        premium = bool(
+            subscription
+            and subscription.get("active", True)
+            and subscription["expires_at"] > datetime.utcnow()
+        )
+        bot_counts = {}
+        for group in doc["bot_counts"]:
+            for bot_id in group["bot_ids"]:
+                self.bot_owners[bot_id] = user_id
+                # Buffered status writes may not be flushed yet; the
+                # in-memory status is newer than what was just read
+                status = self.bot_status.get(bot_id, group["_id"])
+                bot_counts[status] = bot_counts.get(status, 0) + 1
+                
+        snapshot = {
+            "user_id": user_id,
+            "banned": bool(doc["ban"]),
+            "premium": premium,
+            "plan": subscription["plan"] if premium else "free",
+            "expires_at": subscription["expires_at"] if premium else None,
+            "bot_counts": bot_counts,
+            "total_bots": sum(bot_counts.values())
+        }
+        self.snapshots[user_id] = (time.monotonic() + config.USER_SNAPSHOT_TTL, snapshot)
+        return self._with_ban_flag(snapshot)
+        
+    async def get_or_create_user_snapshot(self, user_id: int, username: str, first_name: str):
+        """Snapshot for a user, registering them on first contact"""
+        snapshot = await self.get_user_snapshot(user_id)
+        if snapshot is None:
+            await self.register_user(user_id, username, first_name)
+            snapshot = await self.get_user_snapshot(user_id)
+        return snapshot
+        
+    def _with_ban_flag(self, snapshot: dict) -> dict:
+        # The ban cache is authoritative and costs nothing once loaded
+        snapshot = dict(snapshot)
+        if self.bans is not None and self.bans.ready:
+            snapshot["banned"] = snapshot["user_id"] in self.bans.banned
+        return snapshot
+        
+    def invalidate_snapshot(self, user_id: int):
+        """Forget a user's cached snapshot after a lifecycle change"""
+        self.snapshots.pop(user_id, None)
+        
     async def get_user_bots(self, user_id: int):
         """Get all bots for a user"""
         cursor = self.db.bots.find({"user_id": user_id})
@@ -120,41 +500,141 @@ class Database:
             "bot_id": bot_id
         })
         
-    async def update_bot_status(self, user_id: int, bot_id: str, status: str):
-        """Update bot status"""
-        await self.db.bots.update_one(
-            {"user_id": user_id, "bot_id": bot_id},
-            {
-                "$set": {
-                    "status": status,
-                    "updated_at": datetime.utcnow()
-                }
+    async def get_bot_by_id(self, bot_id: str, projection: dict = None):
+        """Get a bot by bot_id, optionally limited to projected fields"""
+        return await self.db.bots.find_one({"bot_id": bot_id}, projection)
+        
+    async def get_bots_by_ids(self, bot_ids: list, projection: dict = None):
+        """Get many bots in one query, keyed by bot_id"""
+        if projection is not None:
+            projection = {**projection, "bot_id": 1}
+        cursor = self.db.bots.find({"bot_id": {"$in": list(bot_ids)}}, projection)
+        return {bot["bot_id"]: bot async for bot in cursor}
+        
+    async def update_bot_runtime(self, bot_id: str, status: str, fields: dict = None, strict: bool = False):
+        """Update a bot's status and runtime fields (exit code, restarts, ...)"""
+        if bot_id in self.bot_owners:
+            self.invalidate_snapshot(self.bot_owners[bot_id])
+            
+        filter = {"bot_id": bot_id}
+        update = {
+            "$set": {
+                "status": status,
+                "updated_at": datetime.utcnow(),
+                **(fields or {})
             }
+        }
+        running = status == "running"
+        known = self.bot_status.get(bot_id)
+        self.bot_status[bot_id] = status
+        
+        if not strict and known is not None and (known == "running") == running:
+            # active_bots is unaffected, so this can be buffered
+            await self.write("bots", filter, update)
+            return
+            
+        # Read the previous status atomically to keep active_bots exact
+        async with self.writes.lock:
+            pending = self.writes.take("bots", filter)
+            if pending:
+                update = merge_update(pending, update)
+            previous = await self.db.bots.find_one_and_update(
+                filter, update,
+                projection={"_id": 0, "status": 1},
+                return_document=ReturnDocument.BEFORE
+            )
+        if previous and (previous.get("status") == "running") != running:
+            await self.bump_stats({"active_bots": 1 if running else -1})
+        
+    async def get_bots_with_status(self, statuses: list, projection: dict = None):
+        """Get every bot whose status is one of statuses"""
+        cursor = self.db.bots.find({"status": {"$in": list(statuses)}}, projection)
+        return await cursor.to_list(length=None)
+        
+    async def get_premium_user_ids(self, user_ids) -> set:
+        """Subset of user_ids with an active, unexpired subscription"""
+        cursor = self.db.subscriptions.find(
+            {"user_id": {"$in": list(user_ids)}, "active": True, "expires_at": {"$gt": datetime.utcnow()}},
+            {"_id": 0, "user_id": 1}
         )
+        return {sub["user_id"] async for sub in cursor}
+        
+    async def bulk_set_bot_status(self, statuses: dict, fields: dict = None):
+        """Set many bots' statuses in one bulk_write and adjust active_bots"""
+        if not statuses:
+            return
+        now = datetime.utcnow()
+        operations = []
+        async with self.writes.lock:
+            # Direct status writes hold the same lock, so these stay current
+            cursor = self.db.bots.find({"bot_id": {"$in": list(statuses)}}, {"_id": 0, "bot_id": 1, "status": 1})
+            previous = {bot["bot_id"]: bot.get("status") async for bot in cursor}
+            for bot_id, status in statuses.items():
+                pending = self.writes.take("bots", {"bot_id": bot_id})
+                update = {"$set": {"status": status, "updated_at": now, **(fields or {})}}
+                if pending:
+                    update = merge_update(pending, update)
+                operations.append(UpdateOne({"bot_id": bot_id}, update))
+                self.bot_status[bot_id] = status
+                if bot_id in self.bot_owners:
+                    self.invalidate_snapshot(self.bot_owners[bot_id])
+            await self.db.bots.bulk_write(operations, ordered=False)
+            
+        delta = sum(
+            (status == "running") - (previous[bot_id] == "running")
+            for bot_id, status in statuses.items() if bot_id in previous
+        )
+        await self.bump_stats({"active_bots": delta})
+        
+    async def mark_bots_for_resume(self, bot_ids: list):
+        """Remember bots stopped by a fleet-wide stop so they can be resumed"""
+        await self.db.bots.update_many({"bot_id": {"$in": list(bot_ids)}}, {"$set": {"resume_pending": True}})
+        
+    async def get_bots_pending_resume(self) -> list:
+        cursor = self.db.bots.find({"resume_pending": True}, {"_id": 0, "bot_id": 1})
+        return [bot["bot_id"] async for bot in cursor]
+        
+    async def clear_resume_pending(self, bot_ids: list):
+        await self.db.bots.update_many({"bot_id": {"$in": list(bot_ids)}}, {"$unset": {"resume_pending": ""}})
         
+    async def bulk_update_bot_metrics(self, metrics: dict):
+        """Write sampled resource usage for many bots in one bulk_write"""
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne({"bot_id": bot_id}, {"$set": {**values, "metrics_at": now}})
+            for bot_id, values in metrics.items()
+        ]
+        if operations:
+            await self.db.bots.bulk_write(operations, ordered=False)
+            
     async def delete_bot(self, user_id: int, bot_id: str):
         """Delete a bot"""
-        result = await self.db.bots.delete_one({
-            "user_id": user_id,
-            "bot_id": bot_id
-        })
+        deleted = await self.db.bots.find_one_and_delete(
+            {"user_id": user_id, "bot_id": bot_id},
+            projection={"_id": 0, "status": 1}
+        )
         
-        if result.deleted_count > 0:
+        if deleted is not None:
             # Update user bot count
-            await self.db.users.update_one(
-                {"user_id": user_id},
-                {"$inc": {"total_bots": -1}}
-            )
+            await self.write("users", {"user_id": user_id}, {"$inc": {"total_bots": -1}})
+            await self.bump_stats({
+                "total_bots": -1,
+                "active_bots": -1 if deleted.get("status") == "running" else 0
+            })
             
-        return result.deleted_count > 0
+        self.bot_status.pop(bot_id, None)
+        self.bot_owners.pop(bot_id, None)
+        self.invalidate_snapshot(user_id)
+        return deleted is not None
         
     async def store_bot_token(self, user_id: int, bot_id: str, token: str, bot_info: dict):
-        """Store bot token (plain text as per owner's request)"""
+        """Store bot token encrypted under the current key"""
         await self.db.bots.update_one(
             {"user_id": user_id, "bot_id": bot_id},
             {
                 "$set": {
-                    "bot_token": token,
+                    "bot_token": crypto.encrypt(token),
+                    "token_key_id": crypto.current_key_id(),
                     "bot_username": bot_info.get('username'),
                     "bot_name": bot_info['first_name'],
                     "telegram_bot_id": bot_info['id'],
@@ -164,6 +644,88 @@ class Database:
             }
         )
         
+    async def reencrypt_bot_tokens(self) -> dict:
+        """Rewrite every stored token under the current key
+        
+        Plain-text tokens (no token_key_id) are encrypted, tokens under an
+        older key are rotated. Runs online: each write is conditional on the
+        token it read, so a concurrent store_bot_token always wins (those
+        tokens are counted as superseded).
+        """
+        async with self._reencrypt_lock:
+            return await self._reencrypt_bot_tokens()
+            
+    async def _reencrypt_bot_tokens(self) -> dict:
+        key_id = crypto.current_key_id()
+        counts = {"migrated": 0, "reencrypted": 0, "superseded": 0, "failed": 0}
+        semaphore = asyncio.Semaphore(config.TOKEN_REENCRYPT_CONCURRENCY)
+        tasks = []
+        
+        def convert(batch):
+            operations, outcomes = [], []
+            for bot in batch:
+                try:
+                    if bot.get("token_key_id"):
+                        token = crypto.reencrypt(bot["bot_token"])
+                        outcomes.append("reencrypted")
+                    else:
+                        token = crypto.encrypt(bot["bot_token"])
+                        outcomes.append("migrated")
+                except Exception as e:
+                    logger.error(f"Cannot re-encrypt token of bot {bot['bot_id']}: {str(e)}")
+                    outcomes.append("failed")
+                    continue
+                operations.append(UpdateOne(
+                    {"bot_id": bot["bot_id"], "bot_token": bot["bot_token"]},
+                    {"$set": {"bot_token": token, "token_key_id": key_id}}
+                ))
+            return operations, outcomes
+            
+        async def process(batch):
+            try:
+                operations, outcomes = await asyncio.to_thread(convert, batch)
+                if operations:
+                    result = await self.db.bots.bulk_write(operations, ordered=False)
+                    counts["superseded"] += len(operations) - result.matched_count
+                for outcome in outcomes:
+                    counts[outcome] += 1
+            finally:
+                semaphore.release()
+                
+        cursor = self.db.bots.find(
+            {"token_configured": True, "bot_token": {"$type": "string"}, "token_key_id": {"$ne": key_id}},
+            {"_id": 0, "bot_id": 1, "bot_token": 1, "token_key_id": 1},
+            batch_size=config.DB_BATCH_SIZE
+        )
+        batch = []
+        async for bot in cursor:
+            batch.append(bot)
+            if len(batch) >= config.DB_BATCH_SIZE:
+                await semaphore.acquire()
+                tasks.append(asyncio.ensure_future(process(batch)))
+                batch = []
+        if batch:
+            await semaphore.acquire()
+            tasks.append(asyncio.ensure_future(process(batch)))
+            
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f"Token re-encryption batch failed: {str(result)}")
+                counts["failed"] += 1
+                
+        # Old keys can go once nothing depends on them (and no newer rotation raced us)
+        if not counts["failed"] and crypto.current_key_id() == key_id:
+            remaining = await self.db.bots.count_documents(
+                {"token_configured": True, "token_key_id": {"$ne": key_id}}
+            )
+            if remaining:
+                logger.warning(f"{remaining} bot tokens are still under an old key; keeping old keys")
+            else:
+                await asyncio.to_thread(crypto.retire_old_keys)
+            
+        logger.info(f"Bot token re-encryption finished: {counts}")
+        return counts
+        
     async def store_user_requirements(self, user_id: int, requirements: str):
         """Store user's requirements.txt"""
         await self.db.users.update_one(
@@ -176,16 +738,55 @@ class Database:
         user = await self.db.users.find_one({"user_id": user_id})
         return user.get("custom_requirements", "") if user else ""
         
+    async def bump_stats(self, inc: dict):
+        """Adjust the materialized platform counters (buffered)"""
+        inc = {field: value for field, value in inc.items() if value}
+        if inc:
+            await self.write("stats", {"_id": "platform"}, {"$inc": inc})
+            
     async def get_total_stats(self):
-        """Get total platform statistics"""
-        total_users = await self.db.users.count_documents({})
-        total_bots = await self.db.bots.count_documents({})
-        active_bots = await self.db.bots.count_documents({"status": "running"})
-        premium_users = await self.db.subscriptions.count_documents({"active": True})
-        
+        """Get total platform statistics from the materialized stats document"""
+        stats = await self.db.stats.find_one({"_id": "platform"})
+        if stats is None:
+            stats = await self.reconcile_stats()
+            
         return {
-            "total_users": total_users,
-            "total_bots": total_bots,
-            "active_bots": active_bots,
-            "premium_users": premium_users
+            "total_users": stats.get("total_users", 0),
+            "total_bots": stats.get("total_bots", 0),
+            "active_bots": stats.get("active_bots", 0),
+            "premium_users": stats.get("premium_users", 0),
+            "total_subscriptions": stats.get("total_subscriptions", 0),
+            "plans": {plan: count for plan, count in stats.get("plans", {}).items() if count > 0}
+        }
+        
+    async def reconcile_stats(self):
+        """Recount every platform counter from the source collections"""
+        # Apply buffered increments first so they are not counted twice
+        await self.writes.flush()
+        
+        plans = {}
+        async for group in self.db.subscriptions.aggregate([
+            {"$match": {"active": True}},
+            {"$group": {"_id": "$plan", "count": {"$sum": 1}}}
+        ]):
+            plans[str(group["_id"] or "unknown")] = group["count"]
+            
+        stats = {
+            "total_users": await self.db.users.count_documents({}),
+            "total_bots": await self.db.bots.count_documents({}),
+            "active_bots": await self.db.bots.count_documents({"status": "running"}),
+            "premium_users": sum(plans.values()),
+            "total_subscriptions": await self.db.subscriptions.count_documents({}),
+            "plans": plans,
+            "reconciled_at": datetime.utcnow()
         }
+        await self.db.stats.replace_one({"_id": "platform"}, stats, upsert=True)
+        return stats
+        
+    async def _reconcile_stats_forever(self):
+        while True:
+            try:
+                await self.reconcile_stats()
+            except Exception as e:
+                logger.error(f"Stats reconciliation failed: {str(e)}")
+            await asyncio.sleep(config.STATS_RECONCILE_INTERVAL)
@@ -0,0 +1,185 @@
+"""
+Persistent deploy job queue.
+
+Uploads are stored as jobs in the deploy_jobs collection and drained by
+DEPLOY_WORKERS workers (one per core by default), so a burst of uploads
+never runs more pip/npm installs at once than the host can take.  Jobs
+are claimed atomically, premium before free and oldest first, and at
+most one job per user runs at a time.  Jobs left running by a controller
+that died are queued again on start, up to DEPLOY_JOB_MAX_ATTEMPTS
+times.  Each job runs under its own timeout and exception guard, so a
+failing or hung deploy only ever costs one worker one job.  Outcomes are
+recorded first and then handed to notify, so the user hears about every
+result, including timeouts, crashes and jobs put back in the queue.
+
+Jobs only hold Telegram file ids, not archives: the worker downloads the
+upload itself, so nothing but the job document has to survive a restart.
+"""
+import asyncio
+import math
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from pymongo import ReturnDocument
+import config
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+PRIORITY_PREMIUM = 0
+PRIORITY_FREE = 1
+
+
+class DeployQueue:
+    def __init__(self, db, runner, notify, workers: int = None):
+        """runner is an async callable taking a job document and returning a result dict;
+        notify(job, result) reports the recorded result, or result None when the job was queued again"""
+        self.db = db
+        self.runner = runner
+        self.notify = notify
+        self.workers = workers or config.DEPLOY_WORKERS
+        self.jobs = db.db.deploy_jobs
+        self.running = set()
+        self.durations = deque(maxlen=20)
+        self._wakeup = asyncio.Event()
+        self._claim_lock = asyncio.Lock()
+        self._tasks = []
+
+    async def start(self):
+        """Recover jobs interrupted by the last shutdown and start the workers"""
+        result = {"success": False, "error": "Deploy was interrupted too many times"}
+        abandoned = await self.jobs.find(
+            {"status": "running", "attempts": {"$gte": config.DEPLOY_JOB_MAX_ATTEMPTS}}
+        ).to_list(None)
+        if abandoned:
+            await self.jobs.update_many(
+                {"_id": {"$in": [job["_id"] for job in abandoned]}},
+                {"$set": {"status": "failed", "result": result, "finished_at": datetime.utcnow()}}
+            )
+        requeued = await self.jobs.update_many({"status": "running"}, {"$set": {"status": "queued"}})
+        if requeued.modified_count or abandoned:
+            logger.info(
+                f"Deploy queue: {requeued.modified_count} interrupted jobs requeued, "
+                f"{len(abandoned)} given up"
+            )
+        for job in abandoned:
+            await self._notify(job, result)
+        # Interrupted jobs still show the step they were stopped at
+        async for job in self.jobs.find({"status": "queued", "started_at": {"$exists": True}}):
+            await self._notify(job, None)
+        self._tasks = [asyncio.ensure_future(self._work(n)) for n in range(self.workers)]
+
+    async def stop(self):
+        """Stop the workers; jobs in progress are picked up again on next start"""
+        interrupted = list(self.running)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if interrupted:
+            # A clean shutdown is not the job's fault: don't count the attempt
+            await self.jobs.update_many(
+                {"_id": {"$in": interrupted}, "status": "running"},
+                {"$set": {"status": "queued"}, "$inc": {"attempts": -1}}
+            )
+
+    async def submit(self, kind: str, user_id: int, premium: bool, **fields) -> dict:
+        """Queue a job and return {"job_id", "position", "eta"} (eta in seconds)"""
+        job = {
+            "_id": str(uuid.uuid4()),
+            "kind": kind,
+            "user_id": user_id,
+            "priority": PRIORITY_PREMIUM if premium else PRIORITY_FREE,
+            "status": "queued",
+            "attempts": 0,
+            "created_at": datetime.utcnow(),
+            **fields
+        }
+        await self.jobs.insert_one(job)
+        self._wakeup.set()
+        position = await self.position(job)
+        return {"job_id": job["_id"], "position": position, "eta": self.eta(position)}
+
+    async def position(self, job: dict) -> int:
+        """1-based place of a queued job in the order workers will claim it"""
+        ahead = await self.jobs.count_documents({
+            "status": "queued",
+            "_id": {"$ne": job["_id"]},
+            "$or": [
+                {"priority": {"$lt": job["priority"]}},
+                {"priority": job["priority"], "created_at": {"$lte": job["created_at"]}}
+            ]
+        })
+        return ahead + 1
+
+    def eta(self, position: int) -> float:
+        """Rough seconds until the job at position is done"""
+        average = sum(self.durations) / len(self.durations) if self.durations else config.DEPLOY_JOB_ESTIMATE
+        # Jobs in progress hold workers too; each wave of workers takes about one average job
+        return math.ceil((position + len(self.running)) / self.workers) * average
+
+    async def _claim(self):
+        # A user's jobs run one at a time: two builds of the same user's
+        # uploads would race on the plan limit and on the same bot
+        async with self._claim_lock:
+            busy = await self.jobs.distinct("user_id", {"status": "running"})
+            return await self.jobs.find_one_and_update(
+                {"status": "queued", "user_id": {"$nin": busy}},
+                {"$set": {"status": "running", "started_at": datetime.utcnow()}, "$inc": {"attempts": 1}},
+                sort=[("priority", 1), ("created_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+
+    async def _work(self, n: int):
+        while True:
+            try:
+                self._wakeup.clear()
+                job = await self._claim()
+            except Exception as e:
+                logger.error(f"Deploy worker {n} could not claim a job: {str(e)}")
+                await asyncio.sleep(config.DEPLOY_QUEUE_POLL)
+                continue
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=config.DEPLOY_QUEUE_POLL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(job)
+
+    async def _notify(self, job: dict, result):
+        try:
+            await self.notify(job, result)
+        except Exception as e:
+            logger.error(f"Failed to report deploy job {job['_id']}: {str(e)}")
+
+    async def _run(self, job: dict):
+        """Run, record and report one job; never raises except on cancellation"""
+        self.running.add(job["_id"])
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(self.runner(job), timeout=config.DEPLOY_JOB_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"Deploy job {job['_id']} timed out")
+            result = {"success": False, "error": "Deployment took too long and was stopped"}
+        except Exception as e:
+            logger.error(f"Deploy job {job['_id']} failed: {str(e)}")
+            result = {"success": False, "error": str(e)}
+        finally:
+            self.running.discard(job["_id"])
+
+        self.durations.append(time.monotonic() - started)
+        try:
+            await self.jobs.update_one({"_id": job["_id"]}, {"$set": {
+                "status": "done" if result.get("success") else "failed",
+                "result": {k: result.get(k) for k in ("success", "error", "bot_id")},
+                "finished_at": datetime.utcnow()
+            }})
+        except Exception as e:
+            logger.error(f"Failed to record deploy job {job['_id']}: {str(e)}")
+        # The user's next job may have been held back behind this one
+        self._wakeup.set()
+        await self._notify(job, result)
@@ -0,0 +1,260 @@
+"""
+Docker runtime for hosted bots.
+
+Every Docker API call runs in a dedicated thread pool, so a slow daemon
+never stalls the event loop.  One long-lived subscription to the events
+API (filtered to our label) reports container exits and OOM kills, which
+replaces per-container wait/inspect polling.  Each container is exposed
+as a ContainerProcess, an asyncio.subprocess.Process look-alike, so the
+log collector, supervisor and resource sampler treat it like any other
+child.  The sampler measures containers through their host PID in /proc.
+
+Point DockerBackend at a stand-in daemon with base_url (or DOCKER_HOST).
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import docker
+from docker.errors import DockerException, NotFound
+import config
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+LABEL = "space.bot_id"
+
+
+class ContainerProcess:
+    """Process-like handle for a bot container"""
+
+    def __init__(self, backend, container_id: str, pid: int):
+        self.backend = backend
+        self.container_id = container_id
+        self.pid = pid
+        self.returncode = None
+        self.oom_killed = False
+        self.stdout = asyncio.StreamReader(limit=config.LOG_READ_CHUNK)
+        self.stderr = None
+        self._exited = asyncio.get_running_loop().create_future()
+
+    async def wait(self) -> int:
+        return await asyncio.shield(self._exited)
+
+    def set_exit(self, code: int):
+        if self._exited.done():
+            return
+        self.returncode = code
+        self._exited.set_result(code)
+
+    def terminate(self):
+        asyncio.ensure_future(self.backend.stop(self.container_id))
+
+    def kill(self):
+        asyncio.ensure_future(self.backend.stop(self.container_id, timeout=0))
+
+
+class DockerBackend:
+    def __init__(self, base_url: str = None):
+        self.base_url = base_url
+        self.client = None
+        self.available = False
+        self.containers = {}      # container id -> ContainerProcess
+        self.early_exits = {}     # exits seen before the container was registered
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.DOCKER_IO_WORKERS,
+            thread_name_prefix="docker-io"
+        )
+        self._events = None
+        self._events_thread = None
+        self._loop = None
+        self._closing = False
+
+    async def call(self, func, *args, **kwargs):
+        """Run a blocking Docker SDK call in the Docker pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: func(*args, **kwargs))
+
+    def _connect(self):
+        if self.base_url:
+            client = docker.DockerClient(base_url=self.base_url, timeout=config.DOCKER_API_TIMEOUT)
+        else:
+            client = docker.from_env(timeout=config.DOCKER_API_TIMEOUT)
+        client.ping()
+        return client
+
+    async def start(self) -> bool:
+        """Connect, make sure the bot network exists and subscribe to events"""
+        self._loop = asyncio.get_running_loop()
+        try:
+            self.client = await self.call(self._connect)
+            await self.call(self._ensure_network)
+        except DockerException as e:
+            logger.warning(f"Docker unavailable, bots will run as local processes: {str(e)}")
+            return False
+
+        self._events_thread = threading.Thread(target=self._consume_events, name="docker-events", daemon=True)
+        self._events_thread.start()
+        self.available = True
+        return True
+
+    def _ensure_network(self):
+        try:
+            self.client.networks.get(config.DOCKER_NETWORK)
+        except NotFound:
+            self.client.networks.create(config.DOCKER_NETWORK, driver="bridge")
+
+    async def close(self):
+        self._closing = True
+        if self._events is not None:
+            await self.call(self._events.close)
+        self.executor.shutdown(wait=False)
+        if self.client is not None:
+            self.client.close()
+
+    def _consume_events(self):
+        """Follow container events for our label (blocking, own thread)"""
+        backoff = 1
+        while not self._closing:
+            try:
+                self._events = self.client.events(
+                    decode=True,
+                    filters={"type": "container", "label": LABEL}
+                )
+                backoff = 1
+                for event in self._events:
+                    self._loop.call_soon_threadsafe(self._on_event, event)
+            except Exception as e:
+                if self._closing:
+                    break
+                logger.error(f"Docker event stream failed: {str(e)}")
+            if not self._closing:
+                threading.Event().wait(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _on_event(self, event: dict):
+        action = event.get("Action") or event.get("status")
+        container_id = event.get("id")
+        process = self.containers.get(container_id)
+
+        if action == "oom" and process is not None:
+            process.oom_killed = True
+            logger.warning(f"Container {container_id[:12]} ran out of memory")
+        elif action == "die":
+            code = int(event.get("Actor", {}).get("Attributes", {}).get("exitCode", -1))
+            if process is None:
+                self.early_exits[container_id] = code
+                if len(self.early_exits) > 256:
+                    del self.early_exits[next(iter(self.early_exits))]
+                return
+            self._finish(container_id, code)
+
+    def _finish(self, container_id: str, code: int):
+        process = self.containers.pop(container_id, None)
+        if process is not None:
+            process.set_exit(code)
+        asyncio.ensure_future(self.remove(container_id))
+
+    async def run(self, bot_id: str, image: str, command: list, workdir: str, env: dict) -> ContainerProcess:
+        """Start a bot container with resource limits on the bot network"""
+        name = f"space-bot-{bot_id}"
+        await self.remove(name)
+
+        container = await self.call(
+            self.client.containers.run,
+            image, command,
+            name=name,
+            detach=True,
+            labels={LABEL: bot_id},
+            environment=env,
+            network=config.DOCKER_NETWORK,
+            mem_limit=config.DOCKER_MEMORY_LIMIT,
+            memswap_limit=config.DOCKER_MEMORY_LIMIT,
+            nano_cpus=int(config.DOCKER_CPU_LIMIT * 1e9),
+            pids_limit=config.DOCKER_PIDS_LIMIT,
+            volumes={host_path(workdir): {"bind": "/app", "mode": "rw"}},
+            working_dir="/app"
+        )
+        await self.call(container.reload)
+
+        return self._track(container)
+
+    async def list_bot_containers(self) -> dict:
+        """Running bot containers keyed by bot_id; exited leftovers are removed"""
+        containers = await self.call(self.client.containers.list, all=True, filters={"label": LABEL})
+        running = {}
+        for container in containers:
+            if container.status == "running" and container.id not in self.containers:
+                running[container.labels[LABEL]] = container
+            elif container.status in ("exited", "dead", "created"):
+                await self.remove(container.id)
+        return running
+
+    def adopt(self, container) -> ContainerProcess:
+        """Track a container started by a previous run of this controller"""
+        return self._track(container, since=int(time.time()))
+
+    def _track(self, container, since: int = None) -> ContainerProcess:
+        process = ContainerProcess(self, container.id, container.attrs["State"].get("Pid") or None)
+        self.containers[container.id] = process
+        self._stream_logs(container, process, since)
+
+        # The container may have died before it was registered above
+        if container.id in self.early_exits:
+            self._finish(container.id, self.early_exits.pop(container.id))
+        elif container.status == "exited":
+            self._finish(container.id, container.attrs["State"].get("ExitCode", -1))
+        return process
+
+    def _stream_logs(self, container, process: ContainerProcess, since: int = None):
+        """Feed the container's combined output into process.stdout"""
+        loop = asyncio.get_running_loop()
+        reader = process.stdout
+
+        def follow():
+            try:
+                for chunk in container.logs(stream=True, follow=True, since=since):
+                    loop.call_soon_threadsafe(reader.feed_data, chunk)
+            except Exception as e:
+                logger.debug(f"Log stream of {container.id[:12]} ended: {str(e)}")
+            finally:
+                loop.call_soon_threadsafe(reader.feed_eof)
+
+        threading.Thread(target=follow, name=f"docker-logs-{container.id[:12]}", daemon=True).start()
+
+    async def stop(self, container_id: str, timeout: int = None):
+        """Stop a container (SIGTERM, then SIGKILL after timeout)"""
+        timeout = config.DOCKER_STOP_TIMEOUT if timeout is None else timeout
+        try:
+            container = await self.call(self.client.containers.get, container_id)
+            await self.call(container.stop, timeout=timeout)
+        except NotFound:
+            pass
+        except DockerException as e:
+            logger.error(f"Failed to stop container {container_id[:12]}: {str(e)}")
+
+    async def stop_many(self, container_ids: list, timeout: int = None):
+        """Stop many containers concurrently, bounded by the Docker pool"""
+        await asyncio.gather(*(self.stop(container_id, timeout) for container_id in container_ids))
+
+    async def remove(self, container_id: str):
+        if self._closing:
+            # Exited leftovers are cleaned up by list_bot_containers next start
+            return
+        try:
+            container = await self.call(self.client.containers.get, container_id)
+            await self.call(container.remove, force=True)
+        except NotFound:
+            pass
+        except DockerException as e:
+            logger.error(f"Failed to remove container {container_id[:12]}: {str(e)}")
+
+
+def host_path(path: str) -> str:
+    """Translate a path under BOTS_PATH to the daemon's view of it"""
+    path = os.path.abspath(path)
+    local_root = os.path.abspath(config.BOTS_PATH)
+    if config.DOCKER_HOST_BOTS_PATH and (path == local_root or path.startswith(local_root + os.sep)):
+        return config.DOCKER_HOST_BOTS_PATH + path[len(local_root):]
+    return path
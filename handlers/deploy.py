@@ -4,6 +4,9 @@ from telegram.constants import ParseMode
 import os
 import tempfile
 import asyncio
+import functools
+import time
+import config
 from utils.validators import BotValidator, TokenValidator
 from utils.decorators import subscription_required
 
@@ -12,13 +15,24 @@ class DeployHandler:
         self.db = db
         self.bot_manager = bot_manager
         self.subscription_manager = subscription_manager
+        # Set by attach() once the application exists
+        self.bot = None
+        self.queue = None
+        
+    def attach(self, bot, queue):
+        """Give the handler the Bot API client and the deploy queue it submits to"""
+        self.bot = bot
+        self.queue = queue
         
     async def handle_deployment_process(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the complete deployment process"""
         user_id = update.effective_user.id
         
-        # Check if user can deploy
-        can_deploy = await self.subscription_manager.check_deployment_limit(user_id)
+        # Check if user can deploy (updating an existing bot doesn't add one)
+        can_deploy = (
+            'waiting_for_update' in context.user_data
+            or await self.subscription_manager.check_deployment_limit(user_id)
+        )
         
         if not can_deploy:
             await self.send_upgrade_message(update)
@@ -33,9 +47,14 @@ class DeployHandler:
         await self.process_bot_upload(update, context)
         
     async def process_bot_upload(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Process uploaded bot file"""
+        """Validate an uploaded bot file and queue its deployment"""
         document = update.message.document
-        user_id = update.effective_user.id
+        
+        # A ZIP sent after "Update Code" replaces that bot's code instead
+        update_bot_id = context.user_data.pop('waiting_for_update', None)
+        if update_bot_id:
+            await self.process_bot_update(update, context, update_bot_id)
+            return
         
         # Validate file
         validation_result = await self.validate_upload(document)
@@ -46,36 +65,190 @@ class DeployHandler:
             )
             return
             
-        # Show upload progress
+        await self.queue_job(update, "deploy")
+        
+    async def queue_job(self, update: Update, kind: str, **fields):
+        """Submit an upload to the deploy queue and report its place in line"""
+        document = update.message.document
+        user_id = update.effective_user.id
+        
         progress_msg = await update.message.reply_text(
-            "📥 **Uploading Bot Files...**\n\n⏳ Please wait while we process your bot.",
+            "📥 **Upload Received**\n\n⏳ Adding your bot to the build queue...",
             parse_mode=ParseMode.MARKDOWN
         )
         
         try:
-            # Download file
-            file_path = await self.download_file(document, context, user_id)
+            subscription = await self.subscription_manager.get_user_subscription(user_id)
+            premium = bool(subscription and subscription['active'])
+            queued = await self.queue.submit(
+                kind, user_id, premium,
+                chat_id=progress_msg.chat_id,
+                message_id=progress_msg.message_id,
+                file_id=document.file_id,
+                file_unique_id=document.file_unique_id,
+                file_name=document.file_name,
+                **fields
+            )
+            text = (
+                f"🕒 **Queued for Build**\n\n"
+                f"📍 **Position:** {queued['position']}\n"
+                f"⏱️ **Estimated time:** ~{max(1, round(queued['eta'] / 60))} min"
+            )
+            if not premium:
+                text += "\n\n💎 Premium builds skip ahead of the queue"
+            await progress_msg.edit_text(text, parse_mode=ParseMode.MARKDOWN)
             
-            # Update progress
+        except Exception as e:
             await progress_msg.edit_text(
-                "🔍 **Analyzing Bot Structure...**\n\n⏳ Detecting bot type and dependencies.",
+                f"❌ **Unexpected Error**\n\nError: {str(e)}\n\nPlease try again or contact support.",
                 parse_mode=ParseMode.MARKDOWN
             )
             
-            # Deploy bot
-            deployment_result = await self.bot_manager.deploy_bot(user_id, file_path)
+    async def run_job(self, job: dict) -> dict:
+        """Deploy queue runner: build a queued upload, showing progress on its message"""
+        edit = functools.partial(self.bot.edit_message_text, chat_id=job["chat_id"], message_id=job["message_id"])
+        progress = self.make_progress_reporter(edit)
+        
+        if job["kind"] == "update":
+            return await self.update_from_job(job, progress)
             
-            if deployment_result['success']:
-                await self.send_deployment_success(progress_msg, deployment_result)
-            else:
-                await self.send_deployment_error(progress_msg, deployment_result)
+        # Uploads queued together must not slip past the free plan limit
+        if not await self.subscription_manager.check_deployment_limit(job["user_id"]):
+            return {"success": False, "error": "Deployment limit reached for your plan."}
+        return await self.deploy_from_job(job, progress)
+        
+    async def report_job(self, job: dict, result):
+        """Deploy queue notifier: tell the user how a recorded job went (None: queued again)"""
+        edit = functools.partial(self.bot.edit_message_text, chat_id=job["chat_id"], message_id=job["message_id"])
+        
+        if result is None:
+            position = await self.queue.position(job)
+            await edit(
+                f"🕒 **Queued Again**\n\n"
+                f"Your build was interrupted by a restart and will start over.\n\n"
+                f"📍 **Position:** {position}\n"
+                f"⏱️ **Estimated time:** ~{max(1, round(self.queue.eta(position) / 60))} min",
+                parse_mode=ParseMode.MARKDOWN
+            )
+        elif job["kind"] == "update":
+            await self.send_update_result(edit, job["bot_id"], result)
+        elif result['success']:
+            await self.send_deployment_success(edit, result)
+        else:
+            await self.send_deployment_error(edit, result)
+            
+    async def deploy_from_job(self, job: dict, progress) -> dict:
+        """Deploy a queued upload, skipping the download if we have seen it before"""
+        archive_hash = self.bot_manager.artifacts.lookup(job["file_unique_id"])
+        if archive_hash is not None:
+            result = await self.bot_manager.deploy_bot(job["user_id"], archive_hash=archive_hash, progress=progress)
+            if not result.get('artifact_missing'):
+                return result
                 
-        except Exception as e:
-            await progress_msg.edit_text(
-                f"❌ **Unexpected Error**\n\nError: {str(e)}\n\nPlease try again or contact support.",
+        # The temp dir goes away with the deploy, whatever its outcome
+        os.makedirs(config.TEMP_PATH, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix="upload-", dir=config.TEMP_PATH) as temp_dir:
+            file_path = await self.download_file(job["file_id"], job["file_name"], temp_dir)
+            return await self.bot_manager.deploy_bot(
+                job["user_id"], file_path, progress=progress, file_unique_id=job["file_unique_id"]
+            )
+            
+    async def update_from_job(self, job: dict, progress) -> dict:
+        """Apply a queued upload to an existing bot"""
+        os.makedirs(config.TEMP_PATH, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix="update-", dir=config.TEMP_PATH) as temp_dir:
+            file_path = await self.download_file(job["file_id"], job["file_name"], temp_dir)
+            return await self.bot_manager.update_bot(job["bot_id"], file_path, progress=progress)
+            
+    async def request_bot_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE, bot_id: str):
+        """Ask for the ZIP that will replace a bot's code"""
+        bot_config = await self.bot_manager.load_bot_config(bot_id)
+        if not bot_config or bot_config.get('user_id') != update.effective_user.id:
+            await update.callback_query.answer("Bot not found", show_alert=True)
+            return
+            
+        context.user_data['waiting_for_update'] = bot_id
+        await update.callback_query.edit_message_text(
+            f"🔄 **Update {bot_config.get('name', 'Bot')}**\n\n"
+            "Send the new ZIP of your bot. Only changed files are replaced, "
+            "your token, port and installed packages are kept, and a running "
+            "bot is restarted automatically.",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        
+    async def process_bot_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE, bot_id: str):
+        """Validate an uploaded ZIP and queue it as an update of an existing bot"""
+        document = update.message.document
+        
+        validation_result = await self.validate_upload(document)
+        if not validation_result['valid']:
+            await update.message.reply_text(
+                f"❌ **Upload Validation Failed**\n\n{validation_result['error']}",
                 parse_mode=ParseMode.MARKDOWN
             )
+            return
+            
+        await self.queue_job(update, "update", bot_id=bot_id)
+        
+    async def send_update_result(self, edit, bot_id: str, result: dict):
+        """Report the outcome of an in-place update"""
+        if not result['success']:
+            await self.send_deployment_error(edit, result)
+            return
+            
+        if not result['changed'] and not result['removed']:
+            text = "✅ **Nothing Changed**\n\nThis ZIP matches the code your bot is already running."
+        else:
+            text = (
+                f"✅ **Bot Updated**\n\n"
+                f"📝 **Changed:** {len(result['changed'])} files\n"
+                f"🗑️ **Removed:** {len(result['removed'])} files\n"
+                f"{'🔄 Restarted with the new code' if result['restarted'] else '⏸️ Start the bot to run the new code'}"
+            )
+        await edit(
+            text,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("📊 View Details", callback_data=f"bot_details_{bot_id}")]
+            ])
+        )
+            
+    def make_progress_reporter(self, edit, min_interval: float = 2.0):
+        """Build a throttled deploy progress callback that edits one message via edit"""
+        stage_text = {
+            "reuse": "♻️ **Reusing Previous Upload...**",
+            "extract": "📂 **Extracting Bot Files...**",
+            "analyze": "🔍 **Analyzing Bot Structure...**",
+            "install": "📦 **Installing Dependencies...**",
+            "apply": "🚀 **Applying Update...**"
+        }
+        state = {"last_edit": 0.0, "last_text": None, "stage": None}
+        
+        async def report(stage, done, total):
+            now = time.monotonic()
+            new_stage = stage != state["stage"]
+            if now - state["last_edit"] < min_interval and not new_stage and done < total:
+                return
+            state["stage"] = stage
+                
+            text = stage_text.get(stage, "⏳ **Deploying...**")
+            if stage == "extract":
+                text += f"\n\n⏳ {done * 100 // max(total, 1)}% ({done // 1024 // 1024} MB)"
+            else:
+                text += "\n\n⏳ Please wait..."
+                
+            if text == state["last_text"]:
+                return
+            state["last_edit"] = now
+            state["last_text"] = text
             
+            try:
+                await edit(text, parse_mode=ParseMode.MARKDOWN)
+            except Exception:
+                pass
+                
+        return report
+        
     async def validate_upload(self, document):
         """Validate uploaded file"""
         # Check file size
@@ -94,20 +267,17 @@ class DeployHandler:
             
         return {'valid': True}
         
-    async def download_file(self, document, context, user_id):
-        """Download file to temporary location"""
-        file = await context.bot.get_file(document.file_id)
-        
-        # Create temporary file
-        temp_dir = tempfile.mkdtemp()
-        file_path = os.path.join(temp_dir, document.file_name)
+    async def download_file(self, file_id: str, file_name: str, temp_dir: str):
+        """Download file into temp_dir"""
+        file = await self.bot.get_file(file_id)
+        file_path = os.path.join(temp_dir, os.path.basename(file_name or "") or "bot.zip")
         
         # Download
         await file.download_to_drive(file_path)
         
         return file_path
         
-    async def send_deployment_success(self, message, deployment_result):
+    async def send_deployment_success(self, edit, deployment_result):
         """Send deployment success message with token request"""
         bot_id = deployment_result['bot_id']
         analysis = deployment_result.get('analysis', {})
@@ -156,17 +326,18 @@ Your bot code has been deployed, but you need to provide a Telegram Bot Token fo
             [
                 InlineKeyboardButton("📊 View Details", callback_data=f"bot_details_{bot_id}"),
                 InlineKeyboardButton("🗑️ Delete Bot", callback_data=f"delete_bot_{bot_id}")
-            ]
+            ],
+            [InlineKeyboardButton("🔄 Update Code", callback_data=f"update_bot_{bot_id}")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await message.edit_text(
+        await edit(
             success_text,
             parse_mode=ParseMode.MARKDOWN,
             reply_markup=reply_markup
         )
         
-    async def send_deployment_error(self, message, deployment_result):
+    async def send_deployment_error(self, edit, deployment_result):
         """Send deployment error message"""
         error_text = f"""
 ❌ **Deployment Failed**
@@ -195,7 +366,7 @@ Your bot code has been deployed, but you need to provide a Telegram Bot Token fo
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await message.edit_text(
+        await edit(
             error_text,
             parse_mode=ParseMode.MARKDOWN,
             reply_markup=reply_markup
@@ -1,8 +1,43 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
+from telegram.helpers import escape_markdown
+import time
 import config
 
+def make_bulk_progress_reporter(edit, verb: str, min_interval: float = 2.0):
+    """Throttled (done, total) callback that keeps editing one message via edit"""
+    state = {"last_edit": time.monotonic()}
+    
+    async def report(done, total):
+        now = time.monotonic()
+        if done >= total or now - state["last_edit"] < min_interval:
+            return
+        state["last_edit"] = now
+        try:
+            await edit(f"⏳ **{verb} bots...** {done}/{total}", parse_mode=ParseMode.MARKDOWN)
+        except Exception:
+            pass
+            
+    return report
+
+def format_bulk_results(results: dict, names: dict, verb: str) -> str:
+    """Summarize per-bot bulk results within Telegram's message limit"""
+    failed = {bot_id: r['error'] for bot_id, r in results.items() if not r['success']}
+    text = (
+        f"✅ **{verb} finished**\n\n"
+        f"• Succeeded: {len(results) - len(failed)}\n"
+        f"• Failed: {len(failed)}\n"
+    )
+    for bot_id, error in failed.items():
+        # Bot names and error texts are user-controlled
+        line = f"\n❌ {escape_markdown(str(names.get(bot_id, bot_id)))}: {escape_markdown(str(error))}"
+        if len(text) + len(line) > 3900:
+            text += "\n…"
+            break
+        text += line
+    return text
+
 class SpaceHandler:
     def __init__(self, db, bot_manager, subscription_manager):
         self.db = db
@@ -13,17 +48,17 @@ class SpaceHandler:
         """Enhanced /space command handler"""
         user_id = update.effective_user.id
         
-        if await self.db.is_user_banned(user_id):
+        # Ban flag, plan and bot counts in one round trip
+        user = update.effective_user
+        snapshot = await self.db.get_or_create_user_snapshot(user_id, user.username, user.first_name)
+        
+        if snapshot['banned']:
             await self.send_banned_message(update)
             return
             
-        # Get user data
-        user_bots = await self.db.get_user_bots(user_id)
-        subscription = await self.subscription_manager.get_user_subscription(user_id)
-        
         # Generate space menu
-        menu_text = await self.generate_space_menu_text(user_id, user_bots, subscription)
-        keyboard = await self.create_space_keyboard(user_bots, subscription)
+        menu_text = await self.generate_space_menu_text(user_id, snapshot)
+        keyboard = await self.create_space_keyboard(snapshot)
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         if update.callback_query:
@@ -39,16 +74,13 @@ class SpaceHandler:
                 reply_markup=reply_markup
             )
             
-    async def generate_space_menu_text(self, user_id, user_bots, subscription):
+    async def generate_space_menu_text(self, user_id, snapshot):
         """Generate comprehensive space menu text"""
-        # Calculate statistics
-        running_bots = [bot for bot in user_bots if bot.get('status') == 'running']
-        stopped_bots = [bot for bot in user_bots if bot.get('status') == 'stopped']
-        error_bots = [bot for bot in user_bots if bot.get('status') == 'error']
+        bot_counts = snapshot['bot_counts']
         
         # Subscription info
-        is_premium = subscription and subscription['active']
-        plan_name = subscription['plan'].title() if is_premium else 'Free'
+        is_premium = snapshot['premium']
+        plan_name = snapshot['plan'].title()
         max_bots = '∞' if is_premium else str(config.MAX_BOTS_FREE)
         
         return f"""
@@ -57,13 +89,13 @@ class SpaceHandler:
 **Account Overview:**
 • 👤 User ID: `{user_id}`
 • 💎 Plan: {plan_name}
-• 🤖 Bots: {len(user_bots)}/{max_bots}
-{f"• ⏰ Expires: {subscription['expires_at'].strftime('%b %d, %Y')}" if is_premium else ""}
+• 🤖 Bots: {snapshot['total_bots']}/{max_bots}
+{f"• ⏰ Expires: {snapshot['expires_at'].strftime('%b %d, %Y')}" if is_premium else ""}
 
 **Bot Status Summary:**
-• 🟢 Running: {len(running_bots)}
-• 🔴 Stopped: {len(stopped_bots)}
-• 🟠 Error: {len(error_bots)}
+• 🟢 Running: {bot_counts.get('running', 0)}
+• 🔴 Stopped: {bot_counts.get('stopped', 0)}
+• 🟠 Error: {bot_counts.get('error', 0)}
 
 **Quick Actions:**
 Use the buttons below for instant bot management.
@@ -72,12 +104,12 @@ Use the buttons below for instant bot management.
 **Last Updated:** {self.get_current_time()}
         """
         
-    async def create_space_keyboard(self, user_bots, subscription):
+    async def create_space_keyboard(self, snapshot):
         """Create dynamic space management keyboard"""
         keyboard = []
         
-        is_premium = subscription and subscription['active']
-        can_deploy = len(user_bots) < config.MAX_BOTS_FREE or is_premium
+        is_premium = snapshot['premium']
+        can_deploy = snapshot['total_bots'] < config.MAX_BOTS_FREE or is_premium
         
         # First row - Primary actions
         if can_deploy:
@@ -92,7 +124,7 @@ Use the buttons below for instant bot management.
             ])
             
         # Second row - Bot management
-        if user_bots:
+        if snapshot['total_bots']:
             keyboard.append([
                 InlineKeyboardButton("📱 All Bots", callback_data="show_all_bots"),
                 InlineKeyboardButton("🟢 Running Bots", callback_data="show_running_bots")
@@ -117,6 +149,127 @@ Use the buttons below for instant bot management.
         
         return keyboard
         
+    async def handle_performance_dashboard(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show sampled CPU, memory and uptime of the user's running bots"""
+        user_id = update.effective_user.id
+        user_bots = await self.db.get_user_bots(user_id)
+        running_bots = [bot for bot in user_bots if bot.get('status') == 'running']
+
+        dashboard_text = "📊 **Performance Dashboard**\n\n"
+        for bot in running_bots:
+            section = (
+                f"🤖 **{escape_markdown(bot.get('name', bot['bot_id']))}**\n"
+                f"• ⚙️ CPU: {bot.get('cpu_usage', 0)}%\n"
+                f"• 💾 Memory: {bot.get('memory_usage', 0)} MB\n"
+                f"• ⏱️ Uptime: {bot.get('uptime', '0s')}\n\n"
+            )
+            # Telegram caps messages at 4096 characters
+            if len(dashboard_text) + len(section) > 4000:
+                break
+            dashboard_text += section
+        if not running_bots:
+            dashboard_text += "No running bots right now."
+
+        keyboard = [
+            [
+                InlineKeyboardButton("🔄 Refresh", callback_data="performance_dashboard"),
+                InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu")
+            ]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+
+        if update.callback_query:
+            await update.callback_query.edit_message_text(
+                dashboard_text,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=reply_markup
+            )
+        else:
+            await update.message.reply_text(
+                dashboard_text,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=reply_markup
+            )
+
+    async def handle_activity_logs(self, update: Update, context: ContextTypes.DEFAULT_TYPE, lines: int = 15):
+        """Show the latest output of each of the user's bots"""
+        user_id = update.effective_user.id
+        user_bots = await self.db.get_user_bots(user_id)
+
+        logs_text = "📋 **Activity Logs**\n"
+        for bot in user_bots:
+            tail = self.bot_manager.log_collector.tail(bot['bot_id'], lines)
+            if not tail:
+                continue
+
+            # Telegram caps messages at 4096 characters
+            output = "\n".join(tail).replace("`", "'")[-1000:]
+            section = f"\n🤖 **{escape_markdown(bot.get('name', bot['bot_id']))}**\n```\n{output}\n```\n"
+            if len(logs_text) + len(section) > 4000:
+                break
+            logs_text += section
+
+        if logs_text.endswith("**\n"):
+            logs_text += "\nNo output captured yet."
+
+        keyboard = [
+            [
+                InlineKeyboardButton("🔄 Refresh", callback_data="activity_logs"),
+                InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu")
+            ]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+
+        if update.callback_query:
+            await update.callback_query.edit_message_text(
+                logs_text,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=reply_markup
+            )
+        else:
+            await update.message.reply_text(
+                logs_text,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=reply_markup
+            )
+
+    async def handle_bulk_action(self, update: Update, context: ContextTypes.DEFAULT_TYPE, action: str):
+        """Start or stop all of the user's bots behind one progress message"""
+        query = update.callback_query
+        user_id = update.effective_user.id
+        user_bots = await self.db.get_user_bots(user_id)
+        
+        running = self.bot_manager.running_processes
+        if action == "stop":
+            bot_ids = [bot['bot_id'] for bot in user_bots if bot['bot_id'] in running]
+        else:
+            bot_ids = [bot['bot_id'] for bot in user_bots if bot['bot_id'] not in running]
+        names = {bot['bot_id']: bot.get('name', bot['bot_id']) for bot in user_bots}
+        
+        verb = "Starting" if action == "start" else "Stopping"
+        if not bot_ids:
+            await query.answer(f"No bots to {action}.")
+            return
+            
+        await query.edit_message_text(f"⏳ **{verb} {len(bot_ids)} bots...**", parse_mode=ParseMode.MARKDOWN)
+        
+        async def run():
+            results = await self.bot_manager.bulk_action(
+                action, bot_ids,
+                progress=make_bulk_progress_reporter(query.edit_message_text, verb)
+            )
+            await query.edit_message_text(
+                format_bulk_results(results, names, verb),
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🚀 Space", callback_data="space_menu"),
+                    InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu")
+                ]])
+            )
+            
+        # Stops can take seconds each; don't hold up other updates meanwhile
+        context.application.create_task(run())
+        
     def get_current_time(self):
         """Get current formatted time"""
         from datetime import datetime
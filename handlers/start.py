@@ -12,32 +12,30 @@ class StartHandler:
         """Enhanced start command handler"""
         user = update.effective_user
         
+        # Register on first contact; ban flag, plan and bot counts in one round trip
+        snapshot = await self.db.get_or_create_user_snapshot(user.id, user.username, user.first_name)
+        
         # Check if user is banned
-        if await self.db.is_user_banned(user.id):
+        if snapshot['banned']:
             await self.send_banned_message(update, context)
             return
             
-        # Register/update user
-        await self.db.register_user(user.id, user.username, user.first_name)
-        
-        # Get user stats
-        user_bots = await self.db.get_user_bots(user.id)
-        subscription = await self.subscription_manager.get_user_subscription(user.id)
+        await self.db.update_user_activity(user.id)
         
         # Create personalized welcome message
-        welcome_text = self.generate_welcome_message(user, user_bots, subscription)
+        welcome_text = self.generate_welcome_message(user, snapshot)
         
         # Create dynamic keyboard
-        keyboard = self.create_welcome_keyboard(subscription, len(user_bots))
+        keyboard = self.create_welcome_keyboard(snapshot)
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         # Send welcome with image
         await self.send_welcome_message(update, welcome_text, reply_markup)
         
-    def generate_welcome_message(self, user, user_bots, subscription):
+    def generate_welcome_message(self, user, snapshot):
         """Generate personalized welcome message"""
-        status_emoji = "💎" if subscription and subscription['active'] else "🆓"
-        status_text = "Premium" if subscription and subscription['active'] else "Free"
+        status_emoji = "💎" if snapshot['premium'] else "🆓"
+        status_text = "Premium" if snapshot['premium'] else "Free"
         
         return f"""
 🚀 **Welcome to Space Deployer Bot** 🚀
@@ -46,8 +44,8 @@ Hello **{user.first_name}**! Ready to deploy some amazing bots?
 
 **Your Dashboard:**
 {status_emoji} **Status:** {status_text} User
-🤖 **Active Bots:** {len([b for b in user_bots if b.get('status') == 'running'])}/{len(user_bots)}
-📊 **Total Deployments:** {len(user_bots)}
+🤖 **Active Bots:** {snapshot['bot_counts'].get('running', 0)}/{snapshot['total_bots']}
+📊 **Total Deployments:** {snapshot['total_bots']}
 
 **🌟 What's New:**
 • Advanced monitoring system
@@ -67,12 +65,13 @@ Hello **{user.first_name}**! Ready to deploy some amazing bots?
 **Developer:** {config.DEVELOPER}
         """
         
-    def create_welcome_keyboard(self, subscription, bot_count):
+    def create_welcome_keyboard(self, snapshot):
         """Create dynamic welcome keyboard"""
         keyboard = []
+        bot_count = snapshot['total_bots']
         
         # First row - Primary actions
-        if subscription and subscription['active']:
+        if snapshot['premium']:
             keyboard.append([
                 InlineKeyboardButton("🚀 Deploy Bot", callback_data="deploy_menu"),
                 InlineKeyboardButton("📱 My Bots", callback_data="my_bots")
@@ -0,0 +1,199 @@
+"""
+Layered image cache for containerized bots.
+
+Each bot_type has one base image (config.DOCKER_IMAGES).  On top of it we
+build dependency images tagged by a hash of the base image and the
+normalized requirements.txt / package.json, so every bot with the same
+stack shares one image.  The bot's code is never baked in: it is
+bind-mounted at /app when the container starts.  Dependency images are
+evicted least recently used first once they exceed DOCKER_IMAGE_CACHE_MAX_MB.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+from docker.errors import DockerException, ImageNotFound, APIError
+import config
+from utils.json_store import JsonSnapshotFile
+from utils.logger import get_logger
+from venv_cache import normalize_requirements
+
+logger = get_logger(__name__)
+
+_REPOSITORY = "space-deps"
+
+_DOCKERFILES = {
+    "python": (
+        "requirements.txt",
+        "FROM {base}\n"
+        "COPY requirements.txt /deps/requirements.txt\n"
+        "RUN pip install --no-cache-dir -r /deps/requirements.txt\n"
+    ),
+    "nodejs": (
+        "package.json",
+        "FROM {base}\n"
+        "WORKDIR /deps\n"
+        "COPY package.json /deps/package.json\n"
+        "RUN npm install --omit=dev --no-audit --no-fund\n"
+        "ENV NODE_PATH=/deps/node_modules\n"
+        "WORKDIR /app\n"
+    )
+}
+
+
+def dependency_spec(path: str, bot_type: str):
+    """Return (file name, cache key text, file content) for a bot's dependencies
+
+    The key text is normalized so equivalent specs share an image; the
+    image itself is built from the content (normalizing is lossy, e.g.
+    for URLs and environment markers). None means there is nothing to
+    install or the spec cannot be shared.
+    """
+    if bot_type not in _DOCKERFILES:
+        return None
+    name = _DOCKERFILES[bot_type][0]
+    try:
+        with open(os.path.join(path, name), 'r') as f:
+            content = f.read()
+    except OSError:
+        return None
+
+    if bot_type == "python":
+        requirements = normalize_requirements(content)
+        if not requirements:
+            return None
+        return name, "\n".join(requirements) + "\n", content
+
+    try:
+        package = json.loads(content)
+    except ValueError:
+        return None
+    dependencies = package.get("dependencies")
+    if not dependencies:
+        return None
+    if any(str(spec).startswith(("file:", "link:", ".", "/")) for spec in dependencies.values()):
+        return None
+    package = json.dumps({"name": "deps", "private": True, "dependencies": dependencies}, sort_keys=True)
+    return name, package, package
+
+
+class ImageCache:
+    def __init__(self, backend, max_bytes: int = None):
+        self.backend = backend
+        self.max_bytes = max_bytes if max_bytes is not None else config.DOCKER_IMAGE_CACHE_MAX_MB * 1024 * 1024
+        self.index_path = os.path.join(config.BOTS_PATH, ".image_cache.json")
+        self._index_file = JsonSnapshotFile(self.index_path)
+        self.index = self._load_index()
+        self._locks = {}
+        self._bases = {}
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    async def _save_index(self):
+        await self.backend.call(self._index_file.save, *self._index_file.snapshot(self.index))
+
+    async def base_image(self, bot_type: str):
+        """Pull the runtime's base image once and return its image object"""
+        name = config.DOCKER_IMAGES[bot_type]
+        if name in self._bases:
+            return self._bases[name]
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            if name not in self._bases:
+                client = self.backend.client
+                try:
+                    image = await self.backend.call(client.images.get, name)
+                except ImageNotFound:
+                    logger.info(f"Pulling base image {name}")
+                    image = await self.backend.call(client.images.pull, name)
+                self._bases[name] = image
+        return self._bases[name]
+
+    async def image_for(self, path: str, bot_type: str) -> dict:
+        """Image to run a bot with: {"image": tag, "layered": bool}
+
+        layered is False when the bot's dependencies still have to be
+        installed at container start (nothing shareable to build).
+        """
+        base = await self.base_image(bot_type)
+        spec = await self.backend.call(dependency_spec, path, bot_type)
+        if spec is None:
+            return {"image": config.DOCKER_IMAGES[bot_type], "layered": False}
+
+        digest = hashlib.sha256(base.id.encode())
+        digest.update(spec[1].encode())
+        tag = f"{_REPOSITORY}/{bot_type}:{digest.hexdigest()[:24]}"
+
+        lock = self._locks.setdefault(tag, asyncio.Lock())
+        async with lock:
+            if not await self._exists(tag):
+                try:
+                    await self._build(tag, bot_type, base, spec)
+                except (DockerException, APIError) as e:
+                    logger.error(f"Dependency image build failed for {tag}: {str(e)}")
+                    return {"image": config.DOCKER_IMAGES[bot_type], "layered": False}
+                await self.collect(keep=tag)
+            else:
+                self.index.setdefault(tag, {"size": 0})["last_used"] = time.time()
+            await self._save_index()
+        return {"image": tag, "layered": True}
+
+    async def _exists(self, tag: str) -> bool:
+        try:
+            await self.backend.call(self.backend.client.images.get, tag)
+            return True
+        except ImageNotFound:
+            self.index.pop(tag, None)
+            return False
+
+    async def _build(self, tag: str, bot_type: str, base, spec):
+        name, _, content = spec
+        dockerfile = _DOCKERFILES[bot_type][1].format(base=config.DOCKER_IMAGES[bot_type])
+
+        context = io.BytesIO()
+        with tarfile.open(fileobj=context, mode="w") as tar:
+            for member_name, data in (("Dockerfile", dockerfile), (name, content)):
+                data = data.encode()
+                info = tarfile.TarInfo(member_name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        context.seek(0)
+
+        logger.info(f"Building dependency image {tag}")
+        started = time.monotonic()
+        image, _ = await self.backend.call(
+            self.backend.client.images.build,
+            fileobj=context, custom_context=True, tag=tag, rm=True, forcerm=True
+        )
+        # Only count what this image adds on top of the shared base
+        size = max(0, image.attrs.get("Size", 0) - base.attrs.get("Size", 0))
+        self.index[tag] = {"size": size, "last_used": time.time(), "bot_type": bot_type}
+        logger.info(f"Built {tag} ({size // 1024 // 1024} MB) in {time.monotonic() - started:.1f}s")
+
+    async def collect(self, keep: str = None):
+        """Remove least recently used dependency images beyond the disk budget"""
+        total = sum(entry.get("size", 0) for entry in self.index.values())
+        for tag in sorted(self.index, key=lambda t: self.index[t].get("last_used", 0)):
+            if total <= self.max_bytes:
+                break
+            if tag == keep or (tag in self._locks and self._locks[tag].locked()):
+                continue
+            try:
+                await self.backend.call(self.backend.client.images.remove, tag)
+            except ImageNotFound:
+                pass
+            except APIError as e:
+                # Still used by a container; try the next one
+                logger.debug(f"Keeping image {tag}: {str(e)}")
+                continue
+            logger.info(f"Evicted dependency image {tag}")
+            total -= self.index.pop(tag).get("size", 0)
+            self._locks.pop(tag, None)
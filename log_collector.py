@@ -0,0 +1,297 @@
+"""
+Hosted bot output collection.
+
+Host processes write their stdout/stderr straight into their log file
+under LOGS_PATH/bots, so they keep running (and logging) when the
+controller restarts and adopts them; all of their files are polled here
+in one pass per LOG_POLL_INTERVAL, in a single worker thread hop.  Container
+output arrives as a stream, is drained here so a chatty bot can never
+block, and is spilled to the same file in batches from a worker thread.
+Recent lines are kept in a fixed-size ring buffer per bot (hard memory
+cap of LOG_BUFFER_LINES * LOG_MAX_LINE_BYTES, plus LOG_SPILL_MAX_BYTES of
+output not yet spilled) and log files are rotated by size.  Only the
+in-memory copy of a long line is truncated.
+"""
+import asyncio
+import os
+import shutil
+from collections import deque
+import config
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class BotLog:
+    def __init__(self, bot_id: str):
+        self.bot_id = bot_id
+        self.lines = deque(maxlen=config.LOG_BUFFER_LINES)
+        self.followers = set()
+        self.path = os.path.join(config.LOGS_PATH, "bots", f"{bot_id}.log")
+        self.file = None
+        self.file_size = 0
+        # Output waiting to be spilled by the writer task, in full (lines are
+        # only truncated in memory)
+        self.unspilled = []
+        self.unspilled_bytes = 0
+        self.spill_task = None
+        self.closing = False
+        # Read position in the file when the process writes it itself
+        self.offset = None
+
+    def open_output(self):
+        """Open the log file for a new host process to write to (blocking)"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        return open(self.path, "ab")
+
+    def read_output(self, offset: int):
+        """Return (new bytes, new offset) of a file written by the process (blocking)
+
+        The process holds the file open in append mode, so it is rotated by
+        copying and truncating it in place; anything written between the two
+        steps is lost, as with logrotate's copytruncate.
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return b"", 0
+        if size == offset:
+            return b"", offset
+        if size < offset:
+            offset = 0
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read(config.LOG_READ_CHUNK)
+        offset += len(data)
+        if offset >= config.LOG_FILE_MAX_BYTES and offset >= size:
+            self.shift_backups()
+            shutil.copyfile(self.path, f"{self.path}.1")
+            os.truncate(self.path, 0)
+            offset = 0
+        return data, offset
+
+    def append(self, raw_lines: list, spill: bool = True):
+        for raw in raw_lines:
+            line = raw[:config.LOG_MAX_LINE_BYTES].decode(errors="replace").rstrip("\r")
+            self.lines.append(line)
+            for queue in list(self.followers):
+                if queue.full():
+                    # Slow follower: drop its oldest line rather than grow
+                    queue.get_nowait()
+                queue.put_nowait(line)
+        if spill:
+            data = b"\n".join(raw_lines) + b"\n"
+            self.unspilled.append(data)
+            self.unspilled_bytes += len(data)
+            while self.unspilled_bytes > config.LOG_SPILL_MAX_BYTES and len(self.unspilled) > 1:
+                # The disk can't keep up: drop the oldest output, not memory
+                self.unspilled_bytes -= len(self.unspilled.pop(0))
+            if self.spill_task is None or self.spill_task.done():
+                self.spill_task = asyncio.ensure_future(self._spill_pending())
+
+    async def _spill_pending(self):
+        # Whatever arrives while a write is in flight goes out in the next one
+        while self.unspilled:
+            data = b"".join(self.unspilled)
+            self.unspilled, self.unspilled_bytes = [], 0
+            await asyncio.to_thread(self.spill, data)
+        if self.closing:
+            self._close_file()
+
+    def spill(self, data: bytes):
+        """Append output to the log file, rotating it by size (blocking)"""
+        try:
+            if self.file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.file = open(self.path, "ab")
+                self.file_size = self.file.tell()
+            if self.file_size >= config.LOG_FILE_MAX_BYTES:
+                self.rotate()
+            self.file.write(data)
+            self.file.flush()
+            self.file_size += len(data)
+        except OSError as e:
+            logger.error(f"Failed to write log file for {self.bot_id}: {str(e)}")
+
+    def shift_backups(self):
+        for i in range(config.LOG_FILE_BACKUPS - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+
+    def rotate(self):
+        self.file.close()
+        self.shift_backups()
+        os.replace(self.path, f"{self.path}.1")
+        self.file = open(self.path, "ab")
+        self.file_size = 0
+
+    def close(self):
+        """Close the log file once pending output has been spilled"""
+        if self.spill_task is not None and not self.spill_task.done():
+            self.closing = True
+        else:
+            self._close_file()
+
+    def _close_file(self):
+        self.closing = False
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_outputs(reads: list) -> list:
+    """read_output() for each (log, offset) pair; one thread hop for every file (blocking)"""
+    results = []
+    for log, offset in reads:
+        try:
+            results.append(log.read_output(offset))
+        except OSError as e:
+            logger.error(f"Failed to read log file for {log.bot_id}: {str(e)}")
+            results.append((b"", offset))
+    return results
+
+
+class LogCollector:
+    def __init__(self):
+        self.logs = {}
+        self.tasks = {}
+        # Host processes whose log files the poller reads
+        self.tailed = []
+        self._poll_task = None
+
+    def _log(self, bot_id: str) -> BotLog:
+        log = self.logs.get(bot_id)
+        if log is None:
+            log = self.logs[bot_id] = BotLog(bot_id)
+        return log
+
+    async def open_output(self, bot_id: str):
+        """File a new host process should get as stdout/stderr"""
+        log = self._log(bot_id)
+        output = await asyncio.to_thread(log.open_output)
+        log.offset = output.tell()
+        return output
+
+    def attach(self, bot_id: str, process):
+        """Start collecting a process's output into the bot's log
+
+        Processes without output streams write the log file themselves
+        (see open_output); an adopted one is picked up at the file's end.
+        """
+        log = self._log(bot_id)
+        streams = [s for s in (process.stdout, process.stderr) if s is not None]
+        if streams:
+            task = asyncio.gather(*(self._drain(log, stream) for stream in streams))
+        else:
+            task = self._tail(log, process)
+        self.tasks[bot_id] = asyncio.ensure_future(task)
+        self.tasks[bot_id].add_done_callback(lambda _: log.close())
+
+    async def _drain(self, log: BotLog, stream):
+        pending = b""
+        while True:
+            chunk = await stream.read(config.LOG_READ_CHUNK)
+            if not chunk:
+                break
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            if len(pending) > config.LOG_MAX_LINE_BYTES:
+                lines.append(pending)
+                pending = b""
+            if lines:
+                log.append(lines)
+        if pending:
+            log.append([pending])
+
+    async def _tail(self, log: BotLog, process):
+        offset, log.offset = log.offset, None
+        skip_partial = False
+        if offset is None:
+            # Adopted: prime the buffer with the end of what it already wrote
+            try:
+                size = await asyncio.to_thread(os.path.getsize, log.path)
+            except OSError:
+                size = 0
+            offset = max(0, size - config.LOG_READ_CHUNK)
+            skip_partial = offset > 0
+        tail = {
+            "log": log,
+            "process": process,
+            "offset": offset,
+            "pending": b"",
+            "skip_partial": skip_partial,
+            "done": asyncio.get_running_loop().create_future()
+        }
+        self.tailed.append(tail)
+        if self._poll_task is None or self._poll_task.done():
+            self._poll_task = asyncio.ensure_future(self._poll())
+        try:
+            await tail["done"]
+        finally:
+            self.tailed.remove(tail)
+
+    async def _poll(self):
+        while self.tailed:
+            tails = list(self.tailed)
+            # Checked before reading: whatever it wrote before exiting is read below
+            exited = [tail["process"].returncode is not None for tail in tails]
+            try:
+                results = await asyncio.to_thread(
+                    read_outputs, [(tail["log"], tail["offset"]) for tail in tails]
+                )
+            except Exception as e:
+                logger.error(f"Log polling failed: {str(e)}")
+                results = [(b"", tail["offset"]) for tail in tails]
+            behind = False
+            for tail, gone, (chunk, offset) in zip(tails, exited, results):
+                if tail["done"].done():
+                    continue
+                tail["offset"] = offset
+                if chunk:
+                    self._feed(tail, chunk)
+                    behind = behind or len(chunk) == config.LOG_READ_CHUNK
+                elif gone:
+                    if tail["pending"]:
+                        tail["log"].append([tail["pending"]], spill=False)
+                    tail["done"].set_result(None)
+            # A chatty bot gets its next chunk right away rather than a second later
+            await asyncio.sleep(0 if behind else config.LOG_POLL_INTERVAL)
+
+    def _feed(self, tail: dict, chunk: bytes):
+        *lines, tail["pending"] = (tail["pending"] + chunk).split(b"\n")
+        if tail["skip_partial"] and lines:
+            lines = lines[1:]
+            tail["skip_partial"] = False
+        if len(tail["pending"]) > config.LOG_MAX_LINE_BYTES:
+            lines.append(tail["pending"])
+            tail["pending"] = b""
+        if lines:
+            tail["log"].append(lines, spill=False)
+
+    def tail(self, bot_id: str, lines: int = 50) -> list:
+        """Return the last lines of output kept in memory for a bot"""
+        log = self.logs.get(bot_id)
+        if log is None:
+            return []
+        return list(log.lines)[-lines:]
+
+    async def follow(self, bot_id: str):
+        """Yield new output lines for a bot as they arrive"""
+        log = self._log(bot_id)
+        queue = asyncio.Queue(maxsize=config.LOG_BUFFER_LINES)
+        log.followers.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            log.followers.discard(queue)
+
+    def discard(self, bot_id: str):
+        """Forget a deleted bot's buffer"""
+        task = self.tasks.pop(bot_id, None)
+        if task is not None:
+            task.cancel()
+        log = self.logs.pop(bot_id, None)
+        if log is not None:
+            log.close()
@@ -7,6 +7,7 @@ Created by @x_ifeelram for @billaspace
 import asyncio
 import logging
 import os
+import signal
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 from telegram.constants import ParseMode
@@ -14,11 +15,14 @@ import config
 from database import Database
 from bot_manager import BotManager
 from subscription import SubscriptionManager
+from broadcast import BroadcastEngine
+from deploy_queue import DeployQueue
 from handlers import start, help_handler, space, admin, deploy
 from utils.logger import setup_logger
 from utils.decorators import authorized_only, subscription_required
 from utils.validators import TokenValidator
-import aiohttp
+from utils.telegram_api import BotApiClient
+from utils import crypto
 
 # Setup logging
 logger = setup_logger(__name__)
@@ -26,14 +30,26 @@ logger = setup_logger(__name__)
 class SpaceDeployerBot:
     def __init__(self):
         self.db = Database()
-        self.bot_manager = BotManager()
+        self.bot_manager = BotManager(self.db)
         self.subscription_manager = SubscriptionManager(self.db)
+        self.broadcaster = None
+        self.deploy_handler = deploy.DeployHandler(self.db, self.bot_manager, self.subscription_manager)
+        self.deploy_queue = None
+        self.api_client = BotApiClient()
         self.application = None
         self.logger_enabled = True
         
     async def initialize(self):
         """Initialize the bot application"""
-        self.application = Application.builder().token(config.BOT_TOKEN).build()
+        self.application = (
+            Application.builder()
+            .token(config.BOT_TOKEN)
+            .base_url(config.TELEGRAM_API_BASE_URL)
+            .build()
+        )
+        self.broadcaster = BroadcastEngine(self.db, self.application.bot)
+        self.deploy_queue = DeployQueue(self.db, self.deploy_handler.run_job, self.deploy_handler.report_job)
+        self.deploy_handler.attach(self.application.bot, self.deploy_queue)
         
         # Register handlers
         await self.register_handlers()
@@ -41,6 +57,12 @@ class SpaceDeployerBot:
         # Initialize database
         await self.db.initialize()
         
+        # Load bot workspace index
+        await self.bot_manager.initialize()
+        
+        # Deactivate lapsed subscriptions in the background
+        self.subscription_manager.start_expiry_sweeper()
+        
         logger.info("Space Deployer Bot initialized successfully")
         
     async def register_handlers(self):
@@ -56,6 +78,9 @@ class SpaceDeployerBot:
         app.add_handler(CommandHandler("logger", self.logger_command))
         app.add_handler(CommandHandler("stats", self.stats_command))
         app.add_handler(CommandHandler("subs", self.subscription_command))
+        app.add_handler(CommandHandler("broadcast", self.broadcast_command))
+        app.add_handler(CommandHandler("rotatekey", self.rotatekey_command))
+        app.add_handler(CommandHandler("fleet", self.fleet_command))
         
         # File handlers
         app.add_handler(MessageHandler(filters.Document.ZIP, self.handle_bot_upload))
@@ -184,22 +209,22 @@ Need more help? Join @billacore!
             reply_markup=reply_markup
         )
 
-      async def space_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def space_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /space command - Host menu"""
-        user_id = update.effective_user.id
+        user = update.effective_user
+        
+        # Ban flag, plan and bot counts in one round trip
+        snapshot = await self.db.get_or_create_user_snapshot(user.id, user.username, user.first_name)
         
-        if await self.db.is_user_banned(user_id):
+        if snapshot['banned']:
             await update.message.reply_text("🚫 You are banned from using this bot!")
             return
             
-        user_bots = await self.db.get_user_bots(user_id)
-        subscription = await self.subscription_manager.get_user_subscription(user_id)
-        
         menu_text = f"""
 🚀 **Space Hosting Menu**
 
-**Your Status:** {'💎 Premium' if subscription and subscription['active'] else '🆓 Free'}
-**Active Bots:** {len(user_bots)}/{'∞' if subscription and subscription['active'] else '1'}
+**Your Status:** {'💎 Premium' if snapshot['premium'] else '🆓 Free'}
+**Active Bots:** {snapshot['total_bots']}/{'∞' if snapshot['premium'] else config.MAX_BOTS_FREE}
 
 **Quick Actions:**
         """
@@ -226,6 +251,10 @@ Need more help? Join @billacore!
             reply_markup=reply_markup
         )
 
+    async def handle_bot_upload(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle an uploaded bot ZIP (queued as a deploy or update job)"""
+        await self.deploy_handler.handle_deployment_process(update, context)
+
     async def handle_text_messages(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle text messages (for token input)"""
         user_id = update.effective_user.id
@@ -338,43 +367,171 @@ Your bot is now ready to start!
         )
 
     async def test_bot_token(self, token: str) -> dict:
-        """Test bot token by calling Telegram API"""
+        """Test bot token by calling Telegram API (cached getMe)"""
+        validation = TokenValidator.validate_token_format(token)
+        if not validation['valid']:
+            return {'valid': False, 'error': validation['error']}
+            
         try:
-            url = f"https://api.telegram.org/bot{token}/getMe"
+            data = await self.api_client.get_me(token)
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if data.get('ok'):
-                            return {
-                                'valid': True,
-                                'bot_info': data['result']
-                            }
-                        else:
-                            return {
-                                'valid': False,
-                                'error': f"Telegram API error: {data.get('description', 'Unknown error')}"
-                            }
-                    else:
-                        return {
-                            'valid': False,
-                            'error': f"HTTP error: {response.status}"
-                        }
-                        
+            if data.get('ok'):
+                return {
+                    'valid': True,
+                    'bot_info': data['result']
+                }
+            else:
+                return {
+                    'valid': False,
+                    'error': f"Telegram API error: {data.get('description', 'Unknown error')}"
+                }
+                
+        except asyncio.TimeoutError:
+            return {
+                'valid': False,
+                'error': "Connection error: Telegram API timed out"
+            }
         except Exception as e:
             return {
                 'valid': False,
                 'error': f"Connection error: {str(e)}"
             }
 
+    @authorized_only
+    async def broadcast_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Broadcast an announcement to every registered user"""
+        text = update.message.text.partition(" ")[2].strip()
+        
+        if not text:
+            await update.message.reply_text(
+                "📢 **Usage:** `/broadcast <message>`",
+                parse_mode=ParseMode.MARKDOWN
+            )
+            return
+            
+        recipients = await self.db.get_broadcast_recipients()
+        broadcast_id = await self.broadcaster.create(
+            recipients, text,
+            parse_mode=ParseMode.MARKDOWN,
+            created_by=update.effective_user.id
+        )
+        self.broadcaster.start(broadcast_id)
+        
+        await update.message.reply_text(
+            f"📢 **Broadcast Queued**\n\n"
+            f"🆔 `{broadcast_id}`\n"
+            f"👥 Recipients: {len(recipients):,}\n\n"
+            f"You'll get a summary when it finishes.",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        
+    @authorized_only
+    async def rotatekey_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Rotate the token encryption key and re-encrypt stored tokens"""
+        key_id = await asyncio.to_thread(crypto.rotate_key)
+        await update.message.reply_text(
+            f"🔐 **Encryption key rotated**\n\n"
+            f"🆔 New key: `{key_id}`\n"
+            f"Stored bot tokens are being re-encrypted in the background.",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        
+        async def reencrypt():
+            counts = await self.db.reencrypt_bot_tokens()
+            await update.message.reply_text(
+                f"🔐 **Re-encryption finished**\n\n"
+                f"🔁 Re-encrypted: {counts['reencrypted']:,}\n"
+                f"🆕 Migrated from plain text: {counts['migrated']:,}\n"
+                f"↪️ Superseded by a newer token: {counts['superseded']:,}\n"
+                f"❌ Failed: {counts['failed']:,}",
+                parse_mode=ParseMode.MARKDOWN
+            )
+            
+        context.application.create_task(reencrypt())
+        
+    @authorized_only
+    async def fleet_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Start, stop or restart every hosted bot (e.g. around host maintenance)"""
+        action = context.args[0].lower() if context.args else ""
+        
+        if action == "stop" or action == "restart":
+            bot_ids = [b for b, info in self.bot_manager.running_processes.items() if not info.get("stopping")]
+        elif action == "start":
+            bot_ids = await self.db.get_bots_pending_resume()
+        else:
+            await update.message.reply_text(
+                "🛠️ **Usage:** `/fleet <stop|start|restart>`\n\n"
+                "• `stop` stops every running bot and remembers them\n"
+                "• `start` starts the bots stopped by `/fleet stop`\n"
+                "• `restart` restarts every running bot",
+                parse_mode=ParseMode.MARKDOWN
+            )
+            return
+            
+        verb = {"stop": "Stopping", "start": "Starting", "restart": "Restarting"}[action]
+        message = await update.message.reply_text(
+            f"⏳ **{verb} {len(bot_ids)} bots...**",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        if action == "stop":
+            await self.db.mark_bots_for_resume(bot_ids)
+            
+        async def run():
+            results = await self.bot_manager.bulk_action(
+                action, bot_ids,
+                progress=space.make_bulk_progress_reporter(message.edit_text, verb)
+            )
+            if action == "start":
+                await self.db.clear_resume_pending([b for b, r in results.items() if r["success"]])
+                
+            await message.edit_text(
+                space.format_bulk_results(results, {}, verb),
+                parse_mode=ParseMode.MARKDOWN
+            )
+            
+        # Stops can take seconds each; don't hold up other updates meanwhile
+        context.application.create_task(run())
+        
+    async def post_init(self, application: Application):
+        """Resume work interrupted by the last shutdown"""
+        await self.broadcaster.resume_pending()
+        # Builds queued or interrupted before the restart continue here
+        await self.deploy_queue.start()
+        # Finish any interrupted rotation and encrypt legacy plain-text tokens
+        application.create_task(self.db.reencrypt_bot_tokens())
+        
+    async def shutdown(self, application: Application):
+        """Stop the fleet and flush buffered state when the application stops"""
+        self.subscription_manager.stop_expiry_sweeper()
+        await self.deploy_queue.stop()
+        await self.bot_manager.stop_fleet()
+        await self.api_client.close()
+        await self.bot_manager.close()
+        await self.db.close()
+        
     # Continue with other methods...
     async def run(self):
-        """Run the bot"""
+        """Run the bot until SIGTERM/SIGINT, then shut down gracefully"""
         await self.initialize()
         
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+            
         logger.info("Starting Space Deployer Bot...")
-        await self.application.run_polling(drop_pending_updates=True)
+        # run_polling() manages its own event loop, so drive the lifecycle here
+        async with self.application:
+            await self.application.start()
+            await self.post_init(self.application)
+            await self.application.updater.start_polling(drop_pending_updates=True)
+            
+            await stop.wait()
+            logger.info("Shutdown requested")
+            
+            await self.application.updater.stop()
+            await self.application.stop()
+            await self.shutdown(self.application)
 
 # Run the bot
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+"""
+Periodic resource sampler for supervised bots.
+
+One pass over /proc per interval maps every process to its parent, so
+bots launched through start.sh are measured as whole process trees.  CPU
+comes from utime+stime deltas in /proc/<pid>/stat and memory from the PSS
+line of /proc/<pid>/smaps_rollup, so pages shared between bots (the same
+interpreter, hard-linked venvs) are not double counted.  Containers are
+measured through their host PID, which needs the host PID namespace when
+this bot itself runs in a container.  Results land in Mongo with a single
+bulk_write.
+"""
+import asyncio
+import os
+import time
+import config
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def format_uptime(seconds: float) -> str:
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return f"{days}d {hours}h {minutes}m"
+    if hours:
+        return f"{hours}h {minutes}m"
+    if minutes:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
+
+
+def read_proc_stat(pid):
+    """Return (ppid, cpu_ticks, start_ticks, state) for a pid or None"""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # comm may contain spaces or parentheses; fields resume after the last ')'
+    fields = data[data.rindex(b")") + 2:].split()
+    return int(fields[1]), int(fields[11]) + int(fields[12]), int(fields[19]), fields[0].decode()
+
+
+def read_cmdline(pid) -> list:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return [arg.decode(errors="replace") for arg in f.read().split(b"\0") if arg]
+    except OSError:
+        return []
+
+
+def _read_pss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "rb") as f:
+            for line in f:
+                if line.startswith(b"Pss:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def sample_trees(roots: dict) -> dict:
+    """Measure process trees rooted at roots {bot_id: pid} (blocking)"""
+    stats = {}
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        stat = read_proc_stat(entry)
+        if stat is None:
+            continue
+        pid = int(entry)
+        stats[pid] = stat
+        children.setdefault(stat[0], []).append(pid)
+
+    with open("/proc/uptime", "r") as f:
+        boot_uptime = float(f.readline().split()[0])
+
+    result = {}
+    for bot_id, root in roots.items():
+        if root not in stats:
+            continue
+        tree, stack = [], [root]
+        while stack:
+            pid = stack.pop()
+            tree.append(pid)
+            stack.extend(children.get(pid, ()))
+        result[bot_id] = {
+            "cpu_ticks": sum(stats[pid][1] for pid in tree),
+            "pss_kb": sum(_read_pss_kb(pid) for pid in tree),
+            "uptime": boot_uptime - stats[root][2] / _CLK_TCK,
+            "processes": len(tree)
+        }
+    return result
+
+
+class ResourceSampler:
+    def __init__(self, manager):
+        self.manager = manager
+        self.latest = {}
+        self._previous = {}
+        self._task = None
+
+    def start(self):
+        if not os.path.exists("/proc/self/stat"):
+            logger.warning("/proc not available, resource sampling disabled")
+            return
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sample_once()
+            except Exception as e:
+                logger.error(f"Resource sampling failed: {str(e)}")
+            await asyncio.sleep(config.RESOURCE_SAMPLE_INTERVAL)
+
+    async def sample_once(self):
+        """Sample every supervised process tree and persist the results"""
+        roots = {
+            bot_id: info["process"].pid
+            for bot_id, info in self.manager.running_processes.items()
+            if info["process"].pid and info["process"].returncode is None
+        }
+        if not roots:
+            self.latest = {}
+            return
+
+        now = time.monotonic()
+        raw = await self.manager.run_blocking(sample_trees, roots)
+
+        metrics = {}
+        for bot_id, sample in raw.items():
+            previous = self._previous.get(bot_id)
+            cpu = 0.0
+            if previous and previous["root"] == roots[bot_id] and now > previous["at"]:
+                ticks = sample["cpu_ticks"] - previous["cpu_ticks"]
+                cpu = max(0.0, ticks / _CLK_TCK / (now - previous["at"]) * 100)
+            self._previous[bot_id] = {"root": roots[bot_id], "cpu_ticks": sample["cpu_ticks"], "at": now}
+            metrics[bot_id] = {
+                "cpu_usage": round(cpu, 1),
+                "memory_usage": round(sample["pss_kb"] / 1024, 1),
+                "uptime": format_uptime(sample["uptime"]),
+                "process_count": sample["processes"]
+            }
+
+        for bot_id in list(self._previous):
+            if bot_id not in roots:
+                del self._previous[bot_id]
+
+        self.latest = metrics
+        if metrics and self.manager.db is not None:
+            await self.manager.db.bulk_update_bot_metrics(metrics)
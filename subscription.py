@@ -1,30 +1,96 @@
+import asyncio
+import time
 from datetime import datetime, timedelta
+from pymongo import ReturnDocument
 import config
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 class SubscriptionManager:
     def __init__(self, db):
         self.db = db
+        # user_id -> (monotonic deadline, subscription document or None)
+        self.cache = {}
+        self._sweeper = None
         
     async def get_user_subscription(self, user_id: int):
-        """Get user's subscription status"""
-        subscription = await self.db.db.subscriptions.find_one({"user_id": user_id})
-        
+        """Get user's subscription status (cached, never writes)"""
+        cached = self.cache.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            subscription = cached[1]
+        else:
+            subscription = await self.db.db.subscriptions.find_one({"user_id": user_id})
+            self.cache[user_id] = (self._cache_deadline(subscription), subscription)
+            
         if not subscription:
             return None
             
-        # Check if subscription is still active
-        if subscription['expires_at'] > datetime.utcnow():
-            subscription['active'] = True
-        else:
-            subscription['active'] = False
-            # Update database
-            await self.db.db.subscriptions.update_one(
-                {"user_id": user_id},
-                {"$set": {"active": False}}
-            )
-            
+        # Expiry is decided here; the sweeper persists it in bulk
+        subscription = dict(subscription)
+        subscription['active'] = subscription.get('active', True) and subscription['expires_at'] > datetime.utcnow()
         return subscription
         
+    def _cache_deadline(self, subscription) -> float:
+        """TTL for a cache entry, cut short at the subscription's expiry"""
+        ttl = config.SUBSCRIPTION_CACHE_TTL
+        if subscription and subscription.get('active', True):
+            until_expiry = (subscription['expires_at'] - datetime.utcnow()).total_seconds()
+            if until_expiry > 0:
+                ttl = min(ttl, until_expiry)
+        return time.monotonic() + ttl
+        
+    def invalidate(self, user_id: int):
+        """Drop a user's cached subscription after it changes"""
+        self.cache.pop(user_id, None)
+        self.db.invalidate_snapshot(user_id)
+        
+    def start_expiry_sweeper(self):
+        """Periodically deactivate lapsed subscriptions in bulk"""
+        if self._sweeper is None:
+            self._sweeper = asyncio.ensure_future(self._sweep_forever())
+            
+    def stop_expiry_sweeper(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+            
+    async def _sweep_forever(self):
+        while True:
+            try:
+                await self.sweep_expired()
+            except Exception as e:
+                logger.error(f"Subscription sweep failed: {str(e)}")
+            await asyncio.sleep(config.SUBSCRIPTION_SWEEP_INTERVAL)
+            
+    async def sweep_expired(self) -> int:
+        """Mark every lapsed subscription inactive with one update_many"""
+        now = datetime.utcnow()
+        expired_filter = {"active": True, "expires_at": {"$lte": now}}
+        
+        cursor = self.db.db.subscriptions.find(expired_filter, {"user_id": 1, "plan": 1, "_id": 0})
+        expired = [sub async for sub in cursor]
+        if not expired:
+            return 0
+        user_ids = [sub['user_id'] for sub in expired]
+            
+        await self.db.db.subscriptions.update_many(
+            {"user_id": {"$in": user_ids}, **expired_filter},
+            {"$set": {"active": False}}
+        )
+        
+        inc = {"premium_users": -len(expired)}
+        for sub in expired:
+            key = f"plans.{sub.get('plan', 'unknown')}"
+            inc[key] = inc.get(key, 0) - 1
+        await self.db.bump_stats(inc)
+        
+        for user_id in user_ids:
+            self.invalidate(user_id)
+            
+        logger.info(f"Deactivated {len(user_ids)} expired subscriptions")
+        return len(user_ids)
+        
     async def create_subscription(self, user_id: int, plan: str, duration_days: int):
         """Create a new subscription"""
         expires_at = datetime.utcnow() + timedelta(days=duration_days)
@@ -38,11 +104,15 @@ class SubscriptionManager:
             "auto_renew": False
         }
         
-        await self.db.db.subscriptions.update_one(
+        previous = await self.db.db.subscriptions.find_one_and_update(
             {"user_id": user_id},
             {"$set": subscription_data},
-            upsert=True
+            projection={"_id": 0, "plan": 1, "active": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
         )
+        await self._bump_plan_stats(previous, plan)
+        self.invalidate(user_id)
         
         return subscription_data
         
@@ -55,22 +125,50 @@ class SubscriptionManager:
         else:
             new_expires = datetime.utcnow() + timedelta(days=days)
             
-        await self.db.db.subscriptions.update_one(
+        previous = await self.db.db.subscriptions.find_one_and_update(
             {"user_id": user_id},
             {
                 "$set": {
                     "expires_at": new_expires,
                     "active": True
                 }
-            }
+            },
+            projection={"_id": 0, "plan": 1, "active": 1},
+            return_document=ReturnDocument.BEFORE
         )
+        if previous is not None:
+            await self._bump_plan_stats(previous, previous.get('plan', 'unknown'))
+        self.invalidate(user_id)
         
     async def cancel_subscription(self, user_id: int):
         """Cancel user's subscription"""
-        await self.db.db.subscriptions.update_one(
+        previous = await self.db.db.subscriptions.find_one_and_update(
             {"user_id": user_id},
-            {"$set": {"active": False, "auto_renew": False}}
+            {"$set": {"active": False, "auto_renew": False}},
+            projection={"_id": 0, "plan": 1, "active": 1},
+            return_document=ReturnDocument.BEFORE
         )
+        if previous is not None:
+            await self._bump_plan_stats(previous, None)
+        self.invalidate(user_id)
+        
+    async def _bump_plan_stats(self, previous, new_plan):
+        """Move platform counters from a subscription's old state to new_plan
+        
+        previous is the document before the write (None if it was created);
+        new_plan is the active plan afterwards, or None if now inactive.
+        """
+        inc = {}
+        if previous is None:
+            inc["total_subscriptions"] = 1
+        elif previous.get('active'):
+            inc["premium_users"] = -1
+            inc[f"plans.{previous.get('plan', 'unknown')}"] = -1
+        if new_plan is not None:
+            inc["premium_users"] = inc.get("premium_users", 0) + 1
+            key = f"plans.{new_plan}"
+            inc[key] = inc.get(key, 0) + 1
+        await self.db.bump_stats(inc)
         
     async def check_deployment_limit(self, user_id: int) -> bool:
         """Check if user can deploy more bots"""
@@ -83,21 +181,13 @@ class SubscriptionManager:
             return len(user_bots) < config.MAX_BOTS_FREE
             
     async def get_subscription_stats(self):
-        """Get subscription statistics for admin"""
-        total_subs = await self.db.db.subscriptions.count_documents({})
-        active_subs = await self.db.db.subscriptions.count_documents({"active": True})
+        """Get subscription statistics for admin (materialized counters)"""
+        stats = await self.db.get_total_stats()
         
-        # Get plan breakdown
-        plans = {}
-        cursor = self.db.db.subscriptions.find({"active": True})
-        async for sub in cursor:
-            plan = sub.get('plan', 'unknown')
-            plans[plan] = plans.get(plan, 0) + 1
-            
         return {
-            "total_subscriptions": total_subs,
-            "active_subscriptions": active_subs,
-            "plan_breakdown": plans
+            "total_subscriptions": stats["total_subscriptions"],
+            "active_subscriptions": stats["premium_users"],
+            "plan_breakdown": stats["plans"]
         }
         
     async def get_expiring_subscriptions(self, days: int = 7):
@@ -119,13 +209,15 @@ class SubscriptionManager:
             
         return expiring_subs
         
-    async def notify_expiring_subscriptions(self, bot_application):
-        """Send notifications for expiring subscriptions"""
+    async def notify_expiring_subscriptions(self, broadcaster):
+        """Send notifications for expiring subscriptions through the broadcast engine"""
         expiring = await self.get_expiring_subscriptions(3)  # 3 days warning
-        
+        if not expiring:
+            return None
+            
+        recipients = []
         for sub in expiring:
-            try:
-                message = f"""
+            message = f"""
 🔔 **Subscription Expiring Soon**
 
 Your {sub['plan']} subscription will expire on {sub['expires_at'].strftime('%B %d, %Y')}.
@@ -137,12 +229,7 @@ Your {sub['plan']} subscription will expire on {sub['expires_at'].strftime('%B %
 
 Contact @x_ifeelram to renew your subscription.
                 """
-                
-                await bot_application.bot.send_message(
-                    chat_id=sub['user_id'],
-                    text=message,
-                    parse_mode='Markdown'
-                )
-                
-            except Exception as e:
-                logger.error(f"Failed to notify user {sub['user_id']}: {str(e)}")
+            recipients.append({"chat_id": sub['user_id'], "text": message})
+            
+        broadcast_id = await broadcaster.create(recipients, parse_mode='Markdown')
+        return await broadcaster.run(broadcast_id)
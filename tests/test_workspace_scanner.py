@@ -0,0 +1,39 @@
+import os
+
+from workspace_scanner import scan_manifest, hoist_root
+
+
+def write(root, rel, content=""):
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def test_wrapper_folder_is_detected_as_root(tmp_path):
+    write(tmp_path, "MyBot-main/main.py")
+    write(tmp_path, "MyBot-main/requirements.txt")
+    write(tmp_path, "__MACOSX/._main.py")
+
+    assert scan_manifest(str(tmp_path))["root"] == "MyBot-main"
+
+
+def test_lone_package_is_not_treated_as_wrapper(tmp_path):
+    write(tmp_path, "bot/__init__.py")
+    write(tmp_path, "bot/__main__.py", "from . import core\n")
+    write(tmp_path, "bot/core.py")
+
+    manifest = scan_manifest(str(tmp_path))
+    assert manifest["root"] == ""
+    assert manifest["packages"] == ["bot"]
+
+
+def test_package_inside_wrapper_stops_at_wrapper(tmp_path):
+    write(tmp_path, "Repo-main/bot/__init__.py")
+    write(tmp_path, "Repo-main/bot/__main__.py")
+
+    manifest = scan_manifest(str(tmp_path))
+    assert manifest["root"] == "Repo-main"
+
+    hoist_root(str(tmp_path), manifest["root"])
+    assert sorted(os.listdir(os.path.join(tmp_path, "bot"))) == ["__init__.py", "__main__.py"]
@@ -2,19 +2,68 @@
 Auto-managed encryption key.
 Key is generated on first run (encryption.key) so the owner never
 needs to set it manually.  Users never see the key.
+
+The key file holds one key per line, newest first.  All keys are loaded
+into a MultiFernet once and cached: new ciphertext always uses the first
+key, any listed key can decrypt, so rotation is just prepending a key and
+re-encrypting stored values in the background.
 """
-import os, base64, pathlib
-from cryptography.fernet import Fernet
+import os, base64, hashlib, pathlib, threading
+from cryptography.fernet import Fernet, MultiFernet
 
 _KEY_FILE = "encryption.key"
 
-def _get_fernet() -> Fernet:
+_lock = threading.Lock()
+_fernet = None
+_key_id = None
+
+def _read_keys() -> list:
     if not os.path.exists(_KEY_FILE):
-        key = Fernet.generate_key()
-        pathlib.Path(_KEY_FILE).write_bytes(key)
-    else:
-        key = pathlib.Path(_KEY_FILE).read_bytes()
-    return Fernet(key)
+        return []
+    return [line.strip() for line in pathlib.Path(_KEY_FILE).read_bytes().splitlines() if line.strip()]
+
+def _write_keys(keys: list):
+    tmp = f"{_KEY_FILE}.tmp"
+    pathlib.Path(tmp).write_bytes(b"\n".join(keys) + b"\n")
+    os.chmod(tmp, 0o600)
+    os.replace(tmp, _KEY_FILE)
+
+def _load(keys: list):
+    global _fernet, _key_id
+    _fernet = MultiFernet([Fernet(key) for key in keys])
+    _key_id = hashlib.sha256(keys[0]).hexdigest()[:16]
+
+def _get_fernet() -> MultiFernet:
+    if _fernet is None:
+        with _lock:
+            if _fernet is None:
+                keys = _read_keys()
+                if not keys:
+                    keys = [Fernet.generate_key()]
+                    _write_keys(keys)
+                _load(keys)
+    return _fernet
+
+def current_key_id() -> str:
+    """Short fingerprint of the key new ciphertext is written with"""
+    _get_fernet()
+    return _key_id
+
+def rotate_key() -> str:
+    """Make a fresh key primary, keeping old keys for decryption"""
+    with _lock:
+        keys = [Fernet.generate_key()] + _read_keys()
+        _write_keys(keys)
+        _load(keys)
+    return _key_id
+
+def retire_old_keys():
+    """Drop every key but the primary once nothing is encrypted under them"""
+    with _lock:
+        keys = _read_keys()[:1]
+        if keys:
+            _write_keys(keys)
+            _load(keys)
 
 def encrypt(text: str) -> str:
     f = _get_fernet()
@@ -23,3 +72,8 @@ def encrypt(text: str) -> str:
 def decrypt(token_b64: str) -> str:
     f = _get_fernet()
     return f.decrypt(base64.b64decode(token_b64.encode())).decode()
+
+def reencrypt(token_b64: str) -> str:
+    """Re-encrypt ciphertext from any known key under the primary key"""
+    f = _get_fernet()
+    return base64.b64encode(f.rotate(base64.b64decode(token_b64.encode()))).decode()
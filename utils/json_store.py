@@ -0,0 +1,46 @@
+"""
+Crash-safe JSON files for state owned by the event loop.
+
+State is only ever mutated on the loop; snapshot() copies it there and
+save() writes the copy from a worker thread.  Writes are serialized,
+each goes through its own temp file and a snapshot older than the last
+one written is dropped, so concurrent saves can neither interleave nor
+roll the file back.
+"""
+import copy
+import json
+import os
+import threading
+import uuid
+
+
+class JsonSnapshotFile:
+    def __init__(self, path: str):
+        self.path = path
+        self.generation = 0
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def snapshot(self, data):
+        """Copy data for a later save() (call on the event loop)"""
+        self.generation += 1
+        return copy.deepcopy(data), self.generation
+
+    def save(self, data, generation: int):
+        """Persist a snapshot unless a newer one was already written (blocking)"""
+        with self._lock:
+            if generation <= self._written:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{uuid.uuid4().hex[:8]}.tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                raise
+            self._written = generation
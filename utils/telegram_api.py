@@ -0,0 +1,59 @@
+"""
+Shared HTTP client for outbound Bot API calls.
+
+One keep-alive aiohttp session (with timeouts) is reused for every call,
+and successful getMe results are cached by token hash so repeated
+configure/start flows skip the network.
+"""
+import hashlib, time
+import aiohttp
+import config
+
+class BotApiClient:
+    def __init__(self):
+        self._session = None
+        self._me_cache = {}       # sha256(token) -> (expires_at, bot_info)
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=config.HTTP_POOL_SIZE, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(
+                    total=config.HTTP_TIMEOUT,
+                    connect=config.HTTP_CONNECT_TIMEOUT
+                )
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    @staticmethod
+    def _token_key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    async def call(self, token: str, method: str, **params) -> dict:
+        """Call a Bot API method and return the decoded JSON response"""
+        url = f"{config.TELEGRAM_API_BASE_URL}{token}/{method}"
+        async with self.session().post(url, json=params or None) as response:
+            try:
+                return await response.json(content_type=None)
+            except ValueError:
+                return {"ok": False, "description": f"HTTP error: {response.status}"}
+
+    async def get_me(self, token: str) -> dict:
+        """getMe with a TTL cache; returns the raw API response"""
+        key = self._token_key(token)
+        cached = self._me_cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            return {"ok": True, "result": cached[1]}
+
+        data = await self.call(token, "getMe")
+        if data.get("ok"):
+            now = time.monotonic()
+            # Drop expired entries so the cache only holds tokens seen within the TTL
+            for stale in [k for k, (expires_at, _) in self._me_cache.items() if expires_at <= now]:
+                del self._me_cache[stale]
+            self._me_cache[key] = (now + config.GETME_CACHE_TTL, data["result"])
+        return data
@@ -17,7 +17,26 @@ class BotValidator:
 
 class TokenValidator:
     PATTERN = re.compile(r"^\d{8,10}:[A-Za-z0-9_-]{35}$")
+    SECRET_CHARS = re.compile(r"^[A-Za-z0-9_-]+$")
 
     @classmethod
     def looks_like_token(cls, txt: str) -> bool:
         return bool(cls.PATTERN.match(txt.strip()))
+
+    @classmethod
+    def validate_token_format(cls, token: str) -> Dict[str, Any]:
+        """Check a bot token's shape without any network I/O"""
+        if not token:
+            return {"valid": False, "error": "Token is empty."}
+        if any(c.isspace() for c in token):
+            return {"valid": False, "error": "Token must not contain spaces or line breaks."}
+        bot_id, sep, secret = token.partition(":")
+        if not sep:
+            return {"valid": False, "error": "Token must look like `123456789:ABC...` (missing `:`)."}
+        if not bot_id.isdigit() or not 8 <= len(bot_id) <= 10:
+            return {"valid": False, "error": "The part before `:` must be the 8-10 digit bot ID."}
+        if len(secret) != 35:
+            return {"valid": False, "error": f"The part after `:` must be 35 characters long (got {len(secret)})."}
+        if not cls.SECRET_CHARS.match(secret):
+            return {"valid": False, "error": "The part after `:` may only contain letters, digits, `_` and `-`."}
+        return {"valid": True}
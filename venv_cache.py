@@ -0,0 +1,246 @@
+"""
+Content-addressed cache of Python virtual environments.
+
+Entries are keyed by the normalized requirement set plus the interpreter
+version and live under config.VENV_CACHE_PATH/<key>.  A bot receives its
+own venv as a hard-linked clone of the cached one, so a cache hit costs a
+directory walk instead of a full pip install.
+"""
+import asyncio
+import errno
+import hashlib
+import json
+import os
+import re
+import shutil
+import signal
+import time
+import config
+from utils.json_store import JsonSnapshotFile
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_NAME_RE = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)(.*)$")
+# Lines whose result depends on files next to requirements.txt
+_LOCAL_PREFIXES = ("-e", "--editable", "-r", "--requirement", "-c", "--constraint", ".", "/")
+_COMPLETE_MARKER = ".complete"
+_INDEX_FILE = "index.json"
+
+
+def normalize_requirements(text: str):
+    """Return sorted, normalized requirement lines or None if not cacheable"""
+    lines = set()
+    for raw in text.splitlines():
+        line = raw.split(" #", 1)[0].strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith(_LOCAL_PREFIXES) or "file:" in line:
+            return None
+        match = _NAME_RE.match(line)
+        if match:
+            name = re.sub(r"[-_.]+", "-", match.group(1)).lower()
+            line = name + re.sub(r"\s+", "", match.group(2)).lower()
+        lines.add(line)
+    return sorted(lines)
+
+
+class VenvCache:
+    def __init__(self, root: str = None, max_bytes: int = None):
+        self.root = os.path.abspath(root or config.VENV_CACHE_PATH)
+        self.max_bytes = max_bytes if max_bytes is not None else config.VENV_CACHE_MAX_MB * 1024 * 1024
+        self.index_path = os.path.join(self.root, _INDEX_FILE)
+        self._index_file = JsonSnapshotFile(self.index_path)
+        self.index = self._load_index()
+        self._locks = {}
+        self._interpreter = None
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    async def _save_index(self):
+        await asyncio.to_thread(self._index_file.save, *self._index_file.snapshot(self.index))
+
+    async def interpreter_version(self) -> str:
+        """Version string of the python3 used to build venvs (memoized)"""
+        if self._interpreter is None:
+            process = await asyncio.create_subprocess_exec(
+                "python3", "-c", "import sys; print(sys.version)",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            stdout, _ = await process.communicate()
+            self._interpreter = stdout.decode().strip()
+        return self._interpreter
+
+    async def cache_key(self, req_file: str):
+        """Hash of interpreter version and normalized requirements, or None"""
+        with open(req_file, 'r') as f:
+            requirements = normalize_requirements(f.read())
+        if requirements is None:
+            return None
+        digest = hashlib.sha256((await self.interpreter_version()).encode())
+        digest.update("\n".join(requirements).encode())
+        return digest.hexdigest()[:32]
+
+    async def provision(self, req_file: str, venv_path: str, cwd: str = None):
+        """Give venv_path an environment satisfying req_file"""
+        cwd = cwd or os.path.dirname(req_file)
+        key = await self.cache_key(req_file)
+        if key is None:
+            logger.info(f"Requirements at {req_file} reference local files, installing without cache")
+            return await create_venv(venv_path, req_file, cwd)
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry_path = os.path.join(self.root, key)
+            if not os.path.exists(os.path.join(entry_path, _COMPLETE_MARKER)):
+                logger.info(f"Venv cache miss for {key}, building")
+                await asyncio.to_thread(shutil.rmtree, entry_path, True)
+                result = await create_venv(entry_path, req_file, cwd)
+                if not result["success"]:
+                    await asyncio.to_thread(shutil.rmtree, entry_path, True)
+                    return result
+                open(os.path.join(entry_path, _COMPLETE_MARKER), 'w').close()
+                size = await asyncio.to_thread(tree_size, entry_path)
+                self.index[key] = {"size": size, "last_used": time.time()}
+                await self.evict(keep=key)
+            else:
+                logger.info(f"Venv cache hit for {key}")
+                self.index.setdefault(key, {"size": 0})["last_used"] = time.time()
+
+            await asyncio.to_thread(clone_venv, entry_path, venv_path)
+            await self._save_index()
+
+        return {"success": True, "cache_key": key}
+
+    async def evict(self, keep: str = None):
+        """Drop least recently used entries until the cache fits its budget"""
+        total = sum(entry.get("size", 0) for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k].get("last_used", 0)):
+            if total <= self.max_bytes:
+                break
+            if key == keep or (key in self._locks and self._locks[key].locked()):
+                continue
+            logger.info(f"Evicting venv cache entry {key}")
+            await asyncio.to_thread(shutil.rmtree, os.path.join(self.root, key), True)
+            total -= self.index.pop(key).get("size", 0)
+            self._locks.pop(key, None)
+        await self._save_index()
+
+
+async def create_venv(venv_path: str, req_file: str, cwd: str):
+    """Create a venv at venv_path and pip install req_file into it"""
+    venv_path = os.path.abspath(venv_path)
+    process = await asyncio.create_subprocess_exec(
+        "python3", "-m", "venv", venv_path,
+        cwd=cwd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True
+    )
+
+    stdout, stderr = await communicate(process)
+
+    if process.returncode != 0:
+        return {"success": False, "error": f"Virtual environment creation failed: {stderr.decode()}"}
+
+    return await install_requirements(venv_path, req_file, cwd)
+
+
+async def install_requirements(venv_path: str, req_file: str, cwd: str):
+    """pip install req_file into an existing venv (already satisfied pins are skipped)"""
+    venv_path = os.path.abspath(venv_path)
+    process = await asyncio.create_subprocess_exec(
+        f"{venv_path}/bin/pip", "install", "-r", os.path.abspath(req_file),
+        cwd=cwd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True
+    )
+
+    stdout, stderr = await communicate(process)
+
+    if process.returncode != 0:
+        return {"success": False, "error": f"Pip install failed: {stderr.decode()}"}
+
+    return {"success": True}
+
+
+async def communicate(process):
+    """process.communicate(), killing the process group if the caller is cancelled
+
+    Deploys run under a timeout; without this a cancelled install would
+    leave pip (and any build it spawned) running against a deleted venv.
+    The process must have been started with start_new_session=True.
+    """
+    try:
+        return await process.communicate()
+    finally:
+        if process.returncode is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+
+def clone_venv(src: str, dst: str):
+    """Hard-link src into dst, rewriting absolute paths in bin/ scripts"""
+    src = os.path.abspath(src)
+    dst = os.path.abspath(dst)
+    src_bytes, dst_bytes = src.encode(), dst.encode()
+    bin_dir = os.path.join(src, "bin")
+
+    for dirpath, dirnames, filenames in os.walk(src):
+        target_dir = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in dirnames + filenames:
+            source = os.path.join(dirpath, name)
+            target = os.path.join(target_dir, name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), target)
+                if name in dirnames:
+                    dirnames.remove(name)
+            elif name in dirnames or name == _COMPLETE_MARKER:
+                continue
+            elif dirpath == bin_dir:
+                with open(source, 'rb') as f:
+                    content = f.read()
+                with open(target, 'wb') as f:
+                    f.write(content.replace(src_bytes, dst_bytes))
+                shutil.copymode(source, target)
+            else:
+                _link_or_copy(source, target)
+
+    cfg = os.path.join(dst, "pyvenv.cfg")
+    if os.path.exists(cfg):
+        with open(cfg, 'r') as f:
+            content = f.read()
+        os.unlink(cfg)
+        with open(cfg, 'w') as f:
+            f.write(content.replace(src, dst))
+
+
+def _link_or_copy(source: str, target: str):
+    try:
+        os.link(source, target)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(source, target)
+
+
+def tree_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
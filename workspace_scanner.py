@@ -0,0 +1,206 @@
+"""
+Single-pass workspace manifest scanner.
+
+scan_manifest walks an extracted upload once with os.scandir and records
+every directory listing, file size, Python package and dependency file,
+so bot analysis never touches the filesystem again.  It also finds the
+real project root when the archive wraps everything in one folder (the
+usual "zip the project directory" layout).  Analyses are cached by the
+archive's SHA-256, so re-uploading the same ZIP skips analysis entirely.
+"""
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from collections import OrderedDict
+import config
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Never descend into these; they are build output, not project structure
+_SKIP_DIRS = {"venv", ".venv", "node_modules", "__pycache__", ".git", "__MACOSX"}
+DEPENDENCY_FILES = ("requirements.txt", "package.json", "setup.py", "pyproject.toml", "pom.xml")
+_PACKAGE_MARKERS = ("__init__.py", "__main__.py")
+
+
+def scan_manifest(path: str) -> dict:
+    """Walk path once and describe it
+
+    Returns {"root", "listing", "files", "packages", "dependency_files",
+    "total_size"}; paths are relative to path and root is "" unless the
+    project sits inside wrapping folders.
+    """
+    listing = {}
+    files = {}
+    packages = []
+    dependency_files = []
+    total_size = 0
+
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        names = []
+        try:
+            with os.scandir(os.path.join(path, rel_dir)) as entries:
+                for entry in entries:
+                    rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    names.append(entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in _SKIP_DIRS:
+                            stack.append(rel)
+                    elif entry.is_file(follow_symlinks=False):
+                        size = entry.stat(follow_symlinks=False).st_size
+                        files[rel] = size
+                        total_size += size
+                        if entry.name in DEPENDENCY_FILES:
+                            dependency_files.append(rel)
+        except OSError as e:
+            logger.warning(f"Cannot scan {rel_dir or path}: {str(e)}")
+        listing[rel_dir] = sorted(names)
+        if rel_dir and any(marker in names for marker in _PACKAGE_MARKERS):
+            packages.append(rel_dir)
+
+    return {
+        "root": find_root(listing),
+        "listing": listing,
+        "files": files,
+        "packages": sorted(packages),
+        "dependency_files": sorted(dependency_files),
+        "total_size": total_size
+    }
+
+
+def find_root(listing: dict) -> str:
+    """Descend through folders that are the only meaningful entry of their parent"""
+    root = ""
+    while True:
+        names = [
+            name for name in listing.get(root, [])
+            if not name.startswith(".") and name not in _SKIP_DIRS
+        ]
+        if len(names) != 1:
+            return root
+        child = f"{root}/{names[0]}" if root else names[0]
+        if child not in listing:
+            return root
+        # A lone package is the project itself (run as python -m <name>)
+        if any(marker in listing[child] for marker in _PACKAGE_MARKERS):
+            return root
+        root = child
+
+
+def relative_manifest(manifest: dict) -> dict:
+    """View of a manifest re-based on its detected root"""
+    root = manifest["root"]
+    if not root:
+        return manifest
+    prefix = root + "/"
+
+    def rebase(paths):
+        return [p[len(prefix):] for p in paths if p.startswith(prefix)]
+
+    return {
+        "root": "",
+        "listing": {
+            ("" if d == root else d[len(prefix):]): names
+            for d, names in manifest["listing"].items()
+            if d == root or d.startswith(prefix)
+        },
+        "files": {p[len(prefix):]: s for p, s in manifest["files"].items() if p.startswith(prefix)},
+        "packages": rebase(manifest["packages"]),
+        "dependency_files": rebase(manifest["dependency_files"]),
+        "total_size": manifest["total_size"]
+    }
+
+
+def hoist_root(path: str, root: str):
+    """Move the contents of path/root up to path (blocking)"""
+    if not root:
+        return
+    # Park the outermost wrapper under a unique name first: the project may
+    # contain an entry with the wrapper's own name (e.g. bot/bot/__init__.py)
+    top, _, rest = root.partition("/")
+    parked = os.path.join(path, f".nested-{uuid.uuid4().hex}")
+    os.rename(os.path.join(path, top), parked)
+    source = os.path.join(parked, rest) if rest else parked
+    for name in os.listdir(source):
+        os.rename(os.path.join(source, name), os.path.join(path, name))
+    # Whatever is left is what find_root ignored (.DS_Store, __MACOSX, ...)
+    shutil.rmtree(parked, ignore_errors=True)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def changed_files(source: str, files: dict, target: str) -> list:
+    """Files of source (relative path -> size) whose content differs in target (blocking)
+
+    Sizes are compared first, so only same-size files are hashed.
+    """
+    changed = []
+    for rel, size in files.items():
+        current = os.path.join(target, rel)
+        try:
+            if os.path.getsize(current) == size and file_sha256(current) == file_sha256(os.path.join(source, rel)):
+                continue
+        except OSError:
+            pass
+        changed.append(rel)
+    return sorted(changed)
+
+
+class AnalysisCache:
+    """Bot analyses by archive hash: a small LRU in memory backed by JSON files"""
+
+    def __init__(self, root: str = None, max_entries: int = None):
+        self.root = root or os.path.join(config.BOTS_PATH, ".analysis_cache")
+        self.max_entries = max_entries or config.ANALYSIS_CACHE_SIZE
+        self.entries = OrderedDict()
+
+    def peek(self, archive_hash: str):
+        """Analysis held in memory, or None (call on the event loop)"""
+        if archive_hash in self.entries:
+            self.entries.move_to_end(archive_hash)
+            return self.entries[archive_hash]
+        return None
+
+    def load(self, archive_hash: str):
+        """Read an analysis from disk, or None; remember() it on the loop (blocking)"""
+        try:
+            with open(os.path.join(self.root, f"{archive_hash}.json"), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def remember(self, archive_hash: str, analysis: dict):
+        """Keep an analysis in memory (call on the event loop)"""
+        self.entries[archive_hash] = analysis
+        self.entries.move_to_end(archive_hash)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self, archive_hash: str, analysis: dict):
+        """Write an analysis to disk (blocking)"""
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = os.path.join(self.root, f"{archive_hash}.json.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(analysis, f)
+        os.replace(tmp_path, os.path.join(self.root, f"{archive_hash}.json"))
+        self._prune_disk()
+
+    def _prune_disk(self):
+        with os.scandir(self.root) as entries:
+            cached = [(e.stat().st_mtime, e.path) for e in entries if e.name.endswith(".json")]
+        if len(cached) > self.max_entries:
+            for _, stale in sorted(cached)[:len(cached) - self.max_entries]:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass